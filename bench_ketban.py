@@ -0,0 +1,716 @@
+"""Đo hiệu năng ketban.py.
+
+    python bench_ketban.py users                 # user.xlsx
+    python bench_ketban.py users --rows 1000000  # dữ liệu tổng hợp 1M dòng
+    python bench_ketban.py service --requests 2000 --concurrency 16
+    python bench_ketban.py batch --profiles 5000 --workers 0,1,2,4
+    python bench_ketban.py suite --sizes 1000,10000,100000,1000000 --out before.json
+    python bench_ketban.py compare before.json after.json
+    python bench_ketban.py memory --rows 200000   # bộ nhớ graph: thường vs compact
+    python bench_ketban.py lsh --rows 200000 --configs 8x2,16x2,32x1   # LSH vs chấm điểm chính xác
+    python bench_ketban.py classes               # lớp tương đương theo chữ ký đặc trưng (user.xlsx)
+    python bench_ketban.py startup               # thời gian import + tới gợi ý đầu tiên (tiến trình mới)
+    python bench_ketban.py fuzzy --typo-rate 0.05   # chuẩn hoá gõ sai chính tả trên user.xlsx
+    python bench_ketban.py topk --workers 0,1,4  # bảng top-k tính trước cho mọi user (ketban_topk.py)
+"""
+import argparse
+import contextlib
+import gc
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+import ketban
+import ketban_batch
+import ketban_graph
+import ketban_topk
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_FIRST = ["An", "Bình", "Chi", "Dũng", "Hà", "Hải", "Hoa", "Khải", "Lan", "Minh", "Nam", "Nga", "Phúc", "Quân", "Tâm"]
+_LAST = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Phan", "Vũ", "Đặng", "Bùi", "Đỗ"]
+_RAW_LOCATIONS = ["Hà Nội", "HN", "ha noi", "TP.HCM", "Hồ Chí Minh", "sai gon", "Đà Nẵng", "Cần Thơ", "Huế", "Vĩnh Long"]
+_RAW_INDUSTRIES = ["IT", "cntt", "Kế toán", "Bác sĩ", "Sinh viên", "data science", "Luật sư", "Nhiếp ảnh", None]
+_RAW_INTERESTS = [it for items in ketban.DEFAULT_INTEREST_GROUPS.values() for it in items] + ["gym", "chay bo", "doc sach"]
+
+
+def synthetic_dataframe(n_rows, seed=0, interest_density=2.5, friend_degree=4.0, location_skew=0.0,
+                        locations=None):
+    """DataFrame ngẫu nhiên cùng schema với user.xlsx (có cả giá trị viết tắt/thiếu dấu).
+
+    interest_density: số sở thích trung bình mỗi user (>= 1).
+    friend_degree: số id trong "Bạn chung (ID)" trung bình mỗi user (Poisson).
+    location_skew: số mũ Zipf của phân bố nơi ở (0 = đều; càng lớn càng dồn vào vài nơi đầu danh sách).
+    locations: danh sách nơi ở thô (mặc định _RAW_LOCATIONS).
+    """
+    rnd = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    locations = list(locations or _RAW_LOCATIONS)
+    weights = 1.0 / np.arange(1, len(locations) + 1) ** location_skew
+    loc_idx = rng.choice(len(locations), size=n_rows, p=weights / weights.sum()).tolist()
+    n_interests = np.clip(1 + rng.poisson(max(interest_density - 1, 0), n_rows), 1, len(_RAW_INTERESTS)).tolist()
+    n_friends = rng.poisson(friend_degree, n_rows)
+    friend_ids = rng.integers(1, n_rows + 1, int(n_friends.sum())).astype(str).tolist()
+    friend_ends = np.cumsum(n_friends).tolist()
+
+    rows = []
+    start = 0
+    for i in range(n_rows):
+        friends = friend_ids[start:friend_ends[i]]
+        start = friend_ends[i]
+        rows.append({
+            'Số thứ tự': i + 1,
+            'Họ và tên': f"{rnd.choice(_LAST)} {rnd.choice(_FIRST)}",
+            'Ngày sinh': f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/{rnd.randint(1980, 2006)}",
+            'Giới tính': rnd.choice(["Nam", "Nữ"]),
+            'Sở thích': "; ".join(rnd.sample(_RAW_INTERESTS, n_interests[i])),
+            'Nơi ở': locations[loc_idx[i]],
+            'Tình trạng hôn nhân': rnd.choice(["Độc thân", "Hẹn hò", "Đã kết hôn", None]),
+            'Lĩnh vực/ngành nghề': rnd.choice(_RAW_INDUSTRIES),
+            'Bạn chung (ID)': ", ".join(friends) if friends else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def _user_fields(u):
+    return (u.id, u.name, u.dob, u.gender, u.location, u.industry, u.industry_group,
+            u.marital, tuple(u.interests), tuple(u.friends_ids))
+
+
+def bench_users(df, row_sample):
+    """So sánh User.from_row (từng dòng) với User.from_dataframe (theo cột).
+
+    Với dữ liệu lớn, bản từng dòng chỉ chạy trên row_sample dòng đầu rồi ngoại suy.
+    """
+    ketban.NORMALIZER = ketban.DataNormalizer(
+        known_locations=df['Nơi ở'].dropna().astype(str).unique().tolist())
+
+    t = time.perf_counter()
+    bulk = ketban.User.from_dataframe(df)
+    t_bulk = time.perf_counter() - t
+
+    sample = df.iloc[:row_sample] if row_sample else df
+    t = time.perf_counter()
+    per_row = [ketban.User.from_row(r) for _, r in sample.iterrows()]
+    t_row = (time.perf_counter() - t) * len(df) / max(len(sample), 1)
+
+    same = [_user_fields(u) for u in bulk[:len(per_row)]] == [_user_fields(u) for u in per_row]
+    extrapolated = " (ngoại suy)" if len(sample) < len(df) else ""
+    print(f"rows={len(df)}  from_row={t_row:.2f}s{extrapolated}  from_dataframe={t_bulk:.2f}s  "
+          f"speedup={t_row / t_bulk:.1f}x  identical={same}")
+    return same
+
+
+def random_profile(rnd):
+    """Hồ sơ ngẫu nhiên theo các trường của get_input."""
+    return {
+        "name": f"{rnd.choice(_LAST)} {rnd.choice(_FIRST)}",
+        "dob": f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/{rnd.randint(1980, 2006)}",
+        "gender": rnd.choice(["Nam", "Nữ"]),
+        "location": rnd.choice(_RAW_LOCATIONS),
+        "industry": rnd.choice(_RAW_INDUSTRIES) or "-",
+        "interests": "; ".join(rnd.sample(_RAW_INTERESTS, rnd.randint(1, 4))),
+        "marital": rnd.choice(["Độc thân", "Hẹn hò", "Đã kết hôn"]),
+    }
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def _start_service(workers):
+    """Chạy ketban_service.py ở tiến trình riêng trên cổng trống, chờ tới khi sẵn sàng."""
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "ketban_service.py"), "--data", HERE,
+                             "--port", str(port), "--workers", str(workers)],
+                            stdout=subprocess.PIPE, text=True)
+    for line in proc.stdout:
+        if "Đang phục vụ" in line:
+            break
+    else:
+        raise RuntimeError("ketban_service.py không khởi động được")
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def bench_service(url, n_requests, concurrency, seed=0):
+    """Bắn n_requests hồ sơ ngẫu nhiên với `concurrency` client song song; đo throughput, p50/p99."""
+    target = urlparse(url)
+    rnd = random.Random(seed)
+    bodies = [json.dumps(random_profile(rnd), ensure_ascii=False).encode("utf-8") for _ in range(n_requests)]
+
+    def one(body):
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+        t = time.perf_counter()
+        try:
+            conn.request("POST", "/recommend", body, {"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            resp.read()
+            return time.perf_counter() - t, resp.status
+        finally:
+            conn.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, bodies))
+    wall = time.perf_counter() - start
+
+    lat = sorted(r[0] * 1000 for r in results)
+    errors = sum(1 for r in results if r[1] != 200)
+    print(f"requests={n_requests} concurrency={concurrency} errors={errors}  "
+          f"throughput={n_requests / wall:.1f} req/s  p50={_percentile(lat, 0.5):.1f}ms  "
+          f"p99={_percentile(lat, 0.99):.1f}ms  max={lat[-1]:.1f}ms")
+
+
+def bench_batch(n_profiles, worker_counts, chunksize, seed=0):
+    """ketban_batch.run_batch với số worker khác nhau trên cùng tập hồ sơ ngẫu nhiên (0 = không pool)."""
+    users, l_m, b_r, i_g = ketban.load_users(HERE)
+    graph = ketban.SocialGraph(users, l_m, b_r, i_g)
+    rnd = random.Random(seed)
+    profiles = [random_profile(rnd) for _ in range(n_profiles)]
+    with tempfile.TemporaryDirectory() as tmp:
+        base = None
+        for workers in worker_counts:
+            out = os.path.join(tmp, f"out{workers}.jsonl")
+            t = time.perf_counter()
+            ketban_batch.run_batch(graph, profiles, out, workers, chunksize=chunksize)
+            dt = time.perf_counter() - t
+            base = base or dt
+            print(f"workers={workers}  {dt:.2f}s  {n_profiles / dt:.1f} hồ sơ/s  speedup={base / dt:.2f}x")
+
+
+def bench_memory(n_rows, seed=0, queries=3):
+    """Bộ nhớ Python (tracemalloc) của users và SocialGraph ở chế độ thường / compact,
+    kèm thời gian add_new_user + run_bfs (đo khi đã tắt tracemalloc)."""
+    with open(os.path.join(HERE, "ketban.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    l_m, b_r, i_g = config.get("locations", {}), config.get("bonus_config", []), config.get("interest_groups", {})
+    df = synthetic_dataframe(n_rows, seed, location_skew=1.0, locations=list(dict.fromkeys(_RAW_LOCATIONS + list(l_m))))
+    ketban.NORMALIZER = ketban.DataNormalizer(known_locations=df['Nơi ở'].dropna().astype(str).unique().tolist())
+    gc.collect()
+    tracemalloc.start()
+    users = ketban.User.from_dataframe(df)
+    print(f"users: {tracemalloc.get_traced_memory()[0] / 2 ** 20:.1f}MB ({n_rows} dòng)")
+    tracemalloc.stop()
+    del df
+
+    for compact in (False, True):
+        gc.collect()
+        tracemalloc.start()
+        graph = ketban.SocialGraph(users, l_m, b_r, i_g, compact=compact)
+        built = tracemalloc.get_traced_memory()[0]
+        graph.reverse_adj()
+        with_rev = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        rnd = random.Random(seed)
+        t = time.perf_counter()
+        for q in range(queries):
+            me = ketban.user_from_profile(random_profile(rnd), uid=f"BENCH_{q}")
+            graph.add_new_user(me)
+            ketban.run_bfs(graph, me.id)
+        dt = (time.perf_counter() - t) / queries
+        print(f"compact={compact!s:<5}  graph={built / 2 ** 20:7.1f}MB  +reverse_adj={with_rev / 2 ** 20:7.1f}MB  "
+              f"add_new_user+run_bfs={dt * 1e3:.0f}ms")
+        del graph
+
+
+def bench_lsh(n_rows, configs, tokens=("interest",), queries=50, k=30, max_candidates=None, seed=0):
+    """InterestLSH với từng cấu hình (bands, rows) so với top_k chính xác trên cùng các hồ sơ ngẫu nhiên.
+
+    recall@k = tỉ lệ kết quả LSH có điểm >= điểm thứ k của top_k chính xác (hoà điểm coi như trúng).
+    """
+    with open(os.path.join(HERE, "ketban.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    l_m, b_r, i_g = config.get("locations", {}), config.get("bonus_config", []), config.get("interest_groups", {})
+    df = synthetic_dataframe(n_rows, seed, location_skew=1.0, locations=list(dict.fromkeys(_RAW_LOCATIONS + list(l_m))))
+    ketban.NORMALIZER = ketban.DataNormalizer(known_locations=df['Nơi ở'].dropna().astype(str).unique().tolist())
+    graph = ketban.SocialGraph(ketban.User.from_dataframe(df), l_m, b_r, i_g)
+    del df
+    graph.friend_matrix()
+    rnd = random.Random(seed)
+    profiles = []
+    for q in range(queries):
+        me = ketban.user_from_profile(random_profile(rnd), uid=f"BENCH_{q}")
+        graph._encode_user(me, register=False)
+        profiles.append((me, graph.strong_neighbor_ids(me)))
+
+    t = time.perf_counter()
+    exact = [graph.top_k(me, k, strong) for me, strong in profiles]
+    exact_ms = (time.perf_counter() - t) / queries * 1e3
+    print(f"n={n_rows} k={k} tokens={','.join(tokens)}  chính xác: {exact_ms:.2f}ms/truy vấn")
+    for bands, rows in configs:
+        t = time.perf_counter()
+        lsh = ketban.InterestLSH(graph._features, bands, rows, tokens, max_candidates)
+        build = time.perf_counter() - t
+        hits, candidates, spent = [], 0, 0.0
+        for (me, strong), ex in zip(profiles, exact):
+            t = time.perf_counter()
+            rows_ = lsh.candidates(me)
+            approx = graph.top_k(me, k, strong, rows_)
+            spent += time.perf_counter() - t
+            candidates += len(rows_)
+            if ex:
+                kth = ex[-1][1]
+                hits.append(sum(1 for _, s in approx if s >= kth) / len(ex))
+        recall = sum(hits) / len(hits) if hits else 1.0
+        print(f"  {bands:>3}x{rows:<2} dựng {build:6.2f}s  candidate {candidates / queries:9.0f} "
+              f"({candidates / queries / n_rows:6.1%})  {spent / queries * 1e3:7.2f}ms/truy vấn  recall@{k}={recall:.3f}")
+
+
+def _bench_graph(n_rows=0, seed=0):
+    """SocialGraph trên user.xlsx (n_rows=0) hoặc n_rows dòng tổng hợp."""
+    with contextlib.redirect_stdout(sys.stderr):
+        if n_rows:
+            with open(os.path.join(HERE, "ketban.json"), encoding="utf-8") as f:
+                config = json.load(f)
+            l_m, b_r, i_g = (config.get("locations", {}), config.get("bonus_config", []),
+                             config.get("interest_groups", {}))
+            df = synthetic_dataframe(n_rows, seed, location_skew=1.0)
+            ketban.NORMALIZER = ketban.DataNormalizer(
+                known_locations=df['Nơi ở'].dropna().astype(str).unique().tolist())
+            users = ketban.User.from_dataframe(df)
+            del df
+        else:
+            users, l_m, b_r, i_g = ketban.load_users(HERE)
+        return ketban.SocialGraph(users, l_m, b_r, i_g)
+
+
+def bench_classes(n_rows=0, queries=5, seed=0):
+    """Thống kê ProfileClasses và thời gian run_bfs / run_dfs / score_all khi chấm theo lớp vs theo từng user.
+
+    n_rows=0: dùng user.xlsx. Chấm theo lớp chỉ bật khi cỡ lớp trung bình >= PROFILE_CLASS_MIN_MEAN;
+    ở đây đo cả 2 cách bất kể ngưỡng.
+    """
+    graph = _bench_graph(n_rows, seed)
+    stats = graph.profile_classes().stats()
+    print(f"n={stats['users']}  lớp={stats['classes']}  cỡ TB={stats['mean_size']:.2f}  lớn nhất={stats['max_size']}  "
+          f"lớp 1 user={stats['singletons']}  user thuộc lớp >= 2={stats['users_in_shared']} "
+          f"({stats['users_in_shared'] / max(stats['users'], 1):.1%})  "
+          f"-> {'theo lớp' if graph.profile_classes().shared else 'theo từng user'}")
+
+    rnd = random.Random(seed)
+    starts = []
+    for q in range(queries):
+        me = ketban.user_from_profile(random_profile(rnd), uid=f"BENCH_{q}")
+        graph.add_new_user(me)
+        starts.append(me)
+    graph.friend_matrix()
+    graph.components()
+    ketban.run_bfs(graph, starts[0].id)   # làm nóng (bộ nhớ đệm, cấu trúc dựng khi cần)
+    default = ketban_graph.PROFILE_CLASS_MIN_MEAN
+    results = {}
+    try:
+        for label, min_mean in (("theo từng user", float("inf")), ("theo lớp", 0.0)):
+            ketban_graph.PROFILE_CLASS_MIN_MEAN = min_mean
+            row = results[label] = {}
+            for name, fn in (("run_bfs", lambda me: ketban.run_bfs(graph, me.id)),
+                             ("run_dfs", lambda me: ketban.run_dfs(graph, me.id)),
+                             ("score_all", lambda me: graph.score_all(me))):
+                t = time.perf_counter()
+                out = [fn(me) for me in starts]
+                row[name] = ((time.perf_counter() - t) / queries * 1e3,
+                             [[(r["user"].id, r["score"]) for r in o] if isinstance(o, list) else o.tolist()
+                              for o in out])
+    finally:
+        ketban_graph.PROFILE_CLASS_MIN_MEAN = default
+    base, cls = results["theo từng user"], results["theo lớp"]
+    for name in base:
+        same = "giống hệt" if base[name][1] == cls[name][1] else "KHÁC"
+        print(f"  {name:<10} theo từng user {base[name][0]:9.2f}ms  theo lớp {cls[name][0]:9.2f}ms  "
+              f"x{base[name][0] / max(cls[name][0], 1e-9):.2f}  kết quả {same}")
+
+
+def _typo(rnd, text):
+    """Bỏ dấu rồi thêm 1 lỗi gõ (xoá / lặp / thay 1 ký tự) vào 1 từ đủ dài."""
+    text = ketban._strip_accents(text)
+    spots = [i for i, ch in enumerate(text) if ch.isalpha()]
+    if len(spots) < 4:
+        return text
+    i = rnd.choice(spots[1:])
+    op = rnd.randrange(3)
+    if op == 0:
+        return text[:i] + text[i + 1:]
+    if op == 1:
+        return text[:i] + text[i] + text[i:]
+    return text[:i] + rnd.choice("aeioun") + text[i + 1:]
+
+
+def bench_fuzzy(typo_rate=0.05, seed=0):
+    """Thêm lỗi gõ vào typo_rate số ô Nơi ở / Lĩnh vực / Sở thích của user.xlsx, rồi so User.from_dataframe
+    khi tắt/bật so khớp gần đúng: thời gian và tỉ lệ ô lỗi được đưa về đúng giá trị chuẩn như bản sạch.
+
+    Nơi ở đã biết lấy từ dữ liệu sạch (nơi ở trong chính dữ liệu luôn được coi là tên chuẩn).
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        df, loc_map, _, _ = ketban.load_data(HERE)
+    known = df['Nơi ở'].dropna().astype(str).unique().tolist()
+    ketban.NORMALIZER = ketban.DataNormalizer(known_locations=known, valid_locations=loc_map)
+    clean = ketban.User.from_dataframe(df)
+
+    rnd = random.Random(seed)
+    dirty = df.copy()
+    touched = {}
+    for col in ('Nơi ở', 'Lĩnh vực/ngành nghề', 'Sở thích'):
+        values = dirty[col].tolist()
+        rows = [i for i, v in enumerate(values) if isinstance(v, str) and rnd.random() < typo_rate]
+        for i in rows:
+            if col == 'Sở thích':
+                parts = values[i].split(";")
+                j = rnd.randrange(len(parts))
+                parts[j] = _typo(rnd, parts[j])
+                values[i] = ";".join(parts)
+            else:
+                values[i] = _typo(rnd, values[i])
+        dirty[col] = values
+        touched[col] = rows
+    fields = {'Nơi ở': "location", 'Lĩnh vực/ngành nghề': "industry", 'Sở thích': "interests"}
+    print(f"rows={len(df)}  ô có lỗi gõ: " + ", ".join(f"{col}={len(r)}" for col, r in touched.items()))
+    for fuzzy in (False, True):
+        ketban._fixed_fuzzy_index.cache_clear()
+        ketban.NORMALIZER = ketban.DataNormalizer(known_locations=known, fuzzy=fuzzy, valid_locations=loc_map)
+        t = time.perf_counter()
+        users = ketban.User.from_dataframe(dirty)
+        elapsed = time.perf_counter() - t
+        fixed = {col: sum(getattr(users[i], fields[col]) == getattr(clean[i], fields[col]) for i in rows)
+                 / max(len(rows), 1) for col, rows in touched.items()}
+        print(f"  fuzzy={'bật' if fuzzy else 'tắt'}  from_dataframe={elapsed:.3f}s  đưa về đúng: " +
+              ", ".join(f"{col}={v:.1%}" for col, v in fixed.items()))
+
+
+def bench_topk(n_rows=0, sample=300, workers=(0,), chunk_rows=1024, k=30, seed=0):
+    """Bảng top-k tính trước (ketban_topk): chấm theo khối vs SocialGraph.top_k từng user trên `sample` user,
+    thời gian dựng cả bảng theo số tiến trình, và thời gian tra 1 user trong bảng."""
+    graph = _bench_graph(n_rows, seed)
+    ids = graph.row_ids()
+    rows = np.array(sorted(random.Random(seed).sample(range(len(ids)), min(sample, len(ids)))))
+    ga = ketban.GraphArrays.from_graph(graph)
+    ga.top_k_rows(rows[:1], k)   # làm nóng (dựng _BlockScorer)
+    t = time.perf_counter()
+    for r in rows.tolist():
+        graph.top_k(graph.users[ids[r]], k)
+    loop = (time.perf_counter() - t) / len(rows)
+    t = time.perf_counter()
+    ga.top_k_rows(rows, k)
+    block = (time.perf_counter() - t) / len(rows)
+    print(f"n={len(ids)}  top_k từng user={loop * 1e3:.2f}ms/user  theo khối={block * 1e3:.2f}ms/user "
+          f"(x{loop / max(block, 1e-12):.1f})")
+    with tempfile.TemporaryDirectory() as folder:
+        for w in workers:
+            out = os.path.join(folder, f"w{w}")
+            t = time.perf_counter()
+            ketban_topk.build_table(graph, out, k, workers=w, chunk_rows=chunk_rows)
+            elapsed = time.perf_counter() - t
+            print(f"  workers={w}  dựng bảng={elapsed:.1f}s ({len(ids) / elapsed:.0f} user/s)")
+        table = ketban_topk.TopKTable(out)
+        size = sum(os.path.getsize(os.path.join(out, f)) for f in os.listdir(out))
+        t = time.perf_counter()
+        for uid in ids:
+            table.lookup(uid)
+        print(f"  bảng {size / 2 ** 20:.1f} MB  tra 1 user={(time.perf_counter() - t) / len(ids) * 1e6:.1f}µs")
+        del table
+
+
+_STARTUP_SCRIPT = """
+import contextlib, json, sys, time
+t0 = time.perf_counter()
+import ketban
+t1 = time.perf_counter()
+with contextlib.redirect_stdout(sys.stderr):
+    users, l_m, b_r, i_g = ketban.load_users(sys.argv[1])
+t2 = time.perf_counter()
+graph = ketban.SocialGraph(users, l_m, b_r, i_g)
+t3 = time.perf_counter()
+me = ketban.user_from_profile({"name": "An", "location": "HN", "interests": "Yoga; doc sach", "industry": "IT"})
+ketban.recommend(graph, me, 30)
+t4 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "load_users": t2 - t1, "graph": t3 - t2, "recommend": t4 - t3,
+                  "first_recommendation": t4 - t0, "pandas": "pandas" in sys.modules,
+                  "openpyxl": "openpyxl" in sys.modules}))
+"""
+
+
+def bench_startup(runs=5, folder=HERE):
+    """Mỗi lần chạy 1 tiến trình Python mới: import ketban -> load_users (snapshot) -> SocialGraph -> recommend.
+
+    Lần đầu (không tính) dựng snapshot nếu chưa có. In trung vị từng giai đoạn.
+    """
+    cmd = [sys.executable, "-c", _STARTUP_SCRIPT, folder]
+    subprocess.run(cmd, cwd=HERE, capture_output=True, check=True)
+    rows = [json.loads(subprocess.run(cmd, cwd=HERE, capture_output=True, text=True, check=True).stdout)
+            for _ in range(runs)]
+    for phase in ("import", "load_users", "graph", "recommend", "first_recommendation"):
+        print(f"  {phase:<22} {float(np.median([r[phase] for r in rows])) * 1e3:9.1f}ms")
+    print(f"  pandas đã import: {rows[-1]['pandas']}  openpyxl đã import: {rows[-1]['openpyxl']}")
+
+
+# ---- Bộ benchmark theo kích thước dữ liệu (kết quả JSON để so giữa các commit) ----
+
+SUITE_PHASES = ("load_data", "user_construction", "graph_init", "friend_matrix", "landmarks",
+                "calculate_score", "add_new_user", "run_bfs", "run_dfs", "run_astar")
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class _PhaseTimes:
+    """Gom thời gian từng lần gọi theo (n_users, phase)."""
+
+    def __init__(self):
+        self.rows = []
+
+    @contextlib.contextmanager
+    def measure(self, n_users, phase, calls=1):
+        t = time.perf_counter()
+        yield
+        self.add(n_users, phase, [time.perf_counter() - t], calls)
+
+    def add(self, n_users, phase, durations, calls=None):
+        total = sum(durations)
+        calls = calls or len(durations)
+        self.rows.append({"n_users": n_users, "phase": phase, "calls": calls,
+                          "seconds": round(total, 6), "mean_s": total / calls, "max_s": max(durations)})
+        print(f"  n={n_users:<8} {phase:<18} {total:9.3f}s  calls={calls:<7} mean={total / calls * 1e3:.4f}ms",
+              file=sys.stderr)
+
+
+def bench_suite(sizes, interest_density=2.5, friend_degree=4.0, location_skew=1.0, queries=5,
+                score_pairs=100000, load_max=100000, seed=0, bfs_budget=None):
+    """Đo các giai đoạn của ketban trên dữ liệu tổng hợp cho từng kích thước; trả về dict kết quả.
+
+    load_data (ghi rồi đọc lại .xlsx) chỉ đo khi n <= load_max vì riêng việc ghi file đã rất lâu.
+    add_new_user / run_bfs / run_dfs / run_astar đo trên `queries` user mới, A* tới user điểm cao nhất của BFS.
+    bfs_budget: dict giới hạn cho run_bfs (max_depth / max_nodes / time_budget).
+    """
+    with open(os.path.join(HERE, "ketban.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    l_m, b_r, i_g = config.get("locations", {}), config.get("bonus_config", []), config.get("interest_groups", {})
+    locations = list(dict.fromkeys(_RAW_LOCATIONS + list(l_m)))
+    times = _PhaseTimes()
+
+    for n in sizes:
+        df = synthetic_dataframe(n, seed, interest_density, friend_degree, location_skew, locations)
+
+        if n <= load_max:
+            with tempfile.TemporaryDirectory() as tmp:
+                df.to_excel(os.path.join(tmp, "user.xlsx"), index=False, engine="openpyxl")
+                with open(os.path.join(tmp, "ketban.json"), "w", encoding="utf-8") as f:
+                    json.dump(config, f, ensure_ascii=False)
+                with times.measure(n, "load_data"), contextlib.redirect_stdout(sys.stderr):
+                    ketban.load_data(tmp)
+
+        ketban.NORMALIZE_CACHE.clear()
+        with times.measure(n, "user_construction"):
+            ketban.NORMALIZER = ketban.DataNormalizer(
+                known_locations=df['Nơi ở'].dropna().astype(str).unique().tolist())
+            users = ketban.User.from_dataframe(df)
+        del df
+
+        with times.measure(n, "graph_init"):
+            graph = ketban.SocialGraph(users, l_m, b_r, i_g)
+        with times.measure(n, "friend_matrix"):
+            graph.friend_matrix()
+        with times.measure(n, "landmarks"):
+            graph.landmarks()
+
+        rnd = random.Random(seed)
+        ids = list(graph.users)
+        pairs = [(graph.users[rnd.choice(ids)], graph.users[rnd.choice(ids)]) for _ in range(score_pairs)]
+        with times.measure(n, "calculate_score", calls=len(pairs)):
+            for a, b in pairs:
+                graph.calculate_score(a, b)
+        del pairs
+
+        spent = {phase: [] for phase in ("add_new_user", "run_bfs", "run_dfs", "run_astar")}
+        for q in range(queries):
+            me = ketban.user_from_profile(random_profile(rnd), uid=f"BENCH_{q}")
+            t = time.perf_counter()
+            graph.add_new_user(me)
+            spent["add_new_user"].append(time.perf_counter() - t)
+            t = time.perf_counter()
+            bfs = ketban.run_bfs(graph, me.id, **(bfs_budget or {}))
+            spent["run_bfs"].append(time.perf_counter() - t)
+            t = time.perf_counter()
+            ketban.run_dfs(graph, me.id)
+            spent["run_dfs"].append(time.perf_counter() - t)
+            if bfs:
+                goal = max(bfs, key=lambda r: r['score'])['user'].id
+                t = time.perf_counter()
+                ketban.run_astar(graph, me.id, goal)
+                spent["run_astar"].append(time.perf_counter() - t)
+        for phase, durations in spent.items():
+            if durations:
+                times.add(n, phase, durations)
+        del graph, users
+
+    return {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": {"sizes": list(sizes), "interest_density": interest_density, "friend_degree": friend_degree,
+                       "location_skew": location_skew, "queries": queries, "score_pairs": score_pairs,
+                       "load_max": load_max, "seed": seed, "bfs_budget": bfs_budget or {}},
+        },
+        "results": times.rows,
+    }
+
+
+def compare_results(base, new, threshold=0.10):
+    """In tỉ lệ mean_s mới/cũ theo (n_users, phase); trả về số giai đoạn chậm đi quá threshold."""
+    old = {(r["n_users"], r["phase"]): r for r in base["results"]}
+    print(f"{base['meta'].get('revision')} -> {new['meta'].get('revision')}")
+    regressions = 0
+    for r in new["results"]:
+        b = old.get((r["n_users"], r["phase"]))
+        if b is None:
+            continue
+        ratio = r["mean_s"] / b["mean_s"] if b["mean_s"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  CHẬM HƠN"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = "  nhanh hơn"
+        print(f"n={r['n_users']:<8} {r['phase']:<18} {b['mean_s'] * 1e3:10.3f}ms -> "
+              f"{r['mean_s'] * 1e3:10.3f}ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("users", help="tạo User: từng dòng vs theo cột")
+    p.add_argument("--rows", type=int, default=0, help="số dòng tổng hợp (0 = dùng user.xlsx)")
+    p.add_argument("--row-sample", type=int, default=50000,
+                   help="số dòng tối đa chạy bản từng dòng (còn lại ngoại suy)")
+    p = sub.add_parser("service", help="tải giả lập lên ketban_service.py")
+    p.add_argument("--url", help="dịch vụ đang chạy (mặc định: tự khởi động với user.xlsx)")
+    p.add_argument("--requests", type=int, default=1000)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--workers", type=int, default=8, help="số worker khi tự khởi động dịch vụ")
+    p = sub.add_parser("batch", help="ketban_batch: thông lượng theo số tiến trình")
+    p.add_argument("--profiles", type=int, default=2000)
+    p.add_argument("--workers", default="0,1,2,4", help="danh sách số worker, cách nhau bởi dấu phẩy")
+    p.add_argument("--chunksize", type=int, default=64)
+    p = sub.add_parser("suite", help="đo các giai đoạn theo kích thước dữ liệu tổng hợp, xuất JSON")
+    p.add_argument("--sizes", default="1000,10000,100000,1000000")
+    p.add_argument("--interest-density", type=float, default=2.5, help="số sở thích trung bình mỗi user")
+    p.add_argument("--friend-degree", type=float, default=4.0, help="số bạn trung bình mỗi user")
+    p.add_argument("--location-skew", type=float, default=1.0, help="số mũ Zipf của nơi ở (0 = đều)")
+    p.add_argument("--queries", type=int, default=5, help="số user mới cho add_new_user/BFS/DFS/A*")
+    p.add_argument("--score-pairs", type=int, default=100000, help="số cặp ngẫu nhiên cho calculate_score")
+    p.add_argument("--load-max", type=int, default=100000, help="chỉ đo load_data khi số user <= giá trị này")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--bfs-budget", default="", help='giới hạn run_bfs, vd. "max_depth=3,time_budget=0.2"')
+    p.add_argument("--out", help="file JSON kết quả (mặc định: stdout)")
+    p = sub.add_parser("memory", help="bộ nhớ SocialGraph: chế độ thường vs compact")
+    p.add_argument("--rows", type=int, default=200000)
+    p.add_argument("--queries", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("lsh", help="InterestLSH: recall và tốc độ so với chấm điểm chính xác")
+    p.add_argument("--rows", type=int, default=200000)
+    p.add_argument("--configs", default="8x2,16x2,32x1,16x3", help="các cấu hình BANDSxROWS")
+    p.add_argument("--tokens", default="interest", help="interest,industry,location")
+    p.add_argument("--queries", type=int, default=50)
+    p.add_argument("--k", type=int, default=30)
+    p.add_argument("--max-candidates", type=int, default=None)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("classes", help="ProfileClasses: thống kê cỡ lớp, chấm theo lớp vs theo từng user")
+    p.add_argument("--rows", type=int, default=0, help="số dòng tổng hợp (0 = dùng user.xlsx)")
+    p.add_argument("--queries", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("startup", help="thời gian import ketban và tới gợi ý đầu tiên (tiến trình mới)")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--data", default=HERE, help="thư mục chứa file dữ liệu và ketban.json")
+    p = sub.add_parser("fuzzy", help="chuẩn hoá gần đúng: lỗi gõ trên user.xlsx, tắt vs bật")
+    p.add_argument("--typo-rate", type=float, default=0.05, help="tỉ lệ ô bị thêm lỗi gõ")
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("topk", help="ketban_topk: chấm theo khối vs top_k từng user, dựng bảng, tra cứu")
+    p.add_argument("--rows", type=int, default=0, help="số dòng tổng hợp (0 = dùng user.xlsx)")
+    p.add_argument("--sample", type=int, default=300, help="số user để so với top_k từng user")
+    p.add_argument("--workers", default="0", help="danh sách số tiến trình, vd. 0,1,4")
+    p.add_argument("--chunk-rows", type=int, default=1024)
+    p.add_argument("--k", type=int, default=30)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("compare", help="so 2 file kết quả của suite")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.10, help="tỉ lệ chậm đi tối đa chấp nhận được")
+    args = ap.parse_args()
+
+    if args.cmd == "users":
+        if args.rows:
+            df = synthetic_dataframe(args.rows)
+        else:
+            df, _, _, _ = ketban.load_data(HERE)
+        bench_users(df, args.row_sample)
+    elif args.cmd == "service":
+        proc, url = (None, args.url) if args.url else _start_service(args.workers)
+        try:
+            bench_service(url, args.requests, args.concurrency)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+    elif args.cmd == "batch":
+        bench_batch(args.profiles, [int(w) for w in args.workers.split(",")], args.chunksize)
+    elif args.cmd == "suite":
+        result = bench_suite([int(n) for n in args.sizes.split(",")], args.interest_density, args.friend_degree,
+                             args.location_skew, args.queries, args.score_pairs, args.load_max, args.seed,
+                             ketban.parse_bfs_budget(args.bfs_budget))
+        text = json.dumps(result, ensure_ascii=False, indent=2)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+    elif args.cmd == "memory":
+        bench_memory(args.rows, args.seed, args.queries)
+    elif args.cmd == "lsh":
+        configs = [tuple(int(x) for x in c.split("x")) for c in args.configs.split(",")]
+        bench_lsh(args.rows, configs, tuple(args.tokens.split(",")), args.queries, args.k, args.max_candidates,
+                  args.seed)
+    elif args.cmd == "classes":
+        bench_classes(args.rows, args.queries, args.seed)
+    elif args.cmd == "startup":
+        bench_startup(args.runs, args.data)
+    elif args.cmd == "fuzzy":
+        bench_fuzzy(args.typo_rate, args.seed)
+    elif args.cmd == "topk":
+        bench_topk(args.rows, args.sample, [int(w) for w in args.workers.split(",")], args.chunk_rows, args.k,
+                   args.seed)
+    elif args.cmd == "compare":
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        sys.exit(1 if compare_results(base, new, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
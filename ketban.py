@@ -1,14 +1,47 @@
-import pandas as pd
 import numpy as np
-import heapq
+import contextlib
+import functools
+import hashlib
+import importlib
+import itertools
 import json
 import os
 import glob
-from collections import deque
+import threading
+from collections import OrderedDict
 import re
+import sys
 import time
 import unicodedata
 
+
+class _LazyModule:
+    """Module chỉ được import ở lần đầu truy cập thuộc tính (thuộc tính đã dùng được nhớ lại)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        setattr(self, attr, value)
+        return value
+
+
+# pandas (và openpyxl) chỉ được import khi thật sự đọc/ghi bảng dữ liệu: khởi động từ snapshot
+# và gợi ý cho hồ sơ nhập tay không cần tới.
+pd = _LazyModule("pandas")
+
+
+def _isna(val):
+    """pd.isna cho 1 giá trị; chưa import pandas thì không thể có giá trị NA kiểu pandas."""
+    if "pandas" in sys.modules:
+        return pd.isna(val)
+    return val is None or (isinstance(val, float) and val != val)
+
+
 # ==========================================
 # 0. CHUẨN HOÁ DỮ LIỆU (KHÔNG ĐỤNG EXCEL)
 # Theo tiêu chí 3.2.4:
@@ -52,6 +85,171 @@ def _loc_simplify_ascii(s: str) -> str:
     k = re.sub(r"\s+", " ", k).strip()
     return k
 
+# ---- Bộ nhớ đệm kết quả chuẩn hoá (LRU, có giới hạn) ----
+# Cùng một giá trị thô (vd. "Hà Nội", "Yoga") lặp lại hàng nghìn lần trong dữ liệu,
+# nên kết quả normalize_* / infer_industry_group được nhớ lại theo (loại, giá trị).
+
+_MISSING = object()
+
+
+class NormalizeCache:
+    """Cache LRU dùng chung cho các hàm chuẩn hoá, có bộ đếm hit/miss.
+
+    maxsize=None: không giới hạn; maxsize=0: tắt cache.
+    """
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if self.maxsize != 0:
+                value = self._data.get(key, _MISSING)
+                if value is not _MISSING:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            if self.maxsize != 0:
+                self._data[key] = value
+                self._evict()
+        return value
+
+    def _evict(self):
+        while self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            hits, misses, evictions, size = self.hits, self.misses, self.evictions, len(self._data)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "size": size,
+            "maxsize": self.maxsize,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+NORMALIZE_CACHE = NormalizeCache()
+
+
+class Metrics:
+    """Đo đạc tuỳ chọn: thời gian theo giai đoạn + bộ đếm (nút duyệt, cạnh xét, lần chấm điểm, ...).
+
+    Tắt (mặc định) thì phase() trả về context rỗng dùng chung và add() chỉ kiểm tra 1 cờ;
+    các vòng lặp nóng tự đếm bằng biến cục bộ rồi cộng 1 lần khi kết thúc.
+    Bật bằng METRICS.enabled = True hoặc biến môi trường KETBAN_METRICS (trừ "0" / "false").
+    """
+
+    _NULL = contextlib.nullcontext()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.phases = {}     # tên -> [số lần, tổng giây, lâu nhất]
+            self.counters = {}
+
+    def phase(self, name):
+        if not self.enabled:
+            return self._NULL
+        return self._time_phase(name)
+
+    @contextlib.contextmanager
+    def _time_phase(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t
+            with self._lock:
+                rec = self.phases.setdefault(name, [0, 0.0, 0.0])
+                rec[0] += 1
+                rec[1] += dt
+                rec[2] = max(rec[2], dt)
+
+    def timed(self, name):
+        """Decorator: đo cả lần gọi hàm như giai đoạn `name`."""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self._time_phase(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def add(self, **counts):
+        if not self.enabled:
+            return
+        with self._lock:
+            for name, n in counts.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            phases = {name: {"count": c, "seconds": total, "max_seconds": worst}
+                      for name, (c, total, worst) in self.phases.items()}
+            counters = dict(self.counters)
+        return {"phases": phases, "counters": counters, "normalize_cache": NORMALIZE_CACHE.stats()}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix="ketban"):
+        """Định dạng text exposition của Prometheus."""
+        snap = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        ph = sorted(snap["phases"].items())
+        metric("phase_seconds_total", "counter", "Tổng thời gian theo giai đoạn.",
+               [(f'{{phase="{k}"}}', v["seconds"]) for k, v in ph])
+        metric("phase_calls_total", "counter", "Số lần chạy theo giai đoạn.",
+               [(f'{{phase="{k}"}}', v["count"]) for k, v in ph])
+        metric("phase_max_seconds", "gauge", "Lần chạy lâu nhất theo giai đoạn.",
+               [(f'{{phase="{k}"}}', v["max_seconds"]) for k, v in ph])
+        for name, value in sorted(snap["counters"].items()):
+            metric(f"{name}_total", "counter", name.replace("_", " ") + ".", [("", value)])
+        cache = snap["normalize_cache"]
+        for name in ("hits", "misses", "evictions"):
+            metric(f"normalize_cache_{name}_total", "counter", f"Cache chuẩn hoá: {name}.", [("", cache[name])])
+        metric("normalize_cache_size", "gauge", "Số mục trong cache chuẩn hoá.", [("", cache["size"])])
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics(enabled=os.environ.get("KETBAN_METRICS", "").strip().lower() not in ("", "0", "false"))
+
 # ---- BẢNG TRƯỜNG/NGÀNH NGHỀ -> NGÀNH NGHỀ CON (CHUẨN) ----
 DEFAULT_INDUSTRY_GROUPS = {
     "Sinh viên": ["Sinh viên"],
@@ -80,9 +278,6 @@ DEFAULT_INDUSTRY_GROUPS = {
     ],
 }
 
-# Dùng để nhận biết khi người dùng nhập thẳng "tên trường/ngành nghề" thay vì ngành con
-INDUSTRY_GROUP_KEYS_NORM = {_norm_key(g) for g in DEFAULT_INDUSTRY_GROUPS.keys()}
-
 # ---- BẢNG SỞ THÍCH -> SỞ THÍCH CON (CHUẨN) ----
 DEFAULT_INTEREST_GROUPS = {
     "Sáng tạo": ["Vẽ tranh", "Chụp ảnh", "Viết lách", "Làm đồ thủ công"],
@@ -158,49 +353,260 @@ INTEREST_CHILD_ALIASES = {
     "doc sach": "Đọc sách",
 }
 
-# ---- Tạo bảng tra nhanh: ngành nghề con -> trường/ngành nghề ----
-INDUSTRY_CHILD_TO_GROUP = {}
-for _grp, _items in DEFAULT_INDUSTRY_GROUPS.items():
-    INDUSTRY_CHILD_TO_GROUP[_norm_key(_grp)] = _grp
-    INDUSTRY_CHILD_TO_GROUP[_norm_key_ascii(_grp)] = _grp
-    for _it in _items:
-        INDUSTRY_CHILD_TO_GROUP[_norm_key(_it)] = _grp
-        INDUSTRY_CHILD_TO_GROUP[_norm_key_ascii(_it)] = _grp
+# ---- Bảng tra dựng từ các bảng trên (chuẩn hoá key bằng NFD - tốn thời gian lúc khởi động) ----
+# Chỉ dựng trong bộ nhớ ở lần dùng đầu tiên (_lookup_tables).
 
-def infer_industry_group(industry_value: str) -> str:
+# Tên hằng số cũ của module -> bảng tương ứng (truy cập qua __getattr__ của module)
+_LAZY_TABLES = {
+    "INDUSTRY_CHILD_TO_GROUP": "industry_child_to_group",   # ngành nghề con -> trường/ngành nghề
+    "INDUSTRY_GROUP_KEYS_NORM": "industry_group_keys_norm",  # nhận biết khi nhập thẳng tên trường/ngành nghề
+}
+
+
+def build_lookup_tables():
+    """Các bảng tra chuẩn hoá."""
+    industry_child_to_group = {}
+    for grp, items in DEFAULT_INDUSTRY_GROUPS.items():
+        for name in [grp] + items:
+            industry_child_to_group[_norm_key(name)] = grp
+            industry_child_to_group[_norm_key_ascii(name)] = grp
+
+    # Alias nơi ở theo cả 3 dạng key mà DataNormalizer tra
+    location_aliases = {}
+    for k, v in LOCATION_ALIASES.items():
+        location_aliases[_norm_key(k)] = v
+        location_aliases[_norm_key_ascii(k)] = v
+        location_aliases[_loc_simplify_ascii(k)] = v
+
+    interest_canon = {_norm_key_ascii(it): it for items in DEFAULT_INTEREST_GROUPS.values() for it in items}
+    industry_canon = {_norm_key_ascii(it): it for items in DEFAULT_INDUSTRY_GROUPS.values() for it in items}
+    for grp in DEFAULT_INDUSTRY_GROUPS.keys():
+        industry_canon[_norm_key_ascii(grp)] = grp
+
+    return {
+        "industry_child_to_group": industry_child_to_group,
+        "industry_group_keys_norm": frozenset(_norm_key(g) for g in DEFAULT_INDUSTRY_GROUPS.keys()),
+        "location_aliases": location_aliases,
+        "interest_canon": interest_canon,
+        "industry_canon": industry_canon,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def _lookup_tables():
+    """Bảng tra chuẩn hoá, dựng 1 lần ở lần dùng đầu tiên."""
+    return build_lookup_tables()
+
+
+def __getattr__(name):
+    key = _LAZY_TABLES.get(name)
+    if key is not None:
+        return _lookup_tables()[key]
+    # Phần tính toán (SocialGraph, chấm điểm, BFS/DFS/A*...) ở ketban_graph.py, import ở lần dùng đầu tiên
+    if not name.startswith("__"):
+        graph_module = importlib.import_module("ketban_graph")
+        if hasattr(graph_module, name):
+            return getattr(graph_module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _infer_industry_group(industry_value: str) -> str:
+    child_to_group = _lookup_tables()["industry_child_to_group"]
     k = _norm_key(industry_value)
     ka = _norm_key_ascii(industry_value)
-    return INDUSTRY_CHILD_TO_GROUP.get(k) or INDUSTRY_CHILD_TO_GROUP.get(ka) or "-"
+    return child_to_group.get(k) or child_to_group.get(ka) or "-"
+
+
+def infer_industry_group(industry_value: str) -> str:
+    return NORMALIZE_CACHE.get_or_compute(
+        ("industry_group", industry_value), lambda: _infer_industry_group(industry_value))
+
+
+# ---- So khớp gần đúng (gõ sai chính tả) khi không khớp chính xác alias/tên chuẩn ----
+
+# Mặc định của DataNormalizer(fuzzy=None): so khớp gần đúng phải bật rõ ràng - biến môi trường KETBAN_FUZZY
+# (ketban.py và các ketban_*.py) hoặc --fuzzy của ketban_service.py / ketban_batch.py / ketban_topk.py
+FUZZY_NORMALIZE = os.environ.get("KETBAN_FUZZY", "").strip().lower() not in ("", "0", "false")
+FUZZY_MAX_DISTANCE = 2   # khoảng cách sửa tối đa với key dài; 0 = tắt
+
+
+def fuzzy_max_distance(key):
+    """Khoảng cách sửa cho phép theo độ dài key: key ngắn (viết tắt như "hn", "it") phải khớp chính xác."""
+    if len(key) < 4:
+        return 0
+    if len(key) < 8:
+        return min(1, FUZZY_MAX_DISTANCE)
+    return FUZZY_MAX_DISTANCE
+
+
+def _edit_distance(a, b, limit=None):
+    """Khoảng cách Levenshtein (chèn/xoá/thay 1 ký tự); limit: chỉ cần biết tới limit, vượt quá thì
+    trả về limit + 1 ngay (lệch độ dài, hoặc mọi ô của 1 dòng đã > limit)."""
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is None:
+        limit = len(a)
+    if len(a) - len(b) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return min(prev[-1], limit + 1)
+
+
+class FuzzyIndex:
+    """key (đã bỏ dấu/chuẩn hoá) -> giá trị chuẩn, tra gần đúng qua chỉ mục 2-gram; kết quả được nhớ theo key.
+
+    Lọc candidate theo bổ đề q-gram: 2 chuỗi cách nhau <= r phép sửa thì chung ít nhất
+    max(len) + 1 - 2r bigram (có đệm 2 đầu), nên chỉ các key đủ nhiều bigram chung mới phải tính
+    khoảng cách sửa (có giới hạn). Chỉ nhận khi giá trị chuẩn gần nhất hơn hẳn mọi giá trị khác
+    (giá trị khác gần thứ nhì phải xa hơn ít nhất 2 phép sửa); nếu không thì coi là không khớp (không đoán).
+    """
+
+    def __init__(self, items=()):
+        self._values = {}
+        self._postings = {}   # bigram (kèm số lần xuất hiện trước đó) -> tập key
+        self._memo = {}
+        self.update(items)
+
+    @staticmethod
+    def _grams(key):
+        padded = f"\0{key}\0"
+        seen = {}
+        out = []
+        for i in range(len(padded) - 1):
+            g = padded[i:i + 2]
+            n = seen.get(g, 0)
+            seen[g] = n + 1
+            out.append((g, n))   # phân biệt bigram lặp lại để đếm giao như đa tập
+        return out
+
+    def update(self, items):
+        for key, value in items:
+            if not key or key == "-":
+                continue
+            if key not in self._values:
+                for g in self._grams(key):
+                    self._postings.setdefault(g, set()).add(key)
+            self._values[key] = value
+        self._memo.clear()   # key mới có thể gần hơn kết quả đã nhớ
+
+    def search(self, key, radius):
+        """[(khoảng cách, key đã có)] của mọi key cách key <= radius."""
+        if len(key) + 1 - 2 * radius <= 0:
+            candidates = self._values   # ngưỡng bigram vô nghĩa: xét mọi key
+        else:
+            candidates = {}
+            for g in self._grams(key):
+                for other in self._postings.get(g, ()):
+                    candidates[other] = candidates.get(other, 0) + 1
+        out = []
+        for other in candidates:
+            if abs(len(other) - len(key)) > radius:
+                continue
+            if candidates is not self._values and candidates[other] < max(len(key), len(other)) + 1 - 2 * radius:
+                continue
+            d = _edit_distance(key, other, radius)
+            if d <= radius:
+                out.append((d, other))
+        return out
+
+    def lookup(self, key):
+        """Giá trị chuẩn gần nhất với key trong bán kính fuzzy_max_distance(key), hoặc None."""
+        hit = self._memo.get(key, _MISSING)
+        if hit is not _MISSING:
+            return hit
+        radius = fuzzy_max_distance(key)
+        value = self._values.get(key)
+        if value is None and radius:
+            matches = self.search(key, radius)
+            if matches:
+                best = min(d for d, _ in matches)
+                values = {self._values[k] for d, k in matches if d <= best + 1}
+                nearest = {self._values[k] for d, k in matches if d == best}
+                if len(values) == 1 and len(nearest) == 1:
+                    value = nearest.pop()
+        self._memo[key] = value
+        return value
+
+
+@functools.lru_cache(maxsize=None)
+def _fixed_fuzzy_index(kind):
+    """FuzzyIndex cho ngành nghề / sở thích (bảng chuẩn cố định, dùng chung giữa các DataNormalizer)."""
+    tables = _lookup_tables()
+    if kind == "industry":
+        return FuzzyIndex(list(tables["industry_canon"].items()) + list(INDUSTRY_CHILD_ALIASES.items()))
+    return FuzzyIndex(list(tables["interest_canon"].items()) + list(INTEREST_CHILD_ALIASES.items()))
 
 
 class DataNormalizer:
-    """Chuẩn hoá theo tiêu chí 3.2.4."""
-
-    def __init__(self, known_locations=None):
-        self.known_locations = set(known_locations or [])
-
-        self._loc_lookup = {}
-        for loc in self.known_locations:
-            self._loc_lookup[_norm_key(loc)] = loc
-            self._loc_lookup[_norm_key_ascii(loc)] = loc
-            self._loc_lookup[_loc_simplify_ascii(loc)] = loc
-
-        for k, v in LOCATION_ALIASES.items():
-            self._loc_lookup[_norm_key(k)] = v
-            self._loc_lookup[_norm_key_ascii(k)] = v
-            self._loc_lookup[_loc_simplify_ascii(k)] = v
-
-        self._interest_canon = {}
-        for items in DEFAULT_INTEREST_GROUPS.values():
-            for it in items:
-                self._interest_canon[_norm_key_ascii(it)] = it
-
-        self._industry_canon = {}
-        for items in DEFAULT_INDUSTRY_GROUPS.values():
-            for it in items:
-                self._industry_canon[_norm_key_ascii(it)] = it
-        for grp in DEFAULT_INDUSTRY_GROUPS.keys():
-            self._industry_canon[_norm_key_ascii(grp)] = grp
+    """Chuẩn hoá theo tiêu chí 3.2.4.
+
+    Kết quả được nhớ trong `cache` (mặc định NORMALIZE_CACHE, dùng chung với
+    infer_industry_group); key gắn với từng instance vì bảng tra phụ thuộc known_locations.
+    """
+
+    _tokens = itertools.count()
+
+    def __init__(self, known_locations=None, cache=None, fuzzy=None, valid_locations=None):
+        """fuzzy (mặc định FUZZY_NORMALIZE): khi không khớp chính xác, so khớp gần đúng (FuzzyIndex) với
+        alias/tên chuẩn và nơi ở đã biết/hợp lệ trước khi trả về raw.title().
+
+        valid_locations: tên nơi ở có thật (vd. các key loc_map của ketban.json). Tên hợp lệ không bao giờ
+        bị so gần đúng sang nơi khác ("Hà Giang" không thành "An Giang" dù dữ liệu chỉ có An Giang),
+        và cũng là đích so khớp cho lỗi gõ.
+        """
+        self.known_locations = set()
+        self.cache = cache if cache is not None else NORMALIZE_CACHE
+        self._token = next(self._tokens)
+        self.fuzzy = FUZZY_NORMALIZE if fuzzy is None else fuzzy
+        self.valid_locations = sorted(set(valid_locations or []))
+
+        tables = _lookup_tables()
+        # Alias luôn thắng nơi ở lấy từ dữ liệu
+        self._loc_lookup = dict(tables["location_aliases"])
+        self._alias_keys = set(self._loc_lookup)
+        self._valid_loc_keys = {_loc_simplify_ascii(v) for v in self.valid_locations}
+        # Alias (và sau đó nơi ở đã biết) ghi đè tên hợp lệ trùng key
+        self._loc_fuzzy = FuzzyIndex([(_loc_simplify_ascii(v), v) for v in self.valid_locations]
+                                     + [(_loc_simplify_ascii(k), v) for k, v in LOCATION_ALIASES.items()])
+        self.add_known_locations(dict.fromkeys(known_locations or []))   # giữ thứ tự: key trùng thì nơi ở sau thắng
+
+        # Chỉ đọc, dùng chung giữa các instance
+        self._interest_canon = tables["interest_canon"]
+        self._industry_canon = tables["industry_canon"]
+
+    def add_known_locations(self, locations):
+        """Bổ sung nơi ở đã biết (khi nạp dữ liệu theo từng phần).
+
+        Nếu 1 key đã có trong bảng tra đổi sang giá trị khác thì đổi token để bỏ kết quả cũ trong cache.
+        """
+        changed = False
+        fuzzy_items = []
+        for loc in locations:
+            if loc in self.known_locations:
+                continue
+            self.known_locations.add(loc)
+            for key in (_norm_key(loc), _norm_key_ascii(loc), _loc_simplify_ascii(loc)):
+                if key in self._alias_keys:
+                    continue
+                old = self._loc_lookup.get(key)
+                changed |= old is not None and old != loc
+                self._loc_lookup[key] = loc
+            key = _loc_simplify_ascii(loc)
+            if key not in self._alias_keys:
+                fuzzy_items.append((key, self._loc_lookup[key]))
+        if fuzzy_items:
+            self._loc_fuzzy.update(fuzzy_items)
+            # Kết quả gần đúng đã nhớ (vd. raw.title()) có thể đổi khi có nơi ở mới
+            changed = True
+        if changed:
+            self._token = next(self._tokens)
 
     def normalize_location(self, raw: str) -> str:
         if raw is None:
@@ -208,9 +614,17 @@ class DataNormalizer:
         raw = str(raw).strip()
         if raw in ["", "nan", "NaN", "-"]:
             return "-"
+        return self.cache.get_or_compute(("location", self._token, raw), lambda: self._normalize_location(raw))
+
+    def _normalize_location(self, raw: str) -> str:
         for key in (_norm_key(raw), _norm_key_ascii(raw), _loc_simplify_ascii(raw)):
             if key in self._loc_lookup:
                 return self._loc_lookup[key]
+        key = _loc_simplify_ascii(raw)
+        if self.fuzzy and key not in self._valid_loc_keys:
+            hit = self._loc_fuzzy.lookup(key)
+            if hit is not None:
+                return hit
         return raw.title()
 
     def normalize_industry_child(self, raw: str) -> str:
@@ -219,11 +633,18 @@ class DataNormalizer:
         raw = str(raw).strip()
         if raw in ["", "nan", "NaN", "-"]:
             return "-"
+        return self.cache.get_or_compute(("industry", self._token, raw), lambda: self._normalize_industry_child(raw))
+
+    def _normalize_industry_child(self, raw: str) -> str:
         k = _norm_key_ascii(raw)
         if k in INDUSTRY_CHILD_ALIASES:
             return INDUSTRY_CHILD_ALIASES[k]
         if k in self._industry_canon:
             return self._industry_canon[k]
+        if self.fuzzy:
+            hit = _fixed_fuzzy_index("industry").lookup(k)
+            if hit is not None:
+                return hit
         return raw.title()
 
     def normalize_interest_child(self, raw: str) -> str:
@@ -232,11 +653,18 @@ class DataNormalizer:
         raw = str(raw).strip()
         if raw in ["", "nan", "NaN", "-"]:
             return "-"
+        return self.cache.get_or_compute(("interest", self._token, raw), lambda: self._normalize_interest_child(raw))
+
+    def _normalize_interest_child(self, raw: str) -> str:
         k = _norm_key_ascii(raw)
         if k in INTEREST_CHILD_ALIASES:
             return INTEREST_CHILD_ALIASES[k]
         if k in self._interest_canon:
             return self._interest_canon[k]
+        if self.fuzzy:
+            hit = _fixed_fuzzy_index("interest").lookup(k)
+            if hit is not None:
+                return hit
         return raw.title()
 
     def normalize_friend_ids(self, raw: str):
@@ -258,51 +686,224 @@ class DataNormalizer:
 NORMALIZER = None
 
 
+def _find_excel_files(folder_path):
+    excel_files = sorted(glob.glob(os.path.join(folder_path, "*.xlsx")))
+    return [f for f in excel_files if not os.path.basename(f).startswith('~$')]
+
+
+def _find_data_files(folder_path):
+    """Mọi file dữ liệu (.xlsx và .csv, vd. mỗi vùng 1 file), theo thứ tự tên."""
+    files = _find_excel_files(folder_path) + glob.glob(os.path.join(folder_path, "*.csv"))
+    return sorted(files)
+
+
+# ---- Đọc dữ liệu theo từng phần (bộ nhớ giới hạn theo kích thước phần) ----
+
+LOAD_CHUNK_ROWS = 50000
+LOAD_WORKER_POLL = 1.0   # giây chờ hàng đợi của tiến trình đọc file trước khi kiểm tra nó còn sống
+_INTEGRAL_ID_COLUMNS = ('Số thứ tự', 'Bạn chung (ID)')
+
+
+def iter_file_chunks(path, chunk_rows=LOAD_CHUNK_ROWS):
+    """Sinh các DataFrame tối đa chunk_rows dòng của 1 file .xlsx (openpyxl read-only) hoặc .csv."""
+    if path.lower().endswith(".csv"):
+        # Đọc mọi cột dạng chuỗi: kiểu suy ra theo từng phần có thể khác nhau giữa các phần
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str, encoding="utf-8-sig")
+        return
+    import openpyxl
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f"Unnamed: {i}" if h is None else str(h) for i, h in enumerate(header)]
+        # Như read_excel: số thực nguyên trong cột id / bạn chung (vd. 1.0) đổi thành int
+        id_cols = [i for i, c in enumerate(columns) if c in _INTEGRAL_ID_COLUMNS]
+        while True:
+            block = list(itertools.islice(rows, chunk_rows))
+            if not block:
+                return
+            block = [list(r) for r in block if any(v is not None for v in r)]   # bỏ dòng trống
+            for r in block:
+                for i in id_cols:
+                    v = r[i] if i < len(r) else None
+                    if type(v) is float and v.is_integer():
+                        r[i] = int(v)
+            if block:
+                yield pd.DataFrame.from_records(block, columns=columns)
+    finally:
+        wb.close()
+
+
+def _parse_file_worker(path, chunk_rows, queue):
+    try:
+        for chunk in iter_file_chunks(path, chunk_rows):
+            queue.put(chunk)
+        queue.put(None)
+    except Exception as e:  # chuyển lỗi về tiến trình chính
+        queue.put(e)
+
+
+def iter_data_chunks(paths, chunk_rows=LOAD_CHUNK_ROWS, workers=None):
+    """Sinh các phần dữ liệu của mọi file theo đúng thứ tự file.
+
+    Nhiều file: tối đa `workers` tiến trình đọc trước các file kế tiếp, mỗi file giữ tối đa 2 phần
+    chờ trong hàng đợi - bộ nhớ vẫn giới hạn theo kích thước phần.
+    """
+    if workers is None:
+        workers = min(len(paths), os.cpu_count() or 1)
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield from iter_file_chunks(path, chunk_rows)
+        return
+    import multiprocessing
+    from queue import Empty
+    ctx = multiprocessing.get_context()
+    queues = [ctx.Queue(maxsize=2) for _ in paths]
+    procs = {}
+
+    def start(i):
+        if i < len(paths):
+            procs[i] = ctx.Process(target=_parse_file_worker, args=(paths[i], chunk_rows, queues[i]), daemon=True)
+            procs[i].start()
+
+    def get(i):
+        # Tiến trình chết mà không gửi None (bị kill, hết bộ nhớ, lỗi pickle khi put) -> báo lỗi thay vì chờ mãi
+        while True:
+            try:
+                return queues[i].get(timeout=LOAD_WORKER_POLL)
+            except Empty:
+                if procs[i].is_alive():
+                    continue
+            try:   # phần gửi ngay trước khi tiến trình kết thúc có thể vừa tới
+                return queues[i].get(timeout=LOAD_WORKER_POLL)
+            except Empty:
+                raise RuntimeError(f"tiến trình đọc {paths[i]} đã dừng (exitcode {procs[i].exitcode}) "
+                                   f"khi chưa đọc xong file") from None
+
+    try:
+        for i in range(workers):
+            start(i)
+        for i in range(len(paths)):
+            while True:
+                chunk = get(i)
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+            procs.pop(i).join()
+            start(i + workers)
+    finally:
+        for p in procs.values():
+            p.terminate()
+            p.join()
+
+
+def load_config(folder_path, json_filename='ketban.json'):
+    """(loc_map, bonus_rules, interest_groups) từ ketban.json."""
+    with open(os.path.join(folder_path, json_filename), 'r', encoding='utf-8') as f:
+        full_json = json.load(f)
+    return full_json.get('locations', {}), full_json.get('bonus_config', []), full_json.get('interest_groups', {})
+
+
 def load_data(folder_path, json_filename='ketban.json'):
-    excel_files = glob.glob(os.path.join(folder_path, "*.xlsx"))
-    excel_files = [f for f in excel_files if not os.path.basename(f).startswith('~$')]
+    """Toàn bộ dữ liệu (mọi file .xlsx/.csv, nối theo thứ tự tên) trong 1 DataFrame + cấu hình.
+
+    Tốn bộ nhớ theo kích thước dữ liệu; load_users đọc theo từng phần thay vì dùng hàm này.
+    """
+    data_files = _find_data_files(folder_path)
 
-    if not excel_files:
-        print("Lỗi: Không tìm thấy file Excel (.xlsx) trong E:\\ttnt")
+    if not data_files:
+        print(f"Lỗi: Không tìm thấy file dữ liệu (.xlsx/.csv) trong {folder_path}")
         return None, {}, [], {}
 
-    data_file = excel_files[0]
-    print(f"--- Đang nạp dữ liệu: {os.path.basename(data_file)} ---")
+    print(f"--- Đang nạp dữ liệu: {', '.join(os.path.basename(f) for f in data_files)} ---")
 
     try:
-        df = pd.read_excel(data_file, engine='openpyxl')
-        json_path = os.path.join(folder_path, json_filename)
-        with open(json_path, 'r', encoding='utf-8') as f:
-            full_json = json.load(f)
-            return (df,
-                    full_json.get('locations', {}),
-                    full_json.get('bonus_config', []),
-                    full_json.get('interest_groups', {}))
+        df = pd.concat(list(iter_data_chunks(data_files)), ignore_index=True)
+        return (df, *load_config(folder_path, json_filename))
     except Exception as e:
         print(f"Lỗi hệ thống: {e}")
         return None, {}, [], {}
 
 
+# ---- Chuẩn hoá theo cột (dùng cho User.from_dataframe) ----
+# Mỗi cột được factorize: chỉ xử lý 1 lần cho mỗi giá trị thô khác nhau,
+# rồi "take" ngược lại theo codes. Giá trị NA có code -1 -> phần tử cuối.
+
+def _factorize_column(df, col, default=None):
+    """default=None: cột bắt buộc (giống row[col]); ngược lại giống row.get(col, default)."""
+    if default is not None and col not in df.columns:
+        return np.zeros(len(df), dtype=np.intp), pd.Series([default], dtype=object)
+    codes, uniques = pd.factorize(df[col], use_na_sentinel=True)
+    return codes, pd.Series(uniques, dtype=object)
+
+
+def _clean_distinct(uniques):
+    """Bản vector hoá của clean() trong User.__init__ (áp dụng trên các giá trị khác NA)."""
+    s = uniques.map(str).str.strip()
+    return s.where(~s.isin(["", "nan", "-"]), "-")
+
+
+def _take_distinct(values, codes, na_value):
+    vals = list(values) + [na_value]
+    return [vals[c] for c in codes.tolist()]
+
+
+def _split_interests_distinct(cleaned, normalize):
+    """Tách chuỗi sở thích của mọi giá trị khác nhau trong 1 lượt (split + explode)."""
+    tokens = cleaned.where(cleaned != "-", "").str.split(r"[;,]", regex=True).explode().str.strip()
+    tokens = tokens[tokens.notna() & (tokens != "")]
+    tok_codes, tok_uniques = pd.factorize(tokens)
+    tok_norm = [normalize(t) for t in tok_uniques]
+    out = [[] for _ in range(len(cleaned))]
+    for pos, c in zip(tokens.index.tolist(), tok_codes.tolist()):
+        out[pos].append(tok_norm[c])
+    return out
+
+
+def _split_friend_ids_distinct(uniques, dedupe):
+    """Bản vector hoá của DataNormalizer.normalize_friend_ids (dedupe=False: nhánh không có NORMALIZER)."""
+    # Tách theo "\s*,\s*" trên chuỗi đã strip = split(",") rồi strip từng phần
+    parts = uniques.map(str).str.strip().str.split(r"\s*,\s*", regex=True).explode()
+    parts = parts[parts.str.isdigit().fillna(False).astype(bool)]
+    out = [[] for _ in range(len(uniques))]
+    for pos, v in zip(parts.index.tolist(), parts.tolist()):
+        ids = out[pos]
+        if not dedupe or v not in ids:
+            ids.append(v)
+    return out
+
+
 class User:
+    # Đặc trưng số (loc_code, ...) do _FeatureCodes.encode gắn khi user vào graph,
+    # profile_class do ProfileClasses.add gắn
+    __slots__ = ("id", "name", "dob", "gender", "location", "industry", "industry_group", "marital",
+                 "interests", "friends_ids", "loc_code", "ind_code", "grp_code", "interest_mask",
+                 "interest_group_mask", "profile_class")
+
     def __init__(self, uid, name, dob, gender, location, interests, industry, marital, friends_str):
         def clean(val):
-            if pd.isna(val) or str(val).strip() in ["", "nan", "-"]:
+            if _isna(val) or str(val).strip() in ["", "nan", "-"]:
                 return "-"
             return str(val).strip()
 
         self.id = str(uid)
         self.name = clean(name).title()
         self.dob = clean(dob)
-        self.gender = clean(gender).title()
+        # Giá trị phân loại lặp lại rất nhiều giữa các user -> intern để dùng chung 1 chuỗi
+        self.gender = sys.intern(clean(gender).title())
 
         raw_loc = clean(location)
-        self.location = NORMALIZER.normalize_location(raw_loc) if NORMALIZER else raw_loc.title()
+        self.location = sys.intern(NORMALIZER.normalize_location(raw_loc) if NORMALIZER else raw_loc.title())
 
         raw_ind = clean(industry)
-        self.industry = NORMALIZER.normalize_industry_child(raw_ind) if NORMALIZER else raw_ind.title()
+        self.industry = sys.intern(NORMALIZER.normalize_industry_child(raw_ind) if NORMALIZER else raw_ind.title())
         self.industry_group = infer_industry_group(self.industry)
 
-        self.marital = clean(marital).title()
+        self.marital = sys.intern(clean(marital).title())
 
         raw_its = clean(interests)
         if raw_its == "-":
@@ -322,176 +923,304 @@ class User:
             row.get('Tình trạng hôn nhân', '-'), row.get('Bạn chung (ID)', '')
         )
 
+    @classmethod
+    def from_dataframe(cls, df):
+        """Tạo toàn bộ User từ DataFrame theo cột - kết quả giống hệt [User.from_row(r) for r in df.iterrows()]."""
+        n = len(df)
+        if n == 0:
+            return []
+        df = df.reset_index(drop=True)
+
+        def column(col, transform, default=None):
+            codes, uniques = _factorize_column(df, col, default)
+            values = transform(_clean_distinct(uniques)).tolist()
+            na_value = transform(pd.Series(["-"], dtype=object)).iloc[0]
+            return codes, values, na_value
+
+        def title(s):
+            return s.str.title()
+
+        def identity(s):
+            return s
+
+        norm = NORMALIZER
+        loc_fn = (lambda s: s.map(norm.normalize_location)) if norm else title
+        ind_fn = (lambda s: s.map(norm.normalize_industry_child)) if norm else title
+
+        cols = {}
+        for attr, col, fn, default in (
+            ("name", 'Họ và tên', title, None),
+            ("dob", 'Ngày sinh', identity, None),
+            ("gender", 'Giới tính', title, None),
+            ("location", 'Nơi ở', loc_fn, None),
+            ("industry", 'Lĩnh vực/ngành nghề', ind_fn, '-'),
+            ("marital", 'Tình trạng hôn nhân', title, '-'),
+        ):
+            codes, values, na_value = column(col, fn, default)
+            if attr == "industry":
+                groups = [infer_industry_group(v) for v in values]
+                cols["industry_group"] = _take_distinct(groups, codes, infer_industry_group(na_value))
+            cols[attr] = _take_distinct(values, codes, na_value)
+
+        codes, uniques = _factorize_column(df, 'Sở thích')
+        interests = _split_interests_distinct(
+            _clean_distinct(uniques), norm.normalize_interest_child if norm else str.title)
+        interest_rows = _take_distinct(interests, codes, [])
+
+        codes, uniques = _factorize_column(df, 'Bạn chung (ID)', '')
+        friends = _split_friend_ids_distinct(uniques, dedupe=norm is not None)
+        friend_rows = _take_distinct(friends, codes, [])
+
+        ids = df['Số thứ tự'].astype(str).tolist()
+        # Các dòng có cùng chuỗi thô dùng chung list -> sao chép để mỗi User có list riêng
+        return [
+            cls.from_normalized(uid, name, dob, gender, loc, ind, grp, marital, list(its), list(fr))
+            for uid, name, dob, gender, loc, ind, grp, marital, its, fr in zip(
+                ids, cols["name"], cols["dob"], cols["gender"], cols["location"], cols["industry"],
+                cols["industry_group"], cols["marital"], interest_rows, friend_rows)
+        ]
+
+    @classmethod
+    def from_normalized(cls, uid, name, dob, gender, location, industry, industry_group,
+                        marital, interests, friends_ids):
+        """Tạo User từ các giá trị ĐÃ chuẩn hoá (vd. đọc từ snapshot), bỏ qua bước chuẩn hoá."""
+        u = cls.__new__(cls)
+        u.id = uid
+        u.name = name
+        u.dob = dob
+        u.gender = gender
+        u.location = location
+        u.industry = industry
+        u.industry_group = industry_group
+        u.marital = marital
+        u.interests = interests
+        u.friends_ids = friends_ids
+        return u
 
-class SocialGraph:
-    def __init__(self, users, loc_map, bonus_rules, interest_groups):
-        self.users = {u.id: u for u in users}
-        self.friend_adj = {u.id: set(u.friends_ids) for u in users}
-        self.adj_list = {u.id: set(u.friends_ids) for u in users}
-        self.strong_neighbors = {}
-
-        self.loc_map = loc_map
-        self.bonus_rules = bonus_rules
-
-        merged_groups = {k: list(v) for k, v in DEFAULT_INTEREST_GROUPS.items()}
-        for g, items in (interest_groups or {}).items():
-            if g not in merged_groups:
-                merged_groups[g] = list(items)
-            else:
-                merged_groups[g] = list(dict.fromkeys(merged_groups[g] + list(items)))
-        self.interest_groups = merged_groups
-        self._interest_groups_norm = {g: {_norm_key(x) for x in items} for g, items in self.interest_groups.items()}
-
-    def _proxy_friend_set(self, uid: str) -> set:
-        if uid in self.strong_neighbors:
-            return self.strong_neighbors.get(uid, set())
-        return self.friend_adj.get(uid, set())
-
-    def common_friend_ids(self, id_a: str, id_b: str) -> set:
-        return self._proxy_friend_set(id_a) & self._proxy_friend_set(id_b)
-
-    def add_new_user(self, new_user):
-        self.users[new_user.id] = new_user
-        self.friend_adj[new_user.id] = set()
-        self.adj_list[new_user.id] = set()
-
-        new_loc_val = self.loc_map.get(new_user.location)
-        new_int_set = {_norm_key(x) for x in new_user.interests}
-
-        # Liên kết gợi ý để có candidate
-        for uid, u in self.users.items():
-            if uid == new_user.id:
-                continue
 
-            conn = False
-            if new_user.location != "-" and new_user.location == u.location:
-                conn = True
-            elif new_loc_val is not None and self.loc_map.get(u.location) == new_loc_val:
-                conn = True
-            else:
-                u_int_set = {_norm_key(x) for x in u.interests}
-                if new_int_set & u_int_set:
-                    conn = True
-                elif new_user.industry_group != "-" and new_user.industry_group == u.industry_group:
-                    conn = True
-
-            if conn:
-                self.adj_list[new_user.id].add(uid)
-                self.adj_list[uid].add(new_user.id)
-
-        # Strong neighbors để tính bạn chung tự động (giảm bị +1 hàng loạt)
-        strong = set()
-        for uid, u in self.users.items():
-            if uid == new_user.id:
-                continue
+# ==========================================
+# 1. SNAPSHOT NHỊ PHÂN CHO DỮ LIỆU ĐÃ CHUẨN HOÁ
+# Lưu users (dạng cột) + cấu hình ketban.json + dấu vân tay file nguồn
+# vào 1 file .npz. Lần chạy sau nạp trực tiếp, không phải đọc lại Excel.
+# Snapshot tự build lại khi file xlsx/json thay đổi (size/mtime) hoặc cấu hình chuẩn hoá đổi.
+# ==========================================
 
-            u_int_set = {_norm_key(x) for x in u.interests}
-            common_int = new_int_set & u_int_set
-
-            is_strong = False
-            if new_user.location != "-" and new_user.location == u.location:
-                is_strong = True
-            elif new_user.industry_group != "-" and new_user.industry_group == u.industry_group:
-                is_strong = True
-            elif len(common_int) >= 2:
-                is_strong = True
-
-            if is_strong:
-                strong.add(uid)
-
-        self.strong_neighbors[new_user.id] = strong
-
-    def calculate_score(self, user_a, user_b):
-        score = 0
-
-        # Trùng nơi ở: +1
-        if user_a.location != "-" and user_a.location == user_b.location:
-            score += 1
-
-        # Có ít nhất 1 bạn chung: +1
-        if self.common_friend_ids(user_a.id, user_b.id):
-            score += 1
-
-        # Sở thích: +2 / sở thích trùng
-        a_int = {_norm_key(x) for x in user_a.interests}
-        b_int = {_norm_key(x) for x in user_b.interests}
-        common = a_int & b_int
-        score += len(common) * 2
-
-        # Trùng trường sở thích: +1 (cùng nhóm nhưng không trùng sở thích con trong nhóm đó)
-        for members_norm in self._interest_groups_norm.values():
-            a_in = a_int & members_norm
-            b_in = b_int & members_norm
-            if a_in and b_in and not (a_in & b_in):
-                score += 1
-                break
-
-        # Ngành nghề: +2 nếu trùng ngành con, else +1 nếu trùng trường/ngành nghề
-        a_ind = _norm_key(user_a.industry)
-        b_ind = _norm_key(user_b.industry)
-
-        if a_ind != "-" and a_ind == b_ind and a_ind not in INDUSTRY_GROUP_KEYS_NORM:
-            score += 2
-        else:
-            if user_a.industry_group != "-" and user_a.industry_group == user_b.industry_group:
-                score += 1
-
-        return score
-
-
-def run_bfs(graph, start_id):
-    results = []
-    queue = deque([start_id])
-    visited = {start_id}
-    while queue:
-        curr = queue.popleft()
-        if curr != start_id:
-            s = graph.calculate_score(graph.users[start_id], graph.users[curr])
-            if s > 0:
-                results.append({'user': graph.users[curr], 'score': s})
-        for n in graph.adj_list.get(curr, []):
-            if n in graph.users and n not in visited:
-                visited.add(n)
-                queue.append(n)
-    return results
-
-
-def run_dfs(graph, start_id, max_depth=3):
-    results = []
-    stack = [(start_id, 0)]
-    visited = {start_id}
-    while stack:
-        curr, depth = stack.pop()
-        if curr != start_id:
-            s = graph.calculate_score(graph.users[start_id], graph.users[curr])
-            if s > 0:
-                results.append({'user': graph.users[curr], 'score': s})
-        if depth < max_depth:
-            for n in graph.adj_list.get(curr, []):
-                if n in graph.users and n not in visited:
-                    visited.add(n)
-                    stack.append((n, depth + 1))
-    return results
-
-
-def run_astar(graph, start_id, goal_id):
-    open_set = [(0, start_id, [start_id])]
-    visited = set()
-    while open_set:
-        f, curr, path = heapq.heappop(open_set)
-        if curr == goal_id:
-            return path
-        if curr in visited:
-            continue
-        visited.add(curr)
-        for n in graph.adj_list.get(curr, []):
-            if n in graph.users and n not in visited:
-                heapq.heappush(open_set, (len(path), n, path + [n]))
-    return None
-
-
-def display_profile(u, label, me_id, graph, score):
-    common_ids = graph.common_friend_ids(me_id, u.id)
+# Tăng mỗi khi định dạng snapshot hoặc kết quả chuẩn hoá đổi (2: nơi ở chuẩn hoá lại qua mọi phần
+# dữ liệu, chuẩn hoá gần đúng)
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILENAME = ".ketban_snapshot.npz"
+
+_SNAPSHOT_STR_COLUMNS = ("id", "name", "dob", "gender", "location", "industry", "industry_group", "marital")
+
+
+def _normalizer_fingerprint(json_path):
+    """sha1 của mọi thứ quyết định kết quả chuẩn hoá: bảng nhóm/alias trong mã, cấu hình so khớp gần đúng
+    và nội dung ketban.json (nơi ở hợp lệ)."""
+    tables = [DEFAULT_INDUSTRY_GROUPS, DEFAULT_INTEREST_GROUPS, LOCATION_ALIASES, INDUSTRY_CHILD_ALIASES,
+              INTEREST_CHILD_ALIASES, FUZZY_NORMALIZE, FUZZY_MAX_DISTANCE]
+    h = hashlib.sha1(json.dumps(tables, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    with open(json_path, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def _source_fingerprint(paths, json_path):
+    """Dấu vân tay file nguồn: (tên file, kích thước, mtime_ns) + cấu hình chuẩn hoá + phiên bản snapshot."""
+    items = []
+    for p in paths + [json_path]:
+        st = os.stat(p)
+        items.append([os.path.basename(p), st.st_size, st.st_mtime_ns])
+    return json.dumps({"version": SNAPSHOT_VERSION, "sources": items,
+                       "normalizer": _normalizer_fingerprint(json_path)}, sort_keys=True)
+
+
+def _encode_column(values):
+    """Mã hoá cột chuỗi thành (codes int32, vocab) - dạng categorical."""
+    vocab, codes = {}, np.empty(len(values), dtype=np.int32)
+    for i, v in enumerate(values):
+        codes[i] = vocab.setdefault(v, len(vocab))
+    return codes, np.array(list(vocab) or [""], dtype=str)
+
+
+def _encode_lists(lists):
+    """Mã hoá cột danh sách chuỗi thành CSR (offsets, codes) + vocab."""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    flat = []
+    for i, items in enumerate(lists):
+        flat.extend(items)
+        offsets[i + 1] = len(flat)
+    codes, vocab = _encode_column(flat)
+    return offsets, codes, vocab
+
+
+def _decode_column(codes, vocab):
+    # Giải mã qua list vocab để các giá trị trùng dùng chung 1 đối tượng str
+    vocab = vocab.tolist()
+    return [vocab[c] for c in codes.tolist()]
+
+
+def _decode_lists(offsets, codes, vocab):
+    vals = _decode_column(codes, vocab)
+    offs = offsets.tolist()
+    return [vals[offs[i]:offs[i + 1]] for i in range(len(offs) - 1)]
+
+
+def save_snapshot(path, users, known_locations, loc_map, bonus_rules, interest_groups, fingerprint):
+    arrays = {}
+    for col in _SNAPSHOT_STR_COLUMNS:
+        arrays[col + "_codes"], arrays[col + "_vocab"] = _encode_column([getattr(u, col) for u in users])
+    arrays["interests_offsets"], arrays["interests_codes"], arrays["interests_vocab"] = \
+        _encode_lists([u.interests for u in users])
+    arrays["friends_offsets"], arrays["friends_codes"], arrays["friends_vocab"] = \
+        _encode_lists([u.friends_ids for u in users])
+    arrays["known_locations"] = np.array(list(known_locations) or [""], dtype=str)
+    meta = {
+        "fingerprint": fingerprint,
+        "n_users": len(users),
+        "n_known_locations": len(known_locations),
+        "locations": loc_map,
+        "bonus_config": bonus_rules,
+        "interest_groups": interest_groups,
+    }
+    arrays["meta"] = np.array(json.dumps(meta, ensure_ascii=False))
+
+    # Ghi ra file tạm rồi đổi tên để không bao giờ để lại snapshot hỏng
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, fingerprint):
+    """Nạp snapshot nếu còn khớp dấu vân tay. Trả về None nếu thiếu/cũ/hỏng."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            meta = json.loads(str(z["meta"]))
+            if meta.get("fingerprint") != fingerprint:
+                return None
+            n = meta["n_users"]
+            cols = {col: _decode_column(z[col + "_codes"], z[col + "_vocab"]) for col in _SNAPSHOT_STR_COLUMNS}
+            interests = _decode_lists(z["interests_offsets"], z["interests_codes"], z["interests_vocab"])
+            friends = _decode_lists(z["friends_offsets"], z["friends_codes"], z["friends_vocab"])
+            known_locations = z["known_locations"][:meta["n_known_locations"]].tolist()
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Bỏ qua snapshot hỏng ({e})")
+        return None
+
+    users = [
+        User.from_normalized(cols["id"][i], cols["name"][i], cols["dob"][i], cols["gender"][i],
+                             cols["location"][i], cols["industry"][i], cols["industry_group"][i],
+                             cols["marital"][i], interests[i], friends[i])
+        for i in range(n)
+    ]
+    return users, known_locations, meta["locations"], meta["bonus_config"], meta["interest_groups"]
+
+
+def snapshot_user_ids(folder_path, json_filename='ketban.json'):
+    """Id user của dữ liệu gốc đọc từ snapshot còn khớp nguồn (chỉ cột id, không dựng User); None nếu không có."""
+    data_files = _find_data_files(folder_path)
+    json_path = os.path.join(folder_path, json_filename)
+    snapshot_path = os.path.join(folder_path, SNAPSHOT_FILENAME)
+    if not data_files or not os.path.exists(json_path) or not os.path.exists(snapshot_path):
+        return None
+    try:
+        with np.load(snapshot_path, allow_pickle=False) as z:
+            if json.loads(str(z["meta"])).get("fingerprint") != _source_fingerprint(data_files, json_path):
+                return None
+            return _decode_column(z["id_codes"], z["id_vocab"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _users_from_chunks(chunks, valid_locations=None):
+    """(users, known_locations) từ các phần dữ liệu: chuẩn hoá và tạo User từng phần một.
+
+    Nơi ở đã biết của NORMALIZER được bổ sung dần trước khi chuẩn hoá mỗi phần; khi đã đọc hết, cột
+    Nơi ở của các phần trước được chuẩn hoá lại với đủ nơi ở đã biết, nên kết quả không phụ thuộc
+    chunk_rows hay cách chia file (giống nạp 1 DataFrame).
+    """
+    global NORMALIZER
+    NORMALIZER = DataNormalizer(valid_locations=valid_locations)
+    users = []
+    known_locations = {}
+    raw_locations = []   # (user đầu tiên của phần, codes, giá trị khác nhau) của cột Nơi ở
+    chunks = iter(chunks)
+    while True:
+        with METRICS.phase("load"):
+            df = next(chunks, None)
+        if df is None:
+            break
+        with METRICS.phase("normalize"):
+            new = [x for x in df['Nơi ở'].dropna().astype(str).unique().tolist() if x not in known_locations]
+            known_locations.update(dict.fromkeys(new))
+            NORMALIZER.add_known_locations(new)
+            raw_locations.append((len(users), *_factorize_column(df.reset_index(drop=True), 'Nơi ở')))
+            users.extend(User.from_dataframe(df))
+    with METRICS.phase("normalize"):
+        for start, codes, uniques in raw_locations[:-1]:   # phần cuối đã chuẩn hoá với đủ nơi ở
+            values = _clean_distinct(uniques).map(NORMALIZER.normalize_location).tolist()
+            na_value = NORMALIZER.normalize_location("-")
+            for u, loc in zip(users[start:], _take_distinct(values, codes, na_value)):
+                u.location = loc
+    return users, list(known_locations)
+
+
+def load_users(folder_path, json_filename='ketban.json', use_snapshot=True, chunk_rows=LOAD_CHUNK_ROWS,
+               workers=None):
+    """Nạp users đã chuẩn hoá + cấu hình, ưu tiên snapshot; tự build lại snapshot khi nguồn thay đổi.
+
+    Dữ liệu là mọi file .xlsx/.csv trong thư mục, đọc theo từng phần chunk_rows dòng
+    (nhiều file: đọc song song bằng tối đa `workers` tiến trình, xem iter_data_chunks).
+    Đồng thời khởi tạo NORMALIZER toàn cục (cần cho get_input). User đã gộp từ nhật ký sự kiện
+    (COMPACTED_FILENAME, xem compact_events) thay/thêm vào user của dữ liệu gốc.
+    Trả về (users, loc_map, bonus_rules, interest_groups); users = None nếu lỗi.
+    """
+    global NORMALIZER
+
+    data_files = _find_data_files(folder_path)
+    json_path = os.path.join(folder_path, json_filename)
+    snapshot_path = os.path.join(folder_path, SNAPSHOT_FILENAME)
+
+    fingerprint = None
+    if use_snapshot and data_files and os.path.exists(json_path):
+        fingerprint = _source_fingerprint(data_files, json_path)
+        with METRICS.phase("load"):
+            snap = load_snapshot(snapshot_path, fingerprint)
+        if snap is not None:
+            users, known_locations, l_m, b_r, i_g = snap
+            print(f"--- Đang nạp snapshot: {SNAPSHOT_FILENAME} ({len(users)} người dùng) ---")
+            NORMALIZER = DataNormalizer(known_locations=known_locations, valid_locations=l_m)
+            return _with_compacted(folder_path, users), l_m, b_r, i_g
+
+    if not data_files:
+        print(f"Lỗi: Không tìm thấy file dữ liệu (.xlsx/.csv) trong {folder_path}")
+        return None, {}, [], {}
+    print(f"--- Đang nạp dữ liệu: {', '.join(os.path.basename(f) for f in data_files)} ---")
+    try:
+        l_m, b_r, i_g = load_config(folder_path, json_filename)
+        users, known_locations = _users_from_chunks(iter_data_chunks(data_files, chunk_rows, workers), l_m)
+    except Exception as e:
+        print(f"Lỗi hệ thống: {e}")
+        return None, {}, [], {}
+
+    if fingerprint is not None:
+        try:
+            save_snapshot(snapshot_path, users, known_locations, l_m, b_r, i_g, fingerprint)
+        except OSError as e:
+            print(f"Không ghi được snapshot: {e}")
+    return _with_compacted(folder_path, users), l_m, b_r, i_g
+
+
+# ==========================================
+# Bảng đặc trưng, chấm điểm, SocialGraph, BFS/DFS và A*: ketban_graph.py
+# ==========================================
+
+
+def display_profile(u, label, me_id, graph, score, common_ids=None):
+    if common_ids is None:
+        common_ids = graph.common_friend_ids(me_id, u.id)
     common_names = [graph.users[cid].name for cid in common_ids if cid in graph.users]
 
     print(f"\n{label}. {u.name.upper()} (+{score})")
@@ -505,6 +1234,234 @@ def display_profile(u, label, me_id, graph, score):
     print("-" * 45)
 
 
+def user_to_dict(u, score=None, common_names=None):
+    """Hồ sơ user dạng dict (để xuất JSON); kèm điểm và tên bạn chung nếu có."""
+    out = {
+        "id": u.id,
+        "name": u.name,
+        "dob": u.dob,
+        "gender": u.gender,
+        "location": u.location,
+        "industry": u.industry,
+        "industry_group": u.industry_group,
+        "interests": u.interests,
+        "marital": u.marital,
+    }
+    if score is not None:
+        out["score"] = score
+    if common_names is not None:
+        out["common_friends"] = common_names
+    return out
+
+
+# Các trường hồ sơ giống get_input (key tiếng Anh hoặc tên cột Excel)
+PROFILE_FIELDS = (
+    ("name", "Họ và tên"),
+    ("dob", "Ngày sinh"),
+    ("gender", "Giới tính"),
+    ("location", "Nơi ở"),
+    ("industry", "Lĩnh vực/ngành nghề"),
+    ("interests", "Sở thích"),
+    ("marital", "Tình trạng hôn nhân"),
+)
+
+
+def user_from_profile(profile, uid="NEW_USER"):
+    """Tạo User từ dict hồ sơ (như get_input nhập); thiếu trường nào thì coi là "-".
+
+    "friends" (hoặc "Bạn chung (ID)"): danh sách/chuỗi id bạn bè, mặc định không có.
+    """
+    values = {}
+    for key, column in PROFILE_FIELDS:
+        v = profile.get(key, profile.get(column))
+        if isinstance(v, (list, tuple)):
+            v = "; ".join(str(x) for x in v)
+        values[key] = str(v).strip() if v is not None and str(v).strip() else "-"
+    friends = profile.get("friends", profile.get("Bạn chung (ID)")) or ""
+    if isinstance(friends, (list, tuple)):
+        friends = ", ".join(str(x) for x in friends)
+    return User(uid, values["name"], values["dob"], values["gender"], values["location"],
+                values["interests"], values["industry"], values["marital"], friends)
+
+
+def profile_of(u):
+    """Hồ sơ (dạng user_from_profile nhận) của user đã chuẩn hoá."""
+    profile = {key: getattr(u, key) for key, _ in PROFILE_FIELDS}
+    profile["interests"] = "; ".join(u.interests) if u.interests else "-"
+    profile["friends"] = list(u.friends_ids)
+    return profile
+
+
+# ==========================================
+# 2. NHẬT KÝ SỰ KIỆN (JSONL, CHỈ GHI THÊM)
+# Mỗi dòng 1 sự kiện: add_user / update_user (id + profile), add_friend / remove_friend (a, b).
+# Áp dụng tăng dần lên SocialGraph; compact_events gộp nhật ký thành file COMPACTED_FILENAME
+# (user đã chuẩn hoá khác với dữ liệu gốc), file dữ liệu gốc không bị sửa.
+# Áp dụng lại sự kiện đã gộp (vd. sau khi compact bị ngắt giữa chừng) không đổi kết quả.
+# ==========================================
+
+EVENTS_FILENAME = "ketban_events.jsonl"
+EVENT_OPS = ("add_user", "update_user", "add_friend", "remove_friend")
+COMPACTED_FILENAME = "ketban_compacted.npz"
+_COMPACTED_FORMAT = "ketban-compacted-1"   # không phải cache: không phụ thuộc SNAPSHOT_VERSION / file nguồn
+
+
+class EventLog:
+    """File JSONL chỉ ghi thêm; read_new() trả về các sự kiện chưa đọc (theo vị trí byte)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def append(self, op, **fields):
+        if op not in EVENT_OPS:
+            raise ValueError(f"sự kiện không hợp lệ: {op}")
+        event = {"op": op, **fields, "ts": time.time()}
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+        return event
+
+    def read_new(self):
+        """Các sự kiện từ self.offset tới dòng hoàn chỉnh cuối cùng (dòng đang ghi dở để lần sau)."""
+        if not os.path.exists(self.path):
+            return []
+        st = os.stat(self.path)
+        if st.st_size < self.offset or (self._inode is not None and st.st_ino != self._inode):
+            self.offset = 0   # file đã được gộp (compact_events, drop_read): phần còn lại đều là sự kiện mới
+        self._inode = st.st_ino
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        events = []
+        for raw in data[:end].splitlines():
+            if not raw.strip():
+                continue
+            try:
+                events.append(json.loads(raw))
+            except ValueError as e:
+                print(f"Bỏ qua sự kiện hỏng: {e}")
+        self.offset += end
+        return events
+
+    def drop_read(self):
+        """Xoá phần đã đọc khỏi file (giữ sự kiện ghi thêm sau lần read_new cuối)."""
+        with self._lock:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                rest = f.read()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(rest)
+            os.replace(tmp_path, self.path)
+            self.offset = 0
+
+
+def apply_event(graph, event):
+    """Áp dụng 1 sự kiện lên graph. Sự kiện sai định dạng -> ValueError."""
+    op = event.get("op")
+    if op in ("add_user", "update_user"):
+        uid = str(event.get("id", "")).strip()
+        if not uid.isdigit():
+            raise ValueError(f"{op}: id phải là số (id bạn bè chỉ nhận số): {uid!r}")
+        profile = dict(event.get("profile") or {})
+        old = graph.users.get(uid)
+        if op == "add_user" and old is not None:
+            raise ValueError(f"add_user: id {uid} đã tồn tại (sửa hồ sơ bằng update_user)")
+        if op == "update_user" and old is not None:
+            profile = {**profile_of(old), **profile}
+        graph.insert_user(user_from_profile(profile, uid=uid))
+    elif op in ("add_friend", "remove_friend"):
+        a, b = str(event.get("a", "")).strip(), str(event.get("b", "")).strip()
+        if not (a.isdigit() and b.isdigit()):
+            raise ValueError(f"{op}: cần 2 id số a, b")
+        if op == "add_friend":
+            graph.add_friendship(a, b)
+        else:
+            graph.remove_friendship(a, b)
+    else:
+        raise ValueError(f"sự kiện không hợp lệ: {op}")
+
+
+@METRICS.timed("events")
+def replay_events(graph, log):
+    """Áp dụng các sự kiện mới của `log` lên graph; trả về số sự kiện đã áp dụng."""
+    applied = 0
+    for event in log.read_new():
+        try:
+            apply_event(graph, event)
+            applied += 1
+        except ValueError as e:
+            print(f"Bỏ qua sự kiện: {e}")
+    return applied
+
+
+def load_events(graph, folder_path, log=None):
+    """Áp dụng nhật ký sự kiện của thư mục dữ liệu (nếu có) lên graph vừa dựng.
+
+    log: EventLog của chính thư mục đó, để sau này đọc tiếp các sự kiện mới (như ketban_service).
+    """
+    applied = replay_events(graph, log or EventLog(os.path.join(folder_path, EVENTS_FILENAME)))
+    if applied:
+        print(f"--- Đã áp dụng {applied} sự kiện từ {EVENTS_FILENAME} ---")
+    return applied
+
+
+def _user_state(u):
+    return (u.name, u.dob, u.gender, u.location, u.industry, u.industry_group, u.marital,
+            tuple(u.interests), tuple(u.friends_ids))
+
+
+def _load_compacted(folder_path):
+    """User đã gộp từ nhật ký (đã chuẩn hoá), [] nếu chưa gộp lần nào."""
+    path = os.path.join(folder_path, COMPACTED_FILENAME)
+    if not os.path.exists(path):
+        return []
+    snap = load_snapshot(path, _COMPACTED_FORMAT)
+    if snap is None:
+        raise ValueError(f"không đọc được {COMPACTED_FILENAME}")
+    return snap[0]
+
+
+def _with_compacted(folder_path, users):
+    """users của dữ liệu gốc, thay/thêm các user đã gộp (giữ thứ tự; user mới ở cuối)."""
+    compacted = _load_compacted(folder_path)
+    if not compacted:
+        return users
+    merged = {u.id: u for u in users}
+    merged.update((u.id, u) for u in compacted)
+    print(f"--- Đã nạp {len(compacted)} người dùng đã gộp từ {COMPACTED_FILENAME} ---")
+    return list(merged.values())
+
+
+def compact_events(folder_path, json_filename='ketban.json'):
+    """Gộp nhật ký sự kiện vào COMPACTED_FILENAME rồi xoá phần đã gộp khỏi nhật ký. Trả về số sự kiện đã gộp.
+
+    File gộp chứa giá trị đã chuẩn hoá (nạp lại không chuẩn hoá lần nữa) của mọi user khác với dữ liệu gốc
+    (user mới, hồ sơ sửa, bạn bè đổi); các file dữ liệu gốc (1 hay nhiều file) giữ nguyên giá trị thô.
+    Ghi ra file tạm rồi đổi tên.
+    """
+    log = EventLog(os.path.join(folder_path, EVENTS_FILENAME))
+    users, l_m, b_r, i_g = load_users(folder_path, json_filename)
+    if users is None:
+        return 0
+    import ketban_graph
+    compacted = {u.id for u in _load_compacted(folder_path)}
+    graph = ketban_graph.SocialGraph(users, l_m, b_r, i_g)
+    before = {uid: _user_state(u) for uid, u in graph.users.items()}
+    applied = replay_events(graph, log)
+    if not log.offset:
+        return 0
+    changed = [u for uid, u in graph.users.items() if uid in compacted or before.get(uid) != _user_state(u)]
+    save_snapshot(os.path.join(folder_path, COMPACTED_FILENAME), changed,
+                  list(dict.fromkeys(u.location for u in changed)), l_m, b_r, i_g, _COMPACTED_FORMAT)
+    log.drop_read()
+    return applied
+
+
 def get_input():
     print("-" * 50)
     print("   NHẬP THÔNG TIN CỦA BẠN ")
@@ -519,58 +1476,97 @@ def get_input():
     return User("NEW_USER", n, d, g, l, its, ind, m, "")
 
 
-def main():
-    global NORMALIZER
+def parse_bfs_budget(text):
+    """"max_depth=3,max_nodes=50000,time_budget=0.5" (biến KETBAN_BFS_BUDGET) -> dict tham số cho iter_bfs."""
+    budget = {}
+    for item in filter(None, (x.strip() for x in text.split(","))):
+        key, _, value = item.partition("=")
+        key = key.strip()
+        if key not in ("max_depth", "max_nodes", "time_budget"):
+            raise ValueError(f"giới hạn BFS không hợp lệ: {key}")
+        budget[key] = float(value) if key == "time_budget" else int(value)
+    return budget
+
 
+def export_metrics(target):
+    """Ghi METRICS theo KETBAN_METRICS: đường dẫn .prom (Prometheus) / .json, hoặc in JSON ra màn hình."""
+    if target.endswith(".prom"):
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(METRICS.to_prometheus())
+    elif target.endswith(".json"):
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(METRICS.to_json())
+    else:
+        print("\n" + METRICS.to_json())
+
+
+def main():
+    from ketban_graph import SocialGraph, TopK, iter_bfs, iter_dfs, run_astar, stream_top_k
     path = r"E:\ttnt"
-    df, l_m, b_r, i_g = load_data(path)
-    if df is None:
+    users, l_m, b_r, i_g = load_users(path)
+    if users is None:
         return
 
-    known_locations = df['Nơi ở'].dropna().astype(str).unique().tolist()
-    NORMALIZER = DataNormalizer(known_locations=known_locations)
-
-    users = [User.from_row(r) for _, r in df.iterrows()]
-    graph = SocialGraph(users, l_m, b_r, i_g)
+    graph = SocialGraph(users, l_m, b_r, i_g, compact=bool(os.environ.get("KETBAN_COMPACT")))
+    load_events(graph, path)
 
     me = get_input()
     graph.add_new_user(me)
 
     start_exec = time.time()
-    bfs_res = run_bfs(graph, me.id)
-    dfs_res = run_dfs(graph, me.id)
-
-    combined = {c['user'].id: c for c in bfs_res + dfs_res}.values()
-    top_30_all = sorted(combined, key=lambda x: x['score'], reverse=True)[:30]
+    upper = graph.max_score(me)
+    top_all, top_bfs, top_dfs = TopK(30, upper), TopK(30, upper), TopK(30, upper)
+    budget, bfs_stats = parse_bfs_budget(os.environ.get("KETBAN_BFS_BUDGET", "")), {}
+    with METRICS.phase("bfs"):
+        stream_top_k(iter_bfs(graph, me.id, stats=bfs_stats, **budget), top_all, top_bfs)
+    if bfs_stats.get("truncated"):
+        print(f"--- BFS dừng sớm (giới hạn {bfs_stats['truncated']}), dùng kết quả tốt nhất đã tìm được ---")
+    with METRICS.phase("dfs"):
+        stream_top_k(iter_dfs(graph, me.id), top_all, top_dfs)
+    with METRICS.phase("merge"):
+        top_30_all = top_all.results()
+        shown = [c['user'].id for c in top_30_all + top_bfs.results() + top_dfs.results()]
+        common = graph.common_friend_ids_batch(me.id, shown)
 
     print("\n" + "*" * 60 + "\n DANH SÁCH TOP 30 NGƯỜI ĐÃ LỌC\n" + "*" * 60)
-    for i, c in enumerate(top_30_all):
-        display_profile(c['user'], i + 1, me.id, graph, c['score'])
+    with METRICS.phase("render"):
+        for i, c in enumerate(top_30_all):
+            display_profile(c['user'], i + 1, me.id, graph, c['score'], common[c['user'].id])
 
     if top_30_all:
         top_1 = top_30_all[0]
         print("\n" + "!" * 60 + "\n          GỢI Ý PHÙ HỢP NHẤT (TOP-1)\n" + "!" * 60)
-        display_profile(top_1['user'], "TOP-1", me.id, graph, top_1['score'])
+        with METRICS.phase("render"):
+            display_profile(top_1['user'], "TOP-1", me.id, graph, top_1['score'], common[top_1['user'].id])
 
         print("\n CHI PHÍ/ĐƯỜNG ĐI ĐẾN TOP 1 (A*)")
-        path_astar = run_astar(graph, me.id, top_1['user'].id)
+        astar_stats = {}
+        path_astar = run_astar(graph, me.id, top_1['user'].id, stats=astar_stats)
         if path_astar:
             print(" -> ".join([graph.users[p].name for p in path_astar]))
+            print(f"Chi phí: {len(path_astar) - 1} bước | mở rộng {astar_stats['expanded']} nút, "
+                  f"lưu {astar_stats['stored']} nút")
         else:
             print("Không tìm thấy đường đi.")
 
     print(f"\n THỜI GIAN THỰC THI : {time.time() - start_exec:.4f} giây")
 
-    print("\n" + "=" * 60 + "\n DANH SÁCH TOP 30 LỌC TỪ BFS \n" + "=" * 60)
-    for i, c in enumerate(sorted(bfs_res, key=lambda x: x['score'], reverse=True)[:30]):
-        display_profile(c['user'], i + 1, me.id, graph, c['score'])
+    with METRICS.phase("render"):
+        print("\n" + "=" * 60 + "\n DANH SÁCH TOP 30 LỌC TỪ BFS \n" + "=" * 60)
+        for i, c in enumerate(top_bfs.results()):
+            display_profile(c['user'], i + 1, me.id, graph, c['score'], common[c['user'].id])
 
-    print("\n" + "=" * 60 + "\n DANH SÁCH TOP 30 LỌC TỪ DFS \n" + "=" * 60)
-    for i, c in enumerate(sorted(dfs_res, key=lambda x: x['score'], reverse=True)[:30]):
-        display_profile(c['user'], i + 1, me.id, graph, c['score'])
+        print("\n" + "=" * 60 + "\n DANH SÁCH TOP 30 LỌC TỪ DFS \n" + "=" * 60)
+        for i, c in enumerate(top_dfs.results()):
+            display_profile(c['user'], i + 1, me.id, graph, c['score'], common[c['user'].id])
 
     print(f"\n THỜI GIAN THỰC THI TỔNG CỘNG: {time.time() - start_exec:.4f} giây")
 
+    if METRICS.enabled:
+        export_metrics(os.environ.get("KETBAN_METRICS", ""))
+
 
 if __name__ == "__main__":
-    main()
+    # Chạy qua module "ketban" (không phải bản __main__) để ketban_graph dùng chung METRICS với main
+    import ketban
+    ketban.main()
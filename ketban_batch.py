@@ -0,0 +1,202 @@
+"""Gợi ý kết bạn hàng loạt.
+
+Đọc hồ sơ từ CSV hoặc JSONL (các trường như get_input: name, dob, gender, location, industry,
+interests, marital - hoặc tên cột Excel), chia cho 1 pool tiến trình và ghi kết quả dần ra
+file JSONL (mỗi dòng 1 hồ sơ, đúng thứ tự đầu vào).
+
+Các mảng của graph (ketban.GraphArrays) được chép 1 lần vào shared memory; worker gắn vào
+bản chỉ-đọc đó thay vì nhận graph đã pickle. Worker chỉ trả về (dòng, điểm, cột bạn chung),
+tiến trình chính đổi sang hồ sơ đầy đủ khi ghi.
+
+    python ketban_batch.py profiles.csv results.jsonl --data E:\\ttnt --workers 8
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+import ketban
+
+
+def read_profiles(path):
+    """Sinh lần lượt các dict hồ sơ từ file .csv hoặc .jsonl."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class SharedArrays:
+    """Các mảng NumPy đặt trong shared memory, gắn lại được ở tiến trình khác qua `spec`."""
+
+    def __init__(self, blocks, arrays):
+        self._blocks = blocks
+        self.arrays = arrays
+
+    @classmethod
+    def create(cls, arrays):
+        blocks, out = [], {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+            view[...] = arr
+            blocks.append(shm)
+            out[name] = view
+        return cls(blocks, out)
+
+    @property
+    def spec(self):
+        return {name: (shm.name, arr.shape, arr.dtype.str)
+                for shm, (name, arr) in zip(self._blocks, self.arrays.items())}
+
+    @classmethod
+    def attach(cls, spec):
+        blocks, out = [], {}
+        for name, (shm_name, shape, dtype) in spec.items():
+            # Worker của Pool dùng chung resource_tracker với tiến trình chính: chỉ tiến trình chính unlink
+            shm = shared_memory.SharedMemory(name=shm_name)
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            view.flags.writeable = False
+            blocks.append(shm)
+            out[name] = view
+        return cls(blocks, out)
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for shm in self._blocks:
+            shm.close()
+            if unlink:
+                shm.unlink()
+        self._blocks = []
+
+
+# ---- Phía worker ----
+
+_WORKER = {}
+
+
+def _init_worker(spec, codes, normalizer_args):
+    shared = SharedArrays.attach(spec)
+    _WORKER["shared"] = shared
+    _WORKER["arrays"] = ketban.GraphArrays(shared.arrays, codes)
+    ketban.NORMALIZER = ketban.DataNormalizer(**normalizer_args)
+
+
+def _recommend_chunk(chunk, k, arrays=None):
+    """[(số thứ tự, kết quả hoặc None, lỗi hoặc None)] cho 1 lô (số thứ tự, hồ sơ)."""
+    if arrays is None:
+        arrays = _WORKER["arrays"]
+    out = []
+    for i, profile in chunk:
+        try:
+            user = ketban.user_from_profile(profile)
+            out.append((i, [(r, s, c.tolist()) for r, s, c in arrays.recommend(user, k)], None))
+        except Exception as e:  # 1 hồ sơ lỗi không làm hỏng cả lô
+            out.append((i, None, f"{type(e).__name__}: {e}"))
+    return out
+
+
+def _recommend_task(args):
+    chunk, k = args
+    return _recommend_chunk(chunk, k)
+
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ---- Phía tiến trình chính ----
+
+def _normalizer_args(normalizer):
+    """Tham số để dựng lại 1 DataNormalizer tương đương trong worker."""
+    return {"known_locations": sorted(normalizer.known_locations), "fuzzy": normalizer.fuzzy,
+            "valid_locations": normalizer.valid_locations}
+
+
+def run_batch(graph, profiles, out_path, workers=None, k=30, chunksize=64):
+    """Gợi ý cho mọi hồ sơ trong `profiles`, ghi JSONL ra out_path. Trả về số hồ sơ đã xử lý.
+
+    workers=0: chạy ngay trong tiến trình này (không pool, không shared memory).
+    """
+    ga = ketban.GraphArrays.from_graph(graph)
+    ids = graph.row_ids()
+    col_ids = graph.friend_matrix().col_ids
+    users = graph.users
+    chunks = _chunks(enumerate(profiles), chunksize)
+
+    shared = pool = None
+    if workers == 0:
+        results = (_recommend_chunk(c, k, ga) for c in chunks)
+    else:
+        shared = SharedArrays.create(ga.arrays)
+        pool = Pool(workers or os.cpu_count(), initializer=_init_worker,
+                    initargs=(shared.spec, ga.codes, _normalizer_args(ketban.NORMALIZER)))
+        results = pool.imap(_recommend_task, ((c, k) for c in chunks))
+
+    count = 0
+    try:
+        with open(out_path, "w", encoding="utf-8") as f:
+            for batch in results:
+                for i, recs, error in batch:
+                    if error is not None:
+                        line = {"index": i, "error": error}
+                    else:
+                        line = {"index": i, "results": [
+                            ketban.user_to_dict(users[ids[r]], s, [users[col_ids[c]].name for c in cols
+                                                                   if col_ids[c] in users])
+                            for r, s, cols in recs]}
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                    count += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if shared is not None:
+            shared.close(unlink=True)
+    return count
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("input", help="file hồ sơ .csv hoặc .jsonl")
+    ap.add_argument("output", help="file kết quả .jsonl")
+    ap.add_argument("--data", default=r"E:\ttnt", help="thư mục chứa file .xlsx và ketban.json")
+    ap.add_argument("--workers", type=int, default=None, help="số tiến trình (mặc định: số CPU; 0 = không dùng pool)")
+    ap.add_argument("--k", type=int, default=30)
+    ap.add_argument("--chunksize", type=int, default=64)
+    ap.add_argument("--compact", action="store_true", help="danh sách kề dạng CSR (ít bộ nhớ hơn)")
+    ap.add_argument("--fuzzy", action="store_true", help="chuẩn hoá chịu lỗi gõ (như KETBAN_FUZZY=1)")
+    args = ap.parse_args()
+
+    if args.fuzzy:
+        ketban.FUZZY_NORMALIZE = True
+
+    users, l_m, b_r, i_g = ketban.load_users(args.data)
+    if users is None:
+        return
+    graph = ketban.SocialGraph(users, l_m, b_r, i_g, compact=args.compact)
+    ketban.load_events(graph, args.data)
+    start = time.perf_counter()
+    n = run_batch(graph, read_profiles(args.input), args.output, args.workers, args.k, args.chunksize)
+    elapsed = time.perf_counter() - start
+    print(f"--- Đã gợi ý cho {n} hồ sơ trong {elapsed:.2f}s ({n / max(elapsed, 1e-9):.1f} hồ sơ/s) "
+          f"-> {args.output} ---")
+
+
+if __name__ == "__main__":
+    main()
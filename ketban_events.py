@@ -0,0 +1,85 @@
+"""Ghi sự kiện vào nhật ký ketban_events.jsonl và gộp nhật ký vào ketban_compacted.npz.
+
+    python ketban_events.py add-user --name "Nguyễn An" --location HN --interests "Yoga; Đọc sách" --friends 12,45
+    python ketban_events.py update-user 30001 --location "Đà Nẵng"
+    python ketban_events.py add-friend 30001 12
+    python ketban_events.py remove-friend 30001 45
+    python ketban_events.py compact
+
+Sự kiện được áp dụng tăng dần khi ketban.py / ketban_service.py / ketban_batch.py nạp dữ liệu;
+ketban_service.py đang chạy cũng đọc tiếp các sự kiện mới (--events-interval).
+add-user với id đã có là lỗi (dùng update-user). compact không sửa các file dữ liệu gốc: user đã đổi được
+ghi (đã chuẩn hoá) vào ketban_compacted.npz, load_users nạp file này đè lên dữ liệu gốc.
+"""
+import argparse
+import os
+
+import ketban
+
+
+def _user_ids(folder_path, log):
+    """Id của mọi user trong dữ liệu gốc + phần đã gộp + nhật ký.
+
+    Dữ liệu gốc lấy từ cột id của snapshot (không dựng lại / chuẩn hoá dữ liệu); chỉ khi chưa có snapshot
+    khớp nguồn mới nạp dữ liệu 1 lần (load_users ghi snapshot cho các lần sau).
+    """
+    ids = ketban.snapshot_user_ids(folder_path)
+    if ids is None:
+        users, _, _, _ = ketban.load_users(folder_path)
+        ids = {u.id for u in users or []}
+    else:
+        ids = set(ids) | {u.id for u in ketban._load_compacted(folder_path)}
+    for event in ketban.EventLog(log.path).read_new():
+        if event.get("op") == "add_user":
+            ids.add(str(event.get("id", "")).strip())
+    return ids
+
+
+def _next_user_id(ids):
+    """Id số lớn nhất trong `ids`, cộng 1."""
+    return str(max((int(x) for x in ids if x.isdigit()), default=0) + 1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data", default=r"E:\ttnt", help="thư mục chứa file .xlsx và ketban.json")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for cmd in ("add-user", "update-user"):
+        p = sub.add_parser(cmd)
+        if cmd == "update-user":
+            p.add_argument("id")
+        else:
+            p.add_argument("--id", help="mặc định: id lớn nhất + 1")
+        for key, _ in ketban.PROFILE_FIELDS:
+            p.add_argument(f"--{key}")
+        p.add_argument("--friends", help="các id bạn bè, cách nhau bởi dấu phẩy")
+    for cmd in ("add-friend", "remove-friend"):
+        p = sub.add_parser(cmd)
+        p.add_argument("a")
+        p.add_argument("b")
+    sub.add_parser("compact", help="gộp nhật ký vào ketban_compacted.npz")
+    args = ap.parse_args()
+
+    log = ketban.EventLog(os.path.join(args.data, ketban.EVENTS_FILENAME))
+    if args.cmd in ("add-user", "update-user"):
+        profile = {key: getattr(args, key) for key, _ in ketban.PROFILE_FIELDS if getattr(args, key) is not None}
+        if args.friends is not None:
+            profile["friends"] = [x.strip() for x in args.friends.split(",") if x.strip()]
+        uid = args.id
+        if args.cmd == "add-user":
+            ids = _user_ids(args.data, log)
+            if uid in ids:
+                ap.error(f"id {uid} đã tồn tại, dùng update-user để sửa hồ sơ")
+            uid = uid or _next_user_id(ids)
+        event = log.append(args.cmd.replace("-", "_"), id=uid, profile=profile)
+    elif args.cmd in ("add-friend", "remove-friend"):
+        event = log.append(args.cmd.replace("-", "_"), a=args.a, b=args.b)
+    else:
+        n = ketban.compact_events(args.data)
+        print(f"--- Đã gộp {n} sự kiện vào {ketban.COMPACTED_FILENAME} ---")
+        return
+    print(f"--- Đã ghi sự kiện {event['op']} vào {ketban.EVENTS_FILENAME} ---")
+
+
+if __name__ == "__main__":
+    main()
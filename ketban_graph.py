@@ -0,0 +1,2119 @@
+"""Phần tính toán của ketban: bảng đặc trưng và chấm điểm, các cấu trúc đồ thị (CSRAdjacency,
+FriendMatrix, InterestLSH, GraphArrays, Components), SocialGraph, duyệt BFS/DFS và A* (Landmarks).
+
+Chuẩn hoá, nạp dữ liệu, snapshot, nhật ký sự kiện và CLI ở ketban.py; các tên trong module này vẫn
+dùng được qua ketban.X (vd. ketban.SocialGraph).
+"""
+import heapq
+import itertools
+import sys
+import time
+from collections import deque
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from ketban import DEFAULT_INTEREST_GROUPS, METRICS, _MISSING, _lookup_tables, _norm_key
+
+
+# ==========================================
+# 1. BẢNG ĐẶC TRƯNG DẠNG CỘT (NumPy) CHO CHẤM ĐIỂM HÀNG LOẠT
+# ==========================================
+
+_WORD_BITS = 64
+_WORD_MASK = (1 << _WORD_BITS) - 1
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount_rows(words):
+    """Số bit 1 trên mỗi dòng của mảng uint64 (n, W)."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT8[words.view(np.uint8)].reshape(len(words), -1).sum(axis=1, dtype=np.int32)
+
+
+def _mask_words(mask, n_words):
+    return [(mask >> (_WORD_BITS * w)) & _WORD_MASK for w in range(n_words)]
+
+
+class _FeatureTable:
+    """Đặc trưng đã mã hoá của mọi user trong graph, lưu theo cột (mỗi user 1 dòng).
+
+    Thêm user là O(1) khấu hao (mảng tăng dung lượng gấp đôi khi đầy).
+    """
+
+    def __init__(self, capacity=1024):
+        self.ids = []
+        self.row_of = {}
+        self.n = 0
+        self.words = 1
+        self.loc = np.zeros(capacity, dtype=np.int32)
+        self.ind = np.zeros(capacity, dtype=np.int32)
+        self.grp = np.zeros(capacity, dtype=np.int32)
+        self.cls = np.zeros(capacity, dtype=np.int32)   # ProfileClasses: lớp tương đương của dòng
+        self.imask = np.zeros((capacity, 1), dtype=np.uint64)
+
+    def _reserve(self, rows, words):
+        cap = len(self.loc)
+        if rows > cap:
+            new_cap = max(rows, cap * 2)
+            for name in ("loc", "ind", "grp", "cls"):
+                arr = np.zeros(new_cap, dtype=np.int32)
+                arr[:self.n] = getattr(self, name)[:self.n]
+                setattr(self, name, arr)
+            cap = new_cap
+        if rows > len(self.imask) or words > self.words:
+            words = max(words, self.words)
+            arr = np.zeros((cap, words), dtype=np.uint64)
+            arr[:self.n, :self.words] = self.imask[:self.n]
+            self.imask = arr
+            self.words = words
+
+    def add_many(self, users, keys=None):
+        """keys: khoá của từng dòng (mặc định u.id)."""
+        users = list(users)
+        keys = [u.id for u in users] if keys is None else list(keys)
+        new = [key for key in keys if key not in self.row_of]
+        max_bits = max((u.interest_mask.bit_length() for u in users), default=0)
+        self._reserve(self.n + len(new), max(1, -(-max_bits // _WORD_BITS)))
+        for key in new:
+            self.row_of[key] = len(self.ids)
+            self.ids.append(key)
+        rows = np.fromiter((self.row_of[key] for key in keys), dtype=np.int64, count=len(users))
+        self.n = len(self.ids)
+        self.loc[rows] = [u.loc_code for u in users]
+        self.ind[rows] = [u.ind_code for u in users]
+        self.grp[rows] = [u.grp_code for u in users]
+        self.cls[rows] = [u.profile_class for u in users]
+        self.imask[rows] = np.array([_mask_words(u.interest_mask, self.words) for u in users],
+                                    dtype=np.uint64).reshape(len(users), self.words)
+
+    def add(self, user):
+        self.add_many([user])
+
+    def remove(self, uid):
+        """Xoá dòng của uid bằng cách chuyển dòng cuối vào chỗ trống."""
+        row = self.row_of.pop(uid, None)
+        if row is None:
+            return
+        last = self.n - 1
+        last_id = self.ids.pop()
+        if row != last:
+            self.ids[row] = last_id
+            self.row_of[last_id] = row
+            for arr in (self.loc, self.ind, self.grp, self.cls, self.imask):
+                arr[row] = arr[last]
+        self.n = last
+
+
+PROFILE_CLASS_MIN_MEAN = 2.0   # cỡ lớp trung bình tối thiểu để chấm điểm theo lớp có lợi
+
+
+class ProfileClasses:
+    """Lớp tương đương theo chữ ký đặc trưng (loc_code, ind_code, grp_code, interest_mask).
+
+    User cùng lớp có điểm calculate_score với 1 query giống hệt nhau, trừ phần bạn chung: phần đó
+    chỉ cần tính 1 lần cho mỗi lớp (xem signature_score). table: đặc trưng của mỗi lớp, dòng = id lớp;
+    lớp đã rỗng trả id (và dòng) lại cho lớp mới kế tiếp, nên số dòng không vượt số lớp còn user lớn nhất.
+    """
+
+    def __init__(self):
+        self.class_of = {}
+        self.size = []
+        self.n_users = 0
+        self.n_classes = 0   # số lớp còn user
+        self.table = _FeatureTable()
+        self._signature_of = []
+        self._free = []
+
+    @staticmethod
+    def signature(u):
+        return u.loc_code, u.ind_code, u.grp_code, u.interest_mask
+
+    def add(self, u):
+        """Gắn u.profile_class (u đã được encode)."""
+        sig = self.signature(u)
+        cid = self.class_of.get(sig)
+        if cid is None:
+            if self._free:
+                cid = self._free.pop()
+                self._signature_of[cid] = sig
+            else:
+                cid = len(self.size)
+                self.size.append(0)
+                self._signature_of.append(sig)
+            self.class_of[sig] = cid
+        u.profile_class = cid
+        if not self.size[cid]:   # lớp mới: dòng mới hoặc ghi đè dòng của lớp đã rỗng
+            self.table.add_many([u], keys=[cid])
+            self.n_classes += 1
+        self.size[cid] += 1
+        self.n_users += 1
+
+    def remove(self, u):
+        cid = u.profile_class
+        self.size[cid] -= 1
+        self.n_users -= 1
+        if not self.size[cid]:
+            self.n_classes -= 1
+            del self.class_of[self._signature_of[cid]]
+            self._free.append(cid)
+
+    @property
+    def shared(self):
+        """Cỡ lớp trung bình đủ lớn để chấm điểm theo lớp rẻ hơn theo từng user."""
+        return self.n_users >= PROFILE_CLASS_MIN_MEAN * max(self.n_classes, 1)
+
+    def stats(self):
+        """Thống kê cỡ lớp: số user/lớp, lớp lớn nhất, số lớp 1 user, số user thuộc lớp >= 2 user."""
+        sizes = np.array(self.size, dtype=np.int64)
+        sizes = sizes[sizes > 0]
+        return {
+            "users": self.n_users,
+            "classes": self.n_classes,
+            "mean_size": self.n_users / max(self.n_classes, 1),
+            "max_size": int(sizes.max(initial=0)),
+            "singletons": int(np.count_nonzero(sizes == 1)),
+            "users_in_shared": int(sizes[sizes > 1].sum()),
+        }
+
+
+def _location_tiers(bonus_rules):
+    """bonus_config -> [(max_diff, điểm)] tăng dần theo max_diff; không có cấu hình thì chỉ +1 khi trùng nơi ở."""
+    tiers = []
+    for rule in bonus_rules or []:
+        try:
+            tiers.append((float(rule["max_diff"]), int(rule["points"])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return sorted(tiers) or [(0.0, 1)]
+
+
+class _FeatureCodes:
+    """Từ điển mã hoá đặc trưng của 1 graph (code 0 = "-"/không xét); picklable để gửi sang tiến trình khác.
+
+    loc_bonus[a, b]: điểm khoảng cách giữa nơi ở code a và b theo bonus_config và loc_map
+    (|km_a - km_b| <= max_diff của bậc đầu tiên khớp, bỏ qua bậc max_diff = 0; cùng nơi ở luôn được điểm
+    bậc thấp nhất).
+    Dòng/cột 0 ("-") và dòng/cột cuối (code -1: nơi ở lạ của user truy vấn) bằng 0.
+    """
+
+    def __init__(self, interest_groups_norm, loc_map=None, bonus_rules=None):
+        self.loc = {}
+        self.ind = {}
+        self.grp = {}
+        self.interest_bits = {}
+        self.group_keys = _lookup_tables()["industry_group_keys_norm"]   # tên trường ngành nghề: ind_code = 0
+        self.interest_bit_groups = []   # bit sở thích -> bitmask các trường sở thích chứa nó
+        self.group_interest_masks = []  # trường sở thích -> bitmask các sở thích con
+        for gi, members in enumerate(interest_groups_norm.values()):
+            gmask = 0
+            for key in members:
+                bit = self.interest_bit(key)
+                self.interest_bit_groups[bit] |= 1 << gi
+                gmask |= 1 << bit
+            self.group_interest_masks.append(gmask)
+
+        self.loc_km = {}
+        for name, km in (loc_map or {}).items():
+            try:
+                self.loc_km[name] = float(km)
+            except (TypeError, ValueError):
+                continue
+        self.loc_tiers = _location_tiers(bonus_rules)
+        for name in self.loc_km:
+            self.code(self.loc, name)
+        self._build_loc_bonus()
+
+    def _build_loc_bonus(self, capacity=0):
+        """Dựng bảng loc_bonus với sức chứa `capacity` dòng (dư ra để thêm nơi ở mới không phải dựng lại)."""
+        n = max(capacity, len(self.loc) + 2)
+        km = np.full(n, np.nan)   # NaN: không có trong loc_map -> không khớp bậc nào
+        for name, c in self.loc.items():
+            km[c] = self.loc_km.get(name, np.nan)
+        diff = np.abs(km[:, None] - km[None, :])
+        bonus = np.zeros((n, n), dtype=np.int32)
+        # Bậc max_diff = 0 là "cùng nơi ở": chỉ dành cho đường chéo (cùng code, tức cùng tên sau chuẩn hoá
+        # alias); 2 nơi khác nhau trùng số km (vd. 2 phía của mốc) chỉ được xét các bậc khoảng cách
+        for max_diff, points in reversed(self.loc_tiers):
+            if max_diff > 0:
+                bonus[diff <= max_diff] = points
+        same = np.arange(1, len(self.loc) + 1)
+        bonus[same, same] = self.loc_tiers[0][1]
+        self.loc_bonus = bonus
+        self.loc_bonus_rows = bonus.tolist()
+        self.max_loc_bonus = bonus.max(axis=1).tolist()
+
+    def _add_loc_bonus(self, code):
+        """Nơi ở mới: mọi tên trong loc_map đã có code từ đầu, nên nơi ở mới chỉ được điểm khi trùng chính nó."""
+        if code + 2 > len(self.loc_bonus):
+            self._build_loc_bonus(2 * len(self.loc_bonus))
+            return
+        same = self.loc_tiers[0][1]
+        self.loc_bonus[code, code] = same
+        self.loc_bonus_rows[code][code] = same
+        self.max_loc_bonus[code] = same
+
+    def location_code(self, location):
+        code = self.loc.get(location)
+        if code is None:
+            code = self.code(self.loc, location)
+            self._add_loc_bonus(code)
+        return code
+
+    @staticmethod
+    def code(table, value):
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table) + 1
+        return code
+
+    def interest_bit(self, key):
+        bit = self.interest_bits.get(key)
+        if bit is None:
+            bit = self.interest_bits[key] = len(self.interest_bits)
+            self.interest_bit_groups.append(0)
+        return bit
+
+    def groups_of_mask(self, mask):
+        groups = 0
+        while mask:
+            low = mask & -mask
+            groups |= self.interest_bit_groups[low.bit_length() - 1]
+            mask ^= low
+        return groups
+
+    def encode(self, u, register=True):
+        """Gắn đặc trưng dạng số nguyên cho user:
+        loc_code / ind_code / grp_code (0 = không xét), interest_mask, interest_group_mask.
+
+        register=False: không thêm giá trị mới vào từ điển (giá trị lạ -> code -1,
+        sở thích lạ bị bỏ khỏi mask) - dùng cho user truy vấn chưa thuộc graph.
+        """
+        if register:
+            code, bit = self.code, self.interest_bit
+        else:
+            def code(table, value):
+                return table.get(value, -1)
+
+            def bit(key):
+                return self.interest_bits.get(key)
+
+        if u.location == "-":
+            u.loc_code = 0
+        else:
+            u.loc_code = self.location_code(u.location) if register else self.loc.get(u.location, -1)
+        ind = _norm_key(u.industry)
+        u.ind_code = 0 if ind == "-" or ind in self.group_keys else code(self.ind, ind)
+        u.grp_code = 0 if u.industry_group == "-" else code(self.grp, u.industry_group)
+        mask = 0
+        for x in u.interests:
+            b = bit(_norm_key(x))
+            if b is not None:
+                mask |= 1 << b
+        u.interest_mask = mask
+        u.interest_group_mask = self.groups_of_mask(mask)
+
+
+def _score_rows(loc, ind, grp, imask, query_user, has_common, codes):
+    """Điểm calculate_score của query_user với từng dòng đặc trưng (mảng cột cùng độ dài n), theo codes.
+
+    has_common: mảng bool "có >= 1 bạn chung" theo dòng, hoặc None nếu query không có bạn nào.
+    """
+    n = len(loc)
+    words = imask.shape[1]
+    score = np.zeros(n, dtype=np.int32)
+
+    if query_user.loc_code:
+        score += codes.loc_bonus[query_user.loc_code][loc]
+
+    if has_common is not None:
+        score += has_common
+
+    q_words = np.array(_mask_words(query_user.interest_mask, words), dtype=np.uint64)
+    common = imask & q_words
+    score += 2 * _popcount_rows(common)
+
+    bonus = np.zeros(n, dtype=bool)
+    for gi, gmask in enumerate(codes.group_interest_masks):
+        if not query_user.interest_group_mask >> gi & 1:
+            continue
+        g_words = np.array(_mask_words(gmask, words), dtype=np.uint64)
+        bonus |= (imask & g_words).any(axis=1) & ~(common & g_words).any(axis=1)
+    score += bonus
+
+    ind_match = np.zeros(n, dtype=bool)
+    if query_user.ind_code:
+        ind_match = ind == query_user.ind_code
+        score += 2 * ind_match
+    if query_user.grp_code:
+        score += (grp == query_user.grp_code) & ~ind_match
+
+    return score
+
+
+class _BlockScorer:
+    """Chấm điểm 1 khối B query (là các dòng của chính bảng đặc trưng) với mọi dòng: mảng (B, n),
+    dòng b giống _score_rows(..., query b, has_common, codes).
+
+    Sở thích được trải thành ma trận 0/1 (n x số bit) nên số sở thích chung của cả khối là 1 phép
+    nhân ma trận; "có bạn chung" tra qua CSR chuyển vị (cột -> các dòng chứa cột đó), chỉ chạm
+    các dòng thật sự có bạn chung thay vì nhân cả ma trận bạn bè.
+    """
+
+    def __init__(self, loc, ind, grp, imask, indptr, indices, n_cols, codes):
+        n = len(loc)
+        self.loc, self.ind, self.grp, self.codes = loc, ind, grp, codes
+        bits = np.unpackbits(imask.view(np.uint8).reshape(n, -1), axis=1, bitorder="little")
+        used = np.flatnonzero(bits.any(axis=0))
+        n_bits = int(used[-1]) + 1 if len(used) else 0
+        self.bits = bits[:, :n_bits].astype(np.float32)
+        self.bits_t = np.ascontiguousarray(self.bits.T)
+        self.groups = []   # (các bit của trường sở thích, dòng có sở thích thuộc trường đó)
+        for gmask in codes.group_interest_masks:
+            sel = np.array([gmask >> b & 1 for b in range(n_bits)], dtype=bool)
+            if sel.any():
+                self.groups.append((sel, self.bits[:, sel].any(axis=1)))
+        order = np.argsort(indices, kind="stable")
+        self.col_rows = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))[order]
+        self.col_ptr = np.searchsorted(indices[order], np.arange(n_cols + 1))
+
+    def rows_with_common(self, cols):
+        """Các dòng có ít nhất 1 cột trong `cols` (có thể lặp)."""
+        if not len(cols):
+            return np.zeros(0, dtype=np.int64)
+        starts, ends = self.col_ptr[cols], self.col_ptr[cols + 1]
+        lens = ends - starts
+        return self.col_rows[np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(int(lens.sum()))]
+
+    def score(self, rows, friend_cols):
+        """rows: các dòng query; friend_cols: danh sách mảng cột "bạn" của từng query."""
+        b, n = len(rows), len(self.loc)
+        q = self.bits[rows]
+        score = self.codes.loc_bonus[self.loc[rows]][:, self.loc].astype(np.int16)   # dòng 0 = 0
+        score += (2 * (q @ self.bits_t)).astype(np.int16)
+        bonus = np.zeros((b, n), dtype=bool)
+        for sel, row_has in self.groups:
+            q_has = q[:, sel].any(axis=1)
+            if q_has.any():
+                none_common = (q[:, sel] @ self.bits_t[sel]) == 0
+                none_common &= row_has
+                none_common &= q_has[:, None]
+                bonus |= none_common
+        score += bonus
+        q_ind = self.ind[rows][:, None]
+        ind_match = (self.ind[None, :] == q_ind) & (q_ind > 0)
+        score += 2 * ind_match
+        q_grp = self.grp[rows][:, None]
+        score += (self.grp[None, :] == q_grp) & (q_grp > 0) & ~ind_match
+        common = np.zeros((b, n), dtype=bool)
+        for i, cols in enumerate(friend_cols):
+            common[i, self.rows_with_common(cols)] = True
+        score += common
+        return score
+
+
+def _top_rows_block(scores, k):
+    """_top_rows cho từng dòng của scores (B, n) điểm nguyên không âm: (chỉ số dòng (B, k), điểm (B, k)),
+    thiếu thì -1 / 0.
+
+    Ngưỡng (điểm thứ k) của mọi dòng lấy bằng 1 lần np.partition; các điểm bằng ngưỡng chỉ giữ
+    những dòng đầu tiên, nên mỗi dòng chỉ còn tối đa k phần tử phải sắp xếp.
+    """
+    b, n = scores.shape
+    out_rows = np.full((b, k), -1, dtype=np.int32)
+    out_scores = np.zeros((b, k), dtype=np.int32)
+    if not b or not n or not k:
+        return out_rows, out_scores
+    if n > k:
+        threshold = np.maximum(-np.partition(-scores, k - 1, axis=1)[:, k - 1], 1)   # điểm thứ k (điểm > 0)
+    else:
+        threshold = np.ones(b, dtype=scores.dtype)
+    qi, col = np.nonzero(scores >= threshold[:, None])
+    # Trên ngưỡng: lấy hết; đúng bằng ngưỡng: chỉ lấy các dòng đầu tiên (nonzero trả về theo thứ tự dòng)
+    at = scores[qi, col] == threshold[qi]
+    need = k - np.bincount(qi[~at], minlength=b)
+    eq_qi = qi[at]
+    first = np.ones(len(qi), dtype=bool)
+    first[at] = np.arange(len(eq_qi)) - np.searchsorted(eq_qi, eq_qi) < need[eq_qi]
+    qi, col = qi[first], col[first]
+    val = scores[qi, col]
+    order = np.lexsort((col, -val, qi))
+    qi, col, val = qi[order], col[order], val[order]
+    rank = np.arange(len(qi)) - np.searchsorted(qi, qi)
+    keep = rank < k
+    out_rows[qi[keep], rank[keep]] = col[keep]
+    out_scores[qi[keep], rank[keep]] = val[keep]
+    return out_rows, out_scores
+
+
+def _strong_rows(loc, grp, imask, query_user):
+    """Mảng bool các dòng là strong neighbor của query_user (như SocialGraph.strong_neighbor_ids)."""
+    strong = np.zeros(len(loc), dtype=bool)
+    if query_user.loc_code > 0:
+        strong |= loc == query_user.loc_code
+    if query_user.grp_code > 0:
+        strong |= grp == query_user.grp_code
+    if query_user.interest_mask.bit_count() >= 2:
+        q_words = np.array(_mask_words(query_user.interest_mask, imask.shape[1]), dtype=np.uint64)
+        strong |= _popcount_rows(imask & q_words) >= 2
+    return strong
+
+
+def _top_rows(scores, k):
+    """Chỉ số k dòng điểm cao nhất (điểm > 0), giảm dần; bằng điểm thì theo thứ tự dòng."""
+    k = min(k, int(np.count_nonzero(scores > 0)))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    # Ngưỡng = điểm thứ k; các dòng bằng ngưỡng lấy theo thứ tự dòng để kết quả ổn định
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    above = np.flatnonzero(scores > threshold)
+    idx = np.concatenate([above, np.flatnonzero(scores == threshold)[:k - len(above)]])
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+
+class FriendMatrix:
+    """Ma trận thưa CSR (user x id bạn): dòng r = tập "bạn" của user ở dòng r của bảng đặc trưng
+    (friend_adj, hoặc strong_neighbors với user mới).
+
+    Số bạn chung của 1 user với MỌI user = 1 phép nhân ma trận-vector A @ x,
+    với x là vector chỉ thị tập bạn của user đó. Dòng thêm/sửa sau khi dựng nằm trong
+    overlay (dict dòng -> cột) để không phải dựng lại CSR.
+    """
+
+    def __init__(self, row_sets):
+        self.col_of = {}
+        self.col_ids = []
+        self._overlay = {}
+        self.n_base = len(row_sets)
+        self.indptr = np.zeros(self.n_base + 1, dtype=np.int64)
+        cols = []
+        for r, ids in enumerate(row_sets):
+            cols.extend(self._col(x) for x in ids)
+            self.indptr[r + 1] = len(cols)
+        self.indices = np.array(cols, dtype=np.int32)
+
+    @classmethod
+    def from_arrays(cls, indptr, indices):
+        """FriendMatrix chỉ-đọc trên mảng CSR có sẵn (vd. nằm trong shared memory); không có col_of/col_ids."""
+        fm = cls.__new__(cls)
+        fm.col_of = {}
+        fm.col_ids = []
+        fm._overlay = {}
+        fm.n_base = len(indptr) - 1
+        fm.indptr = indptr
+        fm.indices = indices
+        return fm
+
+    def _col(self, fid):
+        c = self.col_of.get(fid)
+        if c is None:
+            c = self.col_of[fid] = len(self.col_ids)
+            self.col_ids.append(fid)
+        return c
+
+    def set_row(self, row, ids):
+        self._overlay[row] = np.array([self._col(x) for x in ids], dtype=np.int32)
+
+    @property
+    def overlay_size(self):
+        return len(self._overlay)
+
+    def row_cols(self, row):
+        cols = self._overlay.get(row)
+        if cols is None:
+            cols = self.indices[self.indptr[row]:self.indptr[row + 1]] if row < self.n_base else \
+                np.zeros(0, dtype=np.int32)
+        return cols
+
+    def _gather(self, rows):
+        """(vị trí trong rows, cột) của mọi phần tử thuộc các dòng `rows`."""
+        rows = np.asarray(rows, dtype=np.int64)
+        over = np.isin(rows, np.fromiter(self._overlay, dtype=np.int64, count=len(self._overlay)))
+        base = np.flatnonzero(~over & (rows < self.n_base))
+        starts = self.indptr[rows[base]]
+        lens = self.indptr[rows[base] + 1] - starts
+        segs = [np.repeat(base, lens)]
+        cols = [self.indices[np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(int(lens.sum()))]]
+        for i in np.flatnonzero(over).tolist():
+            c = self._overlay[int(rows[i])]
+            segs.append(np.full(len(c), i, dtype=np.int64))
+            cols.append(c)
+        return np.concatenate(segs), np.concatenate(cols).astype(np.int64)
+
+    def count_rows(self, rows, ids):
+        """(A @ x)[rows] với x chỉ thị tập `ids`, chỉ cho các dòng `rows` (không nhân cả ma trận).
+
+        Ít phần tử hơn |ids| thì tra từng cột trong ids thay vì dựng vector chỉ thị
+        (tập "bạn" của user truy vấn là strong neighbors, có thể rất lớn).
+        """
+        seg, cols = self._gather(rows)
+        if len(cols) < len(ids):
+            ids = ids if isinstance(ids, (set, frozenset)) else set(ids)
+            col_ids = self.col_ids
+            hit = np.fromiter((col_ids[c] in ids for c in cols.tolist()), dtype=bool, count=len(cols))
+        else:
+            hit = self.indicator(ids)[cols] > 0
+        return np.bincount(seg[hit], minlength=len(rows)).astype(np.int32)
+
+    def indicator(self, ids):
+        x = np.zeros(len(self.col_ids) + 1, dtype=np.int32)
+        cols = [self.col_of[i] for i in ids if i in self.col_of]
+        x[cols] = 1
+        return x
+
+    def matvec(self, x, n_rows):
+        """A @ x cho n_rows dòng đầu (x: vector chỉ thị theo cột)."""
+        out = np.zeros(n_rows, dtype=np.int32)
+        nb = min(self.n_base, n_rows)
+        if nb and len(self.indices):
+            # Thêm 1 phần tử 0 cuối để reduceat hợp lệ với dòng rỗng ở cuối; dòng rỗng đặt lại 0
+            vals = np.append(x[self.indices], 0)
+            starts = self.indptr[:nb]
+            sums = np.add.reduceat(vals, starts)
+            sums[starts == self.indptr[1:nb + 1]] = 0
+            out[:nb] = sums
+        for row, cols in self._overlay.items():
+            if row < n_rows:
+                out[row] = x[cols].sum() if len(cols) else 0
+        return out
+
+
+class AdjacencyDict(dict):
+    """Danh sách kề dạng dict id -> set id (chế độ thường).
+
+    add_edge / discard_edge là API chung với CSRAdjacency: graph chỉ sửa cạnh qua 2 hàm này.
+    """
+
+    def add_edge(self, a, b):
+        self.setdefault(a, set()).add(b)
+
+    def discard_edge(self, a, b):
+        nbrs = dict.get(self, a)
+        if nbrs is not None:
+            nbrs.discard(b)
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls((uid, set(ids)) for uid, ids in rows)
+
+    def transposed(self, keys=()):
+        """Danh sách kề ngược (v -> các u có cạnh u -> v); mọi id trong keys đều có mặt."""
+        rev = AdjacencyDict((uid, set()) for uid in keys)
+        for u, nbrs in self.items():
+            for v in nbrs:
+                rev.add_edge(v, u)
+        return rev
+
+
+class _RowIndex:
+    """id -> số dòng. Id là số nguyên viết chuẩn (cột Số thứ tự) tra qua mảng int32 theo giá trị;
+    id khác (hoặc quá lớn so với số dòng) dùng dict."""
+
+    def __init__(self):
+        self._arr = np.full(1024, -1, dtype=np.int32)
+        self._other = {}
+        self.n = 0
+
+    @staticmethod
+    def _number(key):
+        if key.isdigit() and (key[0] != "0" or len(key) == 1):
+            return int(key)
+        return -1
+
+    def add(self, key):
+        """Gán dòng mới (= số id đã thêm) cho key chưa có; trả về số dòng."""
+        row = self.n
+        i = self._number(key)
+        if 0 <= i < len(self._arr):
+            self._arr[i] = row
+        elif 0 <= i < 4 * (row + 1024):
+            grown = np.full(max(i + 1, 2 * len(self._arr)), -1, dtype=np.int32)
+            grown[:len(self._arr)] = self._arr
+            grown[i] = row
+            self._arr = grown
+        else:
+            self._other[key] = row
+        self.n += 1
+        return row
+
+    def get(self, key, default=None):
+        i = self._number(key)
+        if 0 <= i < len(self._arr):
+            row = int(self._arr[i])
+            return row if row >= 0 else default
+        return self._other.get(key, default)
+
+    @property
+    def nbytes(self):
+        return self._arr.nbytes + sys.getsizeof(self._other)
+
+
+class CSRAdjacency(MutableMapping):
+    """Danh sách kề id -> tập id lưu dạng CSR (indptr/indices int32 trỏ vào bảng id `names`),
+    dùng cho chế độ compact của SocialGraph.
+
+    Phần dựng sẵn là chỉ-đọc; thay đổi nằm trong overlay:
+    - add_edge(a, b) ghi b vào danh sách thêm của a (không bung cả dòng),
+    - adj[a] (để sửa), adj[a] = ..., del adj[a] chép dòng a ra 1 set riêng (None = đã xoá).
+    get() của dòng dựng sẵn trả về bản chỉ đọc; tập được dựng lại theo đúng thứ tự chèn như
+    dict-of-set tương ứng nên thứ tự duyệt (BFS/DFS/A*) không đổi so với AdjacencyDict.
+    Nhiều CSRAdjacency có thể dùng chung names/index (chỉ nối thêm id mới vào cuối).
+    """
+
+    def __init__(self, names, index, indptr, indices, n_rows):
+        self._names = names
+        self._index = index
+        self._indptr = indptr
+        self._indices = indices
+        self._n_rows = n_rows
+        self._rows = {}       # id -> set (dòng đã chép ra) hoặc None (đã xoá)
+        self._added = {}      # id -> [id thêm sau] cho dòng dựng sẵn chưa chép ra
+
+    @staticmethod
+    def _row_of(names, index, key):
+        row = index.get(key)
+        if row is None:
+            names.append(key)
+            row = index.add(key)
+        return row
+
+    @classmethod
+    def from_rows(cls, rows):
+        """rows: [(id, danh sách id kề)]; id trùng dùng dòng sau cùng (như dict).
+        Id kề chưa có dòng (bạn không thuộc dữ liệu) được nối vào cuối names."""
+        rows = dict(rows)
+        names, index = [], _RowIndex()
+        for uid in rows:
+            cls._row_of(names, index, uid)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        cols = []
+        for r, ids in enumerate(rows.values()):
+            cols.extend(cls._row_of(names, index, x) for x in dict.fromkeys(ids))
+            indptr[r + 1] = len(cols)
+        return cls(names, index, indptr, np.array(cols, dtype=np.int32), len(rows))
+
+    def fork(self):
+        """Bản sao dùng chung phần CSR chỉ-đọc (không chép mảng), overlay riêng."""
+        out = CSRAdjacency(self._names, self._index, self._indptr, self._indices, self._n_rows)
+        out._rows = {key: None if nbrs is None else set(nbrs) for key, nbrs in self._rows.items()}
+        out._added = {key: list(ids) for key, ids in self._added.items()}
+        return out
+
+    def _base_row(self, key):
+        row = self._index.get(key)
+        return row if row is not None and row < self._n_rows else None
+
+    def _base_ids(self, row):
+        names = self._names
+        return [names[c] for c in self._indices[self._indptr[row]:self._indptr[row + 1]].tolist()]
+
+    def _build(self, key, row):
+        nbrs = set(self._base_ids(row))
+        for b in self._added.get(key, ()):
+            nbrs.add(b)
+        return nbrs
+
+    def get(self, key, default=None):
+        nbrs = self._rows.get(key, _MISSING)
+        if nbrs is not _MISSING:
+            return default if nbrs is None else nbrs
+        row = self._base_row(key)
+        if row is None:
+            return default
+        if key in self._added:
+            return self._build(key, row)
+        return frozenset(self._base_ids(row))
+
+    def __getitem__(self, key):
+        nbrs = self._rows.get(key, _MISSING)
+        if nbrs is _MISSING:
+            row = self._base_row(key)
+            if row is not None:
+                nbrs = self._rows[key] = self._build(key, row)
+                self._added.pop(key, None)
+        if nbrs is None or nbrs is _MISSING:
+            raise KeyError(key)
+        return nbrs
+
+    def __setitem__(self, key, nbrs):
+        self._rows[key] = nbrs
+        self._added.pop(key, None)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._added.pop(key, None)
+        if self._base_row(key) is None:
+            del self._rows[key]
+        else:
+            self._rows[key] = None
+
+    def __contains__(self, key):
+        nbrs = self._rows.get(key, _MISSING)
+        if nbrs is not _MISSING:
+            return nbrs is not None
+        return self._base_row(key) is not None
+
+    def __iter__(self):
+        rows = self._rows
+        for name in itertools.islice(self._names, self._n_rows):
+            if rows.get(name, _MISSING) is not None:
+                yield name
+        for key, nbrs in list(rows.items()):
+            if nbrs is not None and self._base_row(key) is None:
+                yield key
+
+    def __len__(self):
+        n = self._n_rows
+        for key, nbrs in self._rows.items():
+            n += (nbrs is not None) - (self._base_row(key) is not None)
+        return n
+
+    def items(self):
+        return ((key, self.get(key)) for key in self)
+
+    def values(self):
+        return (self.get(key) for key in self)
+
+    def add_edge(self, a, b):
+        nbrs = self._rows.get(a, _MISSING)
+        if nbrs is None or (nbrs is _MISSING and self._base_row(a) is None):
+            self[a] = {b}
+        elif nbrs is not _MISSING:
+            nbrs.add(b)
+        else:
+            added = self._added.setdefault(a, [])
+            if b not in added:
+                added.append(b)
+
+    def discard_edge(self, a, b):
+        if a in self:
+            self[a].discard(b)
+
+    def transposed(self, keys=()):
+        """Danh sách kề ngược dạng CSR (dùng chung names/index); thứ tự trong mỗi tập giống
+        AdjacencyDict.transposed (nguồn theo thứ tự duyệt của danh sách này)."""
+        names, index = self._names, self._index
+        for key in keys:
+            self._row_of(names, index, key)
+        # Dòng dựng sẵn chưa bị chép/thêm: cạnh lấy thẳng từ mảng; phần còn lại duyệt bằng Python
+        n = self._n_rows
+        deg = np.diff(self._indptr)
+        plain = np.ones(n, dtype=bool)
+        extra_src, extra_dst = [], []
+        touched = set(self._rows).union(self._added)
+        seq = n
+        for key in self:
+            row = self._base_row(key)
+            if row is None:
+                row, seq = seq, seq + 1
+            elif key not in touched:
+                continue
+            for v in self.get(key):
+                extra_src.append(row)
+                extra_dst.append(self._row_of(names, index, v))
+        for key in touched:
+            row = self._base_row(key)
+            if row is not None:
+                plain[row] = False
+        keep = np.repeat(plain, deg)
+        # Nguồn lưu theo "thứ tự duyệt"; dòng mới (ngoài CSR) đánh số tiếp sau n
+        order_src = np.concatenate([np.repeat(np.arange(n, dtype=np.int64), deg)[keep],
+                                    np.array(extra_src, dtype=np.int64)])
+        dst = np.concatenate([self._indices[keep].astype(np.int64), np.array(extra_dst, dtype=np.int64)])
+        new_keys = [key for key in self if self._base_row(key) is None]
+        src_ids = np.concatenate([np.arange(n, dtype=np.int64),
+                                  np.array([index.get(k) for k in new_keys], dtype=np.int64)])
+        order = np.lexsort((order_src, dst))
+        n_total = len(names)
+        indptr = np.zeros(n_total + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dst, minlength=n_total), out=indptr[1:])
+        return CSRAdjacency(names, index, indptr, src_ids[order_src[order]].astype(np.int32), n_total)
+
+    @property
+    def overlay_size(self):
+        return len(self._rows) + len(self._added)
+
+    @property
+    def nbytes(self):
+        """Bộ nhớ phần CSR (không tính chuỗi id, dùng chung với users)."""
+        return self._indptr.nbytes + self._indices.nbytes + self._index.nbytes + sys.getsizeof(self._names)
+
+
+class SocialGraph:
+    @METRICS.timed("graph_build")
+    def __init__(self, users, loc_map, bonus_rules, interest_groups, compact=False):
+        """compact=True: friend_adj/adj_list dạng CSR dùng chung 1 bản (CSRAdjacency) thay cho dict-of-set,
+        tốn ít bộ nhớ hơn nhiều với dữ liệu lớn; kết quả duyệt/gợi ý giống hệt chế độ thường."""
+        self.users = {u.id: u for u in users}
+        self.compact = compact
+        rows = [(uid, u.friends_ids) for uid, u in self.users.items()]
+        if compact:
+            self.friend_adj = CSRAdjacency.from_rows(rows)
+            self.adj_list = self.friend_adj.fork()
+        else:
+            self.friend_adj = AdjacencyDict.from_rows(rows)
+            self.adj_list = AdjacencyDict.from_rows(rows)
+        del rows
+        self.strong_neighbors = {}
+
+        self.loc_map = loc_map
+        self.bonus_rules = bonus_rules
+
+        merged_groups = {k: list(v) for k, v in DEFAULT_INTEREST_GROUPS.items()}
+        for g, items in (interest_groups or {}).items():
+            if g not in merged_groups:
+                merged_groups[g] = list(items)
+            else:
+                merged_groups[g] = list(dict.fromkeys(merged_groups[g] + list(items)))
+        self.interest_groups = merged_groups
+        self._interest_groups_norm = {g: {_norm_key(x) for x in items} for g, items in self.interest_groups.items()}
+
+        self._codes = _FeatureCodes(self._interest_groups_norm, loc_map, bonus_rules)
+
+        self._index = {}
+        self._classes = ProfileClasses()
+        for u in self.users.values():
+            self._encode_user(u)
+            self._classes.add(u)
+            self._index_user(u)
+        self._features = _FeatureTable(capacity=max(1024, len(self.users)))
+        self._features.add_many(self.users.values())
+
+        self._rev_adj = None
+        self._landmarks = None
+        self._friend_matrix = None
+        self._components = None
+        self._lsh = None
+
+    def _groups_of_mask(self, mask):
+        return self._codes.groups_of_mask(mask)
+
+    def _encode_user(self, u, register=True):
+        """Gắn đặc trưng số nguyên cho user theo từ điển của graph này (xem _FeatureCodes.encode)."""
+        self._codes.encode(u, register)
+
+    def _proxy_friend_set(self, uid: str) -> set:
+        if uid in self.strong_neighbors:
+            return self.strong_neighbors.get(uid, set())
+        return self.friend_adj.get(uid, set())
+
+    def common_friend_ids(self, id_a: str, id_b: str) -> set:
+        return self._proxy_friend_set(id_a) & self._proxy_friend_set(id_b)
+
+    def friend_matrix(self):
+        """FriendMatrix của graph (dựng khi cần; dựng lại khi overlay quá lớn hoặc sau khi xoá user)."""
+        fm = self._friend_matrix
+        if fm is None or fm.overlay_size > max(64, fm.n_base // 10):
+            fm = FriendMatrix([self._proxy_friend_set(uid) for uid in self._features.ids])
+            self._friend_matrix = fm
+        return fm
+
+    def common_friend_counts(self, user, proxy_friends=None, rows=None):
+        """Số bạn chung của `user` với mọi user (theo thứ tự row_ids()), bằng 1 phép nhân ma trận-vector.
+        rows: chỉ tính cho các dòng này (mảng tăng dần)."""
+        if proxy_friends is None:
+            proxy_friends = self._proxy_friend_set(user.id) if user.id in self.users else set(user.friends_ids)
+        fm = self.friend_matrix()
+        if rows is not None:
+            return fm.count_rows(rows, proxy_friends)
+        return fm.matvec(fm.indicator(proxy_friends), self._features.n)
+
+    def common_friend_ids_batch(self, user_id, target_ids, proxy_friends=None):
+        """{target_id: tập id bạn chung với user_id} cho nhiều target cùng lúc.
+
+        proxy_friends: tập "bạn" của user_id nếu user đó chưa thuộc graph.
+        """
+        fm = self.friend_matrix()
+        mine = self._proxy_friend_set(user_id) if proxy_friends is None else proxy_friends
+        if not isinstance(mine, (set, frozenset)):
+            mine = set(mine)
+        # Tra từng bạn của target trong tập của user (ít target) thay vì dựng vector chỉ thị cho cả tập
+        row_of = self._features.row_of
+        col_ids = fm.col_ids
+        out = {}
+        for tid in target_ids:
+            row = row_of.get(tid)
+            if row is None:
+                out[tid] = set()
+                continue
+            out[tid] = {fid for fid in map(col_ids.__getitem__, fm.row_cols(row).tolist()) if fid in mine}
+        return out
+
+    # ---- Chỉ mục ngược: giá trị đặc trưng -> tập id user ----
+
+    def _index_keys(self, u):
+        """Các key (loại, giá trị) của user trong chỉ mục ngược."""
+        keys = []
+        if u.location != "-":
+            keys.append(("location", u.location))
+        loc_val = self.loc_map.get(u.location)
+        if loc_val is not None:
+            keys.append(("loc_value", loc_val))
+        mask = u.interest_mask
+        while mask:
+            low = mask & -mask
+            keys.append(("interest", low.bit_length() - 1))
+            mask ^= low
+        if u.industry_group != "-":
+            keys.append(("industry_group", u.industry_group))
+        return keys
+
+    def _index_user(self, u):
+        for key in self._index_keys(u):
+            self._index.setdefault(key, set()).add(u.id)
+
+    def _unindex_user(self, u):
+        for key in self._index_keys(u):
+            posting = self._index.get(key)
+            if posting is not None:
+                posting.discard(u.id)
+                if not posting:
+                    del self._index[key]
+
+    def _posting(self, kind, value):
+        return self._index.get((kind, value), frozenset())
+
+    def candidate_ids(self, user):
+        """User có liên kết gợi ý với `user`: cùng nơi ở, cùng khoảng cách (loc_map),
+        chung ít nhất 1 sở thích hoặc cùng trường/ngành nghề."""
+        cand = set()
+        for key in self._index_keys(user):
+            cand.update(self._index.get(key, ()))
+        cand.discard(user.id)
+        return cand
+
+    def strong_neighbor_ids(self, user):
+        """Strong neighbors: cùng nơi ở, cùng trường/ngành nghề hoặc chung >= 2 sở thích."""
+        strong = set()
+        if user.location != "-":
+            strong.update(self._posting("location", user.location))
+        if user.industry_group != "-":
+            strong.update(self._posting("industry_group", user.industry_group))
+        seen_once = set()
+        for kind, value in self._index_keys(user):
+            if kind != "interest":
+                continue
+            posting = self._posting(kind, value)
+            strong.update(posting & seen_once)
+            seen_once.update(posting)
+        strong.discard(user.id)
+        return strong
+
+    @METRICS.timed("add_new_user")
+    def add_new_user(self, new_user):
+        if new_user.id in self.users:
+            self.remove_user(new_user.id)
+        self._encode_user(new_user)
+        self._classes.add(new_user)
+        self._features.add(new_user)
+        self.users[new_user.id] = new_user
+        self.friend_adj[new_user.id] = set()
+
+        # Liên kết gợi ý để có candidate
+        candidates = self.candidate_ids(new_user)
+        self.adj_list[new_user.id] = set(candidates)
+        for uid in candidates:
+            self.adj_list.add_edge(uid, new_user.id)
+
+        # Strong neighbors để tính bạn chung tự động (giảm bị +1 hàng loạt)
+        self.strong_neighbors[new_user.id] = self.strong_neighbor_ids(new_user)
+
+        self._index_user(new_user)
+
+        if self._rev_adj is not None:
+            self._rev_adj.setdefault(new_user.id, set()).update(candidates)
+            for uid in candidates:
+                self._rev_adj.add_edge(uid, new_user.id)
+        if self._landmarks is not None:
+            self._landmarks.on_insert(new_user.id)
+        if self._components is not None:
+            self._components.on_insert(new_user.id, candidates)   # cạnh tới user mới: chính các candidate
+        if self._lsh is not None:
+            self._lsh.add(self._features, self._features.row_of[new_user.id])
+        if self._friend_matrix is not None:
+            self._friend_matrix.set_row(self._features.row_of[new_user.id], self.strong_neighbors[new_user.id])
+
+    def remove_user(self, uid):
+        """Gỡ user khỏi graph (users, cạnh kề, strong neighbors, chỉ mục, bảng đặc trưng)."""
+        u = self.users.pop(uid, None)
+        if u is None:
+            return False
+        self._unindex_user(u)
+        self._classes.remove(u)
+        self._features.remove(uid)
+        for v in self.adj_list.pop(uid, ()):
+            self.adj_list.discard_edge(v, uid)
+        self.friend_adj.pop(uid, None)
+        self.strong_neighbors.pop(uid, None)
+        for strong in self.strong_neighbors.values():
+            strong.discard(uid)
+        # Xoá có thể làm khoảng cách tăng -> dựng lại khi cần
+        self._rev_adj = None
+        self._landmarks = None
+        self._friend_matrix = None
+        self._components = None
+        self._lsh = None
+        return True
+
+    # ---- Cập nhật tăng dần user gốc (dùng cho nhật ký sự kiện) ----
+    # Khác add_new_user (user truy vấn: nối tới mọi candidate), user gốc chỉ có cạnh tới bạn bè,
+    # giống lúc dựng graph. Chi phí tỉ lệ với số bạn + số user truy vấn, không dựng lại graph.
+
+    def _link_friend(self, a, b):
+        """Cạnh bạn bè có hướng a -> b (a đã thuộc graph)."""
+        if b in self.friend_adj.get(a, ()):
+            return False
+        self.friend_adj.add_edge(a, b)
+        self.adj_list.add_edge(a, b)
+        if b not in self.users[a].friends_ids:
+            self.users[a].friends_ids.append(b)
+        if self._rev_adj is not None:
+            self._rev_adj.add_edge(b, a)
+        if self._landmarks is not None and b in self.users:
+            self._landmarks.on_edge(a, b)
+        if self._components is not None and b in self.users:
+            self._components.on_edge(a, b)
+        if self._friend_matrix is not None and a not in self.strong_neighbors:
+            self._friend_matrix.set_row(self._features.row_of[a], self.friend_adj.get(a))
+        return True
+
+    def _unlink_friend(self, a, b):
+        if b not in self.friend_adj.get(a, ()):
+            return False
+        self.friend_adj.discard_edge(a, b)
+        if a not in self.strong_neighbors and b not in self.strong_neighbors:
+            self.adj_list.discard_edge(a, b)
+            if self._rev_adj is not None:
+                self._rev_adj.discard_edge(b, a)
+        if b in self.users[a].friends_ids:
+            self.users[a].friends_ids.remove(b)
+        if self._friend_matrix is not None and a not in self.strong_neighbors:
+            self._friend_matrix.set_row(self._features.row_of[a], self.friend_adj.get(a))
+        return True
+
+    def _refresh_query_links(self, u):
+        """Cập nhật cạnh gợi ý/strong neighbors giữa user gốc `u` và các user truy vấn (add_new_user)."""
+        keys = set(self._index_keys(u))
+        for qid, strong in self.strong_neighbors.items():
+            if qid == u.id:
+                continue
+            q = self.users[qid]
+            q_keys = self._index_keys(q)
+            linked = u.id in self.adj_list.get(qid, ())
+            if keys.intersection(q_keys) and not linked:
+                self.adj_list.add_edge(qid, u.id)
+                self.adj_list.add_edge(u.id, qid)
+                if self._rev_adj is not None:
+                    self._rev_adj.add_edge(u.id, qid)
+                    self._rev_adj.add_edge(qid, u.id)
+                if self._landmarks is not None:
+                    self._landmarks.on_edge(qid, u.id)
+                    self._landmarks.on_edge(u.id, qid)
+                if self._components is not None:
+                    self._components.on_edge(qid, u.id)
+            elif not keys.intersection(q_keys) and linked and u.id not in self.friend_adj.get(qid, ()) \
+                    and qid not in self.friend_adj.get(u.id, ()):
+                self.adj_list.discard_edge(qid, u.id)
+                self.adj_list.discard_edge(u.id, qid)
+                if self._rev_adj is not None:
+                    self._rev_adj.discard_edge(u.id, qid)
+                    self._rev_adj.discard_edge(qid, u.id)
+                self._landmarks = None
+                self._components = None
+            shared = sum(1 for kind, _ in keys.intersection(q_keys) if kind == "interest")
+            is_strong = (q.location != "-" and q.location == u.location) or \
+                (q.industry_group != "-" and q.industry_group == u.industry_group) or shared >= 2
+            if is_strong != (u.id in strong):
+                if is_strong:
+                    strong.add(u.id)
+                else:
+                    strong.discard(u.id)
+                if self._friend_matrix is not None:
+                    self._friend_matrix.set_row(self._features.row_of[qid], strong)
+
+    def insert_user(self, u):
+        """Thêm user gốc (có trong dữ liệu, không phải user truy vấn); id đã có thì cập nhật hồ sơ.
+
+        Bạn bè là quan hệ 2 chiều: user đã có trong graph được nối ngược lại.
+        """
+        if u.id in self.users:
+            return self.update_user(u)
+        self._encode_user(u)
+        self._classes.add(u)
+        self._features.add(u)
+        self.users[u.id] = u
+        friends = list(u.friends_ids)
+        u.friends_ids = []
+        self.friend_adj[u.id] = set()
+        self.adj_list[u.id] = set()
+        self._index_user(u)
+        if self._rev_adj is not None:
+            self._rev_adj.setdefault(u.id, set())
+        if self._landmarks is not None:
+            self._landmarks.on_insert(u.id)
+        if self._components is not None and not self._components.on_insert(u.id):
+            self._components = None
+        if self._lsh is not None:
+            self._lsh.add(self._features, self._features.row_of[u.id])
+        if self._friend_matrix is not None:
+            self._friend_matrix.set_row(self._features.row_of[u.id], ())
+        for fid in friends:
+            self._link_friend(u.id, fid)
+            if fid in self.users and fid not in self.strong_neighbors:
+                self._link_friend(fid, u.id)
+        self._refresh_query_links(u)
+
+    def update_user(self, u):
+        """Thay hồ sơ user gốc `u.id` bằng `u` (giữ/đổi danh sách bạn theo u.friends_ids)."""
+        old = self.users.get(u.id)
+        if old is None:
+            return self.insert_user(u)
+        self._unindex_user(old)
+        self._classes.remove(old)
+        self._encode_user(u)
+        self._classes.add(u)
+        self._features.add(u)
+        if self._lsh is not None:
+            self._lsh.add(self._features, self._features.row_of[u.id])
+        friends = list(u.friends_ids)
+        u.friends_ids = list(old.friends_ids)
+        self.users[u.id] = u
+        self._index_user(u)
+        for fid in set(u.friends_ids) - set(friends):
+            self.remove_friendship(u.id, fid)
+        for fid in friends:
+            self.add_friendship(u.id, fid)
+        self._refresh_query_links(u)
+
+    def add_friendship(self, a, b):
+        """Kết bạn 2 chiều a <-> b (bên nào chưa thuộc graph thì chỉ giữ id, như dữ liệu gốc)."""
+        if a == b:
+            return False
+        changed = False
+        if a in self.users:
+            changed |= self._link_friend(a, b)
+        if b in self.users:
+            changed |= self._link_friend(b, a)
+        return changed
+
+    def remove_friendship(self, a, b):
+        """Huỷ kết bạn 2 chiều; khoảng cách có thể tăng / thành phần liên thông có thể tách
+        nên landmark và components được dựng lại khi cần."""
+        changed = False
+        if a in self.users:
+            changed |= self._unlink_friend(a, b)
+        if b in self.users:
+            changed |= self._unlink_friend(b, a)
+        if changed:
+            self._landmarks = None
+            self._components = None
+        return changed
+
+    def reverse_adj(self):
+        """Danh sách kề ngược của adj_list (v -> các u có cạnh u -> v), dựng 1 lần rồi cập nhật dần."""
+        if self._rev_adj is None:
+            self._rev_adj = self.adj_list.transposed(self.users)
+        return self._rev_adj
+
+    def components(self):
+        """Thành phần liên thông (Components) của adj_list; dựng khi cần, cập nhật khi thêm user/cạnh."""
+        if self._components is None:
+            self._components = Components(self)
+        return self._components
+
+    def profile_classes(self):
+        """ProfileClasses của graph (cập nhật khi thêm/sửa/xoá user)."""
+        return self._classes
+
+    def landmarks(self, count=4):
+        """Bộ landmark (ALT) cho heuristic của run_astar; dựng khi cần, cập nhật khi thêm user."""
+        if self._landmarks is None or self._landmarks.count != count:
+            self._landmarks = Landmarks(self, count)
+        return self._landmarks
+
+    def calculate_score(self, user_a, user_b, common_count=None):
+        """common_count: số bạn chung đã tính sẵn (vd. từ common_friend_counts); None = tự tính."""
+        score = self.signature_score(user_a, user_b)
+
+        # Có ít nhất 1 bạn chung: +1
+        if common_count is None:
+            if self.common_friend_ids(user_a.id, user_b.id):
+                score += 1
+        elif common_count > 0:
+            score += 1
+
+        return score
+
+    def signature_score(self, user_a, user_b):
+        """Phần điểm chỉ phụ thuộc đặc trưng (mọi thứ trừ bạn chung): như nhau với mọi user cùng ProfileClasses."""
+        # Nơi ở: điểm theo bậc khoảng cách (bonus_config + loc_map), tra sẵn trong bảng loc x loc
+        score = self._codes.loc_bonus_rows[user_a.loc_code][user_b.loc_code]
+
+        # Sở thích: +2 / sở thích trùng
+        common = user_a.interest_mask & user_b.interest_mask
+        score += common.bit_count() * 2
+
+        # Trùng trường sở thích: +1 (cùng nhóm nhưng không trùng sở thích con trong nhóm đó)
+        shared_groups = user_a.interest_group_mask & user_b.interest_group_mask
+        if shared_groups and common:
+            shared_groups &= ~self._groups_of_mask(common)
+        if shared_groups:
+            score += 1
+
+        # Ngành nghề: +2 nếu trùng ngành con, else +1 nếu trùng trường/ngành nghề
+        if user_a.ind_code and user_a.ind_code == user_b.ind_code:
+            score += 2
+        elif user_a.grp_code and user_a.grp_code == user_b.grp_code:
+            score += 1
+
+        return score
+
+    def max_score(self, user):
+        """Cận trên điểm calculate_score(user, *) theo quy tắc chấm điểm (dùng để dừng sớm top-k)."""
+        bound = self._codes.max_loc_bonus[user.loc_code]
+        if user.id not in self.users or self._proxy_friend_set(user.id):
+            bound += 1
+        # Trùng hết m sở thích (+2m) thì không còn trường nào được +1; trùng ít hơn thì <= 2(m-1)+1
+        bound += 2 * user.interest_mask.bit_count()
+        if user.ind_code:
+            bound += 2
+        elif user.grp_code:
+            bound += 1
+        return bound
+
+    def score_all(self, query_user, proxy_friends=None, rows=None):
+        """Điểm của query_user với MỌI user trong graph (cùng quy tắc calculate_score), tính bằng NumPy.
+
+        Trả về mảng int32 theo thứ tự dòng của bảng đặc trưng (self.row_ids()).
+        proxy_friends: tập id dùng làm "bạn" của query (mặc định như _proxy_friend_set,
+        hoặc friends_ids nếu query chưa có trong graph).
+        rows: chỉ chấm các dòng này (mảng tăng dần, vd. từ InterestLSH.candidates); kết quả theo rows.
+        """
+        if query_user.id not in self.users:
+            self._encode_user(query_user, register=False)
+        if proxy_friends is None:
+            if query_user.id in self.users:
+                proxy_friends = self._proxy_friend_set(query_user.id)
+            else:
+                proxy_friends = set(query_user.friends_ids)
+
+        t = self._features
+        sel = slice(0, t.n) if rows is None else rows
+        n_sel = t.n if rows is None else len(rows)
+        METRICS.add(score_all_rows=n_sel)
+        has_common = self.common_friend_counts(query_user, proxy_friends, rows) > 0 if proxy_friends else None
+        ct = self._classes.table
+        if n_sel < PROFILE_CLASS_MIN_MEAN * self._classes.n_classes:
+            return _score_rows(t.loc[sel], t.ind[sel], t.grp[sel], t.imask[sel], query_user, has_common, self._codes)
+        # Chấm 1 lần cho mỗi lớp rồi gán theo lớp của từng dòng; chỉ phần bạn chung tính theo dòng
+        METRICS.add(score_all_classes=ct.n)
+        n = ct.n
+        scores = _score_rows(ct.loc[:n], ct.ind[:n], ct.grp[:n], ct.imask[:n], query_user, None, self._codes)
+        scores = scores[t.cls[sel]]
+        if has_common is not None:
+            scores += has_common
+        return scores
+
+    def row_ids(self):
+        """id user theo thứ tự dòng của score_all."""
+        return self._features.ids
+
+    def top_k(self, query_user, k=30, proxy_friends=None, rows=None):
+        """Top-k (user, điểm) với điểm > 0, chọn bằng argpartition trên score_all.
+        rows: chỉ xét các dòng này (mảng tăng dần, vd. candidate từ lsh_index())."""
+        scores = self.score_all(query_user, proxy_friends, rows)
+        row = self._features.row_of.get(query_user.id)
+        if row is not None:
+            scores[row if rows is None else rows == row] = 0
+        top = _top_rows(scores, k)
+        picked = top if rows is None else rows[top]
+        ids = self._features.ids
+        return [(self.users[ids[r]], s) for r, s in zip(picked.tolist(), scores[top].tolist())]
+
+    def lsh_index(self, bands=16, rows=2, tokens=("interest",)):
+        """InterestLSH trên bảng đặc trưng; dựng khi cần (hoặc khi đổi tham số), cập nhật khi thêm/sửa user."""
+        lsh = self._lsh
+        if lsh is None or (lsh.bands, lsh.rows, lsh.tokens) != (bands, rows, tuple(tokens)):
+            lsh = self._lsh = InterestLSH(self._features, bands, rows, tokens)
+        return lsh
+
+
+class InterestLSH:
+    """Chỉ mục LSH (MinHash) trên tập sở thích của mỗi dòng bảng đặc trưng, tuỳ chọn thêm
+    token trường/ngành nghề và nơi ở: trả về các dòng có Jaccard cao với hồ sơ truy vấn mà
+    không duyệt toàn bộ quần thể; điểm của candidate vẫn chấm chính xác (score_all(rows=...)).
+
+    Chữ ký dài bands * rows, chia thành `bands` dải `rows` giá trị; 2 dòng thành candidate khi
+    trùng ít nhất 1 dải, xác suất 1 - (1 - J^rows)^bands với Jaccard J. Tăng bands / giảm rows:
+    recall cao hơn, nhiều candidate hơn (chậm hơn). max_candidates: chỉ giữ các dòng trùng
+    nhiều dải nhất.
+    """
+
+    _PRIME = (1 << 31) - 1
+    _EMPTY = np.iinfo(np.uint32).max
+    _TOKEN_BASE = {"industry": 1 << 20, "location": 2 << 20}
+    _CHUNK = 16384
+
+    def __init__(self, features, bands=16, rows=2, tokens=("interest",), max_candidates=None, seed=0):
+        unknown = set(tokens) - {"interest", "industry", "location"}
+        if unknown:
+            raise ValueError(f"token LSH không hợp lệ: {sorted(unknown)}")
+        self.bands = bands
+        self.rows = rows
+        self.tokens = tuple(tokens)
+        self.max_candidates = max_candidates
+        rnd = np.random.default_rng(seed)
+        self._a = rnd.integers(1, self._PRIME, bands * rows, dtype=np.int64)
+        self._b = rnd.integers(0, self._PRIME, bands * rows, dtype=np.int64)
+
+        n = features.n
+        keys = np.zeros((n, bands), dtype=np.uint64)
+        filled = np.zeros(n, dtype=bool)
+        for r0 in range(0, n, self._CHUNK):
+            r1 = min(n, r0 + self._CHUNK)
+            sig = self._signatures(features.loc[r0:r1], features.grp[r0:r1], features.imask[r0:r1])
+            keys[r0:r1] = self._band_keys(sig)
+            filled[r0:r1] = sig[:, 0] != self._EMPTY
+        rows_ = np.flatnonzero(filled)
+        self._keys, self._rows = [], []
+        for i in range(bands):
+            order = np.argsort(keys[rows_, i], kind="stable")
+            self._keys.append(keys[rows_[order], i])
+            self._rows.append(rows_[order].astype(np.int32))
+        self._extra = [{} for _ in range(bands)]    # dòng thêm sau khi dựng: key -> [dòng]
+
+    def _row_tokens(self, loc, grp, imask):
+        """(dòng, token) của các dòng đặc trưng, sắp theo dòng."""
+        parts = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))]
+        if "interest" in self.tokens:
+            bytes_ = imask.astype("<u8").view(np.uint8).reshape(len(loc), -1)
+            parts.append(np.nonzero(np.unpackbits(bytes_, axis=1, bitorder="little")))
+        for kind, codes in (("industry", grp), ("location", loc)):
+            if kind in self.tokens:
+                r = np.flatnonzero(codes > 0)
+                parts.append((r, codes[r].astype(np.int64) + self._TOKEN_BASE[kind]))
+        rows_ = np.concatenate([p[0] for p in parts])
+        toks = np.concatenate([p[1] for p in parts]).astype(np.int64)
+        order = np.argsort(rows_, kind="stable")
+        return rows_[order], toks[order]
+
+    def _signatures(self, loc, grp, imask):
+        """Chữ ký MinHash (m x bands*rows, uint32) cho m dòng; dòng không có token = _EMPTY."""
+        sig = np.full((len(loc), len(self._a)), self._EMPTY, dtype=np.uint32)
+        rows_, toks = self._row_tokens(loc, grp, imask)
+        if len(toks):
+            hashed = ((toks[:, None] * self._a + self._b) % self._PRIME).astype(np.uint32)
+            starts = np.flatnonzero(np.r_[True, rows_[1:] != rows_[:-1]])
+            sig[rows_[starts]] = np.minimum.reduceat(hashed, starts, axis=0)
+        return sig
+
+    def _band_keys(self, sig):
+        s = sig.reshape(len(sig), self.bands, self.rows).astype(np.uint64)
+        keys = np.zeros((len(sig), self.bands), dtype=np.uint64)
+        for j in range(self.rows):
+            keys = keys * np.uint64(0x9E3779B97F4A7C15) + s[:, :, j]
+        return keys
+
+    def _query_keys(self, user):
+        words = max(1, (user.interest_mask.bit_length() + 63) // 64)
+        imask = np.array([_mask_words(user.interest_mask, words)], dtype=np.uint64)
+        sig = self._signatures(np.array([user.loc_code]), np.array([user.grp_code]), imask)
+        return None if sig[0, 0] == self._EMPTY else self._band_keys(sig)[0].tolist()
+
+    def add(self, features, row):
+        """Thêm/cập nhật dòng `row` (đã ghi vào features); bản cũ của dòng nếu có chỉ gây candidate thừa."""
+        sig = self._signatures(features.loc[row:row + 1], features.grp[row:row + 1], features.imask[row:row + 1])
+        if sig[0, 0] == self._EMPTY:
+            return
+        for extra, key in zip(self._extra, self._band_keys(sig)[0].tolist()):
+            extra.setdefault(key, []).append(row)
+
+    def candidates(self, user, max_candidates=None):
+        """Các dòng (tăng dần) trùng ít nhất 1 dải chữ ký với `user` (đã _encode_user)."""
+        keys = self._query_keys(user)
+        if keys is None:
+            return np.zeros(0, dtype=np.int64)
+        hits = []
+        for i, key in enumerate(keys):
+            k = np.uint64(key)
+            lo, hi = np.searchsorted(self._keys[i], k), np.searchsorted(self._keys[i], k, side="right")
+            hits.append(self._rows[i][lo:hi])
+            hits.append(np.array(self._extra[i].get(key, ()), dtype=np.int32))
+        rows_, counts = np.unique(np.concatenate(hits), return_counts=True)
+        limit = max_candidates or self.max_candidates
+        if limit and len(rows_) > limit:
+            rows_ = np.sort(rows_[np.argsort(-counts, kind="stable")[:limit]])
+        METRICS.add(lsh_candidates=len(rows_))
+        return rows_.astype(np.int64)
+
+
+class GraphArrays:
+    """Phần mảng chỉ-đọc của SocialGraph đủ để chấm điểm + tìm bạn chung cho user chưa thuộc graph
+    (như recommend, không có đường đi A*). Không giữ object User nên có thể đặt trong shared memory.
+
+    Kết quả theo dòng của graph.row_ids() và cột của graph.friend_matrix().col_ids.
+    """
+
+    ARRAY_NAMES = ("loc", "ind", "grp", "imask", "indptr", "indices", "row_col")
+
+    def __init__(self, arrays, codes):
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.codes = codes
+        self.friends = FriendMatrix.from_arrays(self.indptr, self.indices)
+        self.n_cols = max(int(self.indices.max(initial=-1)), int(self.row_col.max(initial=-1))) + 1
+        self._col_row = None
+        self._scorer = None
+
+    @classmethod
+    def from_graph(cls, graph):
+        fm = graph.friend_matrix()
+        if fm.overlay_size:
+            graph._friend_matrix = None
+            fm = graph.friend_matrix()
+        t = graph._features
+        n = t.n
+        arrays = {
+            "loc": t.loc[:n], "ind": t.ind[:n], "grp": t.grp[:n], "imask": t.imask[:n],
+            "indptr": fm.indptr, "indices": fm.indices,
+            "row_col": np.array([fm.col_of.get(uid, -1) for uid in t.ids], dtype=np.int32),
+        }
+        return cls(arrays, graph._codes)
+
+    @property
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAY_NAMES}
+
+    def recommend(self, user, k=30):
+        """[(dòng, điểm, mảng cột bạn chung)] của top-k; "bạn" của user = strong neighbors."""
+        self.codes.encode(user, register=False)
+        cols = self.row_col[_strong_rows(self.loc, self.grp, self.imask, user)]
+        cols = cols[cols >= 0]
+        has_common = None
+        x = np.zeros(self.n_cols, dtype=np.int32)
+        if len(cols):
+            x[cols] = 1
+            has_common = self.friends.matvec(x, len(self.loc)) > 0
+        scores = _score_rows(self.loc, self.ind, self.grp, self.imask, user, has_common, self.codes)
+        out = []
+        for row in _top_rows(scores, k).tolist():
+            c = self.friends.row_cols(row)
+            out.append((row, int(scores[row]), c[x[c] > 0]))
+        return out
+
+    # ---- Top-k cho chính các user của graph (bảng gợi ý tính trước, xem ketban_topk.py) ----
+
+    TOPK_BLOCK = 16   # số query mỗi khối: khối lớn hơn làm các mảng (khối x n) tràn cache, chậm hơn
+
+    def _block_scorer(self):
+        if self._scorer is None:
+            self._scorer = _BlockScorer(self.loc, self.ind, self.grp, self.imask, self.indptr, self.indices,
+                                        self.n_cols, self.codes)
+        return self._scorer
+
+    def _friend_rows(self, row):
+        """Các dòng là bạn (theo danh sách bạn) của dòng row."""
+        if self._col_row is None:
+            col_row = np.full(self.n_cols + 1, -1, dtype=np.int64)
+            has_col = self.row_col >= 0
+            col_row[self.row_col[has_col]] = np.flatnonzero(has_col)
+            self._col_row = col_row
+        rows = self._col_row[self.friends.row_cols(row)]
+        return rows[rows >= 0]
+
+    def top_k_rows(self, rows, k=30, exclude_friends=True, block=None):
+        """Top-k cho các user ở dòng `rows` của graph: (chỉ số dòng (len(rows), k), điểm (len(rows), k)),
+        thiếu thì -1 / 0. Cùng quy tắc và thứ tự như SocialGraph.top_k(user) với user thuộc graph
+        (bỏ chính user đó; exclude_friends: bỏ cả những người đã là bạn).
+
+        Chấm theo khối `block` query 1 lần (mặc định TOPK_BLOCK) bằng các phép toán mảng (khối x n).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        block = block or self.TOPK_BLOCK
+        scorer = self._block_scorer()
+        out_rows = np.full((len(rows), k), -1, dtype=np.int32)
+        out_scores = np.zeros((len(rows), k), dtype=np.int32)
+        for start in range(0, len(rows), block):
+            part = rows[start:start + block]
+            scores = scorer.score(part, [self.friends.row_cols(r) for r in part.tolist()])
+            scores[np.arange(len(part)), part] = 0
+            if exclude_friends:
+                for b, r in enumerate(part.tolist()):
+                    scores[b, self._friend_rows(r)] = 0
+            out_rows[start:start + len(part)], out_scores[start:start + len(part)] = _top_rows_block(scores, k)
+        return out_rows, out_scores
+
+
+class Components:
+    """Thành phần liên thông của adj_list (coi cạnh là vô hướng): union-find theo dòng của bảng đặc trưng.
+
+    Khác thành phần -> chắc chắn không có đường đi; thành phần nhỏ -> duyệt không cần tính
+    bạn chung cho toàn bộ quần thể. Chỉ hợp nhất được nên thêm user/cạnh cập nhật tăng dần
+    (on_insert / on_edge); xoá user/cạnh thì graph bỏ bộ này và dựng lại khi cần.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.parent = []
+        self.size = []
+        self._grow()
+        row_of = graph._features.row_of
+        for u, nbrs in graph.adj_list.items():
+            ru = row_of.get(u)
+            if ru is None:
+                continue
+            for v in nbrs:
+                rv = row_of.get(v)
+                if rv is not None:
+                    self._union(ru, rv)
+
+    def _grow(self):
+        n = len(self.graph._features.loc)
+        if len(self.parent) < n:
+            self.size.extend([1] * (n - len(self.parent)))
+            self.parent.extend(range(len(self.parent), n))
+
+    def _find(self, r):
+        parent = self.parent
+        while parent[r] != r:
+            parent[r] = parent[parent[r]]
+            r = parent[r]
+        return r
+
+    def _link(self, a, b):
+        """Nối 2 gốc khác nhau, trả về gốc mới."""
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a != b:
+            self._link(a, b)
+
+    def on_insert(self, uid, in_neighbors=None):
+        """Hợp nhất user mới `uid` với các user nối tới/từ nó; False nếu không cập nhật được.
+
+        in_neighbors: các user có cạnh tới uid, nếu người gọi biết. Mặc định lấy từ reverse_adj của graph
+        khi đã dựng; chưa dựng thì không dựng (O(số cạnh)) chỉ để thêm 1 user - graph bỏ bộ này, dựng lại khi cần.
+        """
+        g = self.graph
+        if in_neighbors is None:
+            if g._rev_adj is None:
+                return False
+            in_neighbors = g._rev_adj.get(uid, ())
+        self._grow()
+        row_of = g._features.row_of
+        root = self._find(row_of[uid])
+        for v in itertools.chain(g.adj_list.get(uid, ()), in_neighbors):
+            rv = row_of.get(v)
+            if rv is not None:
+                rv = self._find(rv)
+                if rv != root:
+                    root = self._link(root, rv)
+        return True
+
+    def on_edge(self, a, b):
+        row_of = self.graph._features.row_of
+        self._union(row_of[a], row_of[b])
+
+    def same(self, a, b):
+        row_of = self.graph._features.row_of
+        ra, rb = row_of.get(a), row_of.get(b)
+        return ra is not None and rb is not None and self._find(ra) == self._find(rb)
+
+    def size_of(self, uid):
+        """Số user trong thành phần chứa uid (0 nếu uid không thuộc graph)."""
+        r = self.graph._features.row_of.get(uid)
+        return 0 if r is None else self.size[self._find(r)]
+
+
+def _common_counts(graph, start, reachable):
+    """Số bạn chung của start với mọi dòng (1 phép nhân ma trận-vector), hoặc None khi số user
+    có thể chấm điểm (`reachable`) nhỏ so với quần thể - khi đó calculate_score tự giao tập bạn."""
+    if reachable * 64 < graph._features.n:
+        return None
+    return graph.common_friend_counts(start).tolist()
+
+
+def _scorer(graph, start, common):
+    """(hàm user -> điểm với start như calculate_score, bộ nhớ điểm theo lớp hoặc None).
+
+    Graph có nhiều user cùng chữ ký (ProfileClasses.shared): phần điểm theo đặc trưng (signature_score)
+    nhớ theo lớp, mỗi lớp chỉ tính 1 lần trong lượt duyệt; chỉ phần bạn chung tính theo từng user.
+    """
+    row_of = graph._features.row_of
+    memo = {} if graph.profile_classes().shared else None
+
+    def score(u):
+        if memo is None:
+            s = graph.signature_score(start, u)
+        else:
+            s = memo.get(u.profile_class)
+            if s is None:
+                s = memo[u.profile_class] = graph.signature_score(start, u)
+        if common is None:
+            return s + 1 if graph.common_friend_ids(start.id, u.id) else s
+        return s + 1 if common[row_of[u.id]] > 0 else s
+    return score, memo
+
+
+def iter_bfs(graph, start_id, max_depth=None, max_nodes=None, time_budget=None, stats=None):
+    """Duyệt BFS, sinh dần (user, điểm) cho các user có điểm > 0.
+
+    Giới hạn (None = không giới hạn): max_depth (số bước từ start), max_nodes (số user được
+    chấm điểm), time_budget (giây). Hết giới hạn thì dừng sớm - người gọi giữ kết quả tốt nhất
+    đã có (vd. TopK); stats (dict, tuỳ chọn) nhận truncated = "depth" / "nodes" / "time" / None.
+    Thành phần liên thông chỉ có start thì trả về ngay.
+    """
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    if stats is None:
+        stats = {}
+    stats["truncated"] = None
+    start = graph.users[start_id]
+    reachable = graph.components().size_of(start_id) - 1
+    if not reachable:
+        return
+    if max_nodes is not None:
+        reachable = min(reachable, max_nodes)
+    score, memo = _scorer(graph, start, _common_counts(graph, start, reachable))
+    queue = deque([(start_id, 0)])
+    visited = {start_id}
+    popped = edges = scored = 0
+    try:
+        while queue:
+            if max_nodes is not None and popped > max_nodes:
+                stats["truncated"] = "nodes"
+                return
+            if deadline is not None and not popped & 63 and time.perf_counter() > deadline:
+                stats["truncated"] = "time"
+                return
+            curr, depth = queue.popleft()
+            popped += 1
+            if curr != start_id:
+                s = score(graph.users[curr])
+                scored += 1
+                if s > 0:
+                    yield graph.users[curr], s
+            nbrs = graph.adj_list.get(curr, ())
+            if max_depth is not None and depth >= max_depth:
+                if any(n in graph.users and n not in visited for n in nbrs):
+                    stats["truncated"] = "depth"
+                continue
+            edges += len(nbrs)
+            for n in nbrs:
+                if n in graph.users and n not in visited:
+                    visited.add(n)
+                    queue.append((n, depth + 1))
+    finally:
+        METRICS.add(bfs_nodes_visited=popped, bfs_edges_scanned=edges, users_scored=scored,
+                    bfs_truncated=int(stats["truncated"] is not None),
+                    signature_score_calls=scored if memo is None else len(memo))
+
+
+def iter_dfs(graph, start_id, max_depth=3):
+    """Duyệt DFS (giới hạn độ sâu), sinh dần (user, điểm) cho các user có điểm > 0."""
+    start = graph.users[start_id]
+    reachable = graph.components().size_of(start_id) - 1
+    if not reachable:
+        return
+    score, memo = _scorer(graph, start, _common_counts(graph, start, reachable))
+    stack = [(start_id, 0)]
+    visited = {start_id}
+    popped = edges = scored = 0
+    try:
+        while stack:
+            curr, depth = stack.pop()
+            popped += 1
+            if curr != start_id:
+                s = score(graph.users[curr])
+                scored += 1
+                if s > 0:
+                    yield graph.users[curr], s
+            if depth < max_depth:
+                nbrs = graph.adj_list.get(curr, ())
+                edges += len(nbrs)
+                for n in nbrs:
+                    if n in graph.users and n not in visited:
+                        visited.add(n)
+                        stack.append((n, depth + 1))
+    finally:
+        METRICS.add(dfs_nodes_visited=popped, dfs_edges_scanned=edges, users_scored=scored,
+                    signature_score_calls=scored if memo is None else len(memo))
+
+
+@METRICS.timed("bfs")
+def run_bfs(graph, start_id, max_depth=None, max_nodes=None, time_budget=None, stats=None):
+    """Kết quả BFS (xem iter_bfs); hết giới hạn thì trả về những gì đã tìm được."""
+    return [{'user': u, 'score': s} for u, s in iter_bfs(graph, start_id, max_depth, max_nodes, time_budget, stats)]
+
+
+@METRICS.timed("dfs")
+def run_dfs(graph, start_id, max_depth=3):
+    return [{'user': u, 'score': s} for u, s in iter_dfs(graph, start_id, max_depth)]
+
+
+class TopK:
+    """Giữ k kết quả điểm cao nhất bằng heap kích thước k (bộ nhớ O(k)).
+
+    Hoà điểm thì ưu tiên user được đẩy vào trước - giống sorted(..., reverse=True)
+    ổn định trên danh sách gộp. Một user đẩy lại nhiều lần chỉ được tính 1 lần:
+    nếu đang nằm trong heap thì bỏ qua, nếu đã bị loại thì lần sau cũng không thể lọt vào.
+    upper_bound: điểm tối đa có thể đạt; khi heap đầy toàn điểm bằng mức này thì saturated().
+    """
+
+    def __init__(self, k, upper_bound=None):
+        self.k = k
+        self.upper_bound = upper_bound
+        self._heap = []          # (điểm, -thứ tự, user): phần tử tệ nhất ở đỉnh
+        self._members = set()
+        self._seq = 0
+
+    def push(self, user, score):
+        if user.id in self._members or self.k <= 0:
+            return
+        self._seq += 1
+        item = (score, -self._seq, user)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+            self._members.add(user.id)
+        elif item[:2] > self._heap[0][:2]:
+            dropped = heapq.heapreplace(self._heap, item)
+            self._members.discard(dropped[2].id)
+            self._members.add(user.id)
+
+    def saturated(self):
+        """True nếu không kết quả nào đến sau có thể thay đổi top-k."""
+        return (self.upper_bound is not None and len(self._heap) >= self.k
+                and self._heap[0][0] >= self.upper_bound)
+
+    def results(self):
+        return [{'user': u, 'score': s} for s, _, u in sorted(self._heap, key=lambda x: (-x[0], -x[1]))]
+
+
+def stream_top_k(stream, *aggregators):
+    """Đẩy (user, điểm) từ stream vào các TopK; dừng sớm khi tất cả đã saturated()."""
+    if all(a.saturated() for a in aggregators):
+        return
+    for user, score in stream:
+        for a in aggregators:
+            a.push(user, score)
+        if all(a.saturated() for a in aggregators):
+            return
+
+
+# ==========================================
+# 2. A* VỚI HEURISTIC LANDMARK (ALT) TRÊN adj_list
+# Mỗi cạnh có chi phí 1. Với landmark L, bất đẳng thức tam giác cho
+#   d(v, t) >= d(L, t) - d(L, v)   và   d(v, t) >= d(v, L) - d(t, L)
+# nên max các hiệu này là heuristic chấp nhận được (và nhất quán).
+# ==========================================
+
+_INF = float("inf")
+
+
+class Landmarks:
+    """Khoảng cách BFS từ/đến `count` landmark, lưu theo dòng của bảng đặc trưng (-1 = không tới được)."""
+
+    def __init__(self, graph, count=4):
+        self.graph = graph
+        self.count = count
+        self.ids = []
+        self.dist_from = []   # d(L, v)
+        self.dist_to = []     # d(v, L)
+        self._choose()
+
+    def _bfs(self, source, adj):
+        row_of = self.graph._features.row_of
+        dist = np.full(len(self.graph._features.loc), -1, dtype=np.int32)
+        dist[row_of[source]] = 0
+        queue = deque([source])
+        users = self.graph.users
+        while queue:
+            curr = queue.popleft()
+            d = dist[row_of[curr]] + 1
+            for n in adj.get(curr, ()):
+                if n in users and dist[row_of[n]] < 0:
+                    dist[row_of[n]] = d
+                    queue.append(n)
+        return dist
+
+    def _choose(self):
+        """Chọn landmark theo kiểu farthest-point: mỗi landmark mới xa nhất với các landmark đã chọn."""
+        g = self.graph
+        if not g.users:
+            return
+        n = g._features.n
+        ids = g._features.ids
+        seed = max(g.users, key=lambda uid: len(g.adj_list.get(uid, ())))
+        far = self._bfs(seed, g.adj_list)[:n]
+        nearest = np.where(far >= 0, far, -1).astype(np.int64)
+        rev = g.reverse_adj()
+        for _ in range(min(self.count, n)):
+            candidates = np.flatnonzero(nearest >= 0)
+            if candidates.size == 0:
+                break
+            lm = ids[int(candidates[np.argmax(nearest[candidates])])]
+            self.ids.append(lm)
+            self.dist_from.append(self._bfs(lm, g.adj_list))
+            self.dist_to.append(self._bfs(lm, rev))
+            d = self.dist_from[-1][:n]
+            nearest = np.where((d >= 0) & (nearest >= 0), np.minimum(nearest, d), nearest)
+            nearest[g._features.row_of[lm]] = -1
+
+    def _grown(self, dist, i):
+        cap = len(self.graph._features.loc)
+        if len(dist[i]) < cap:
+            grown = np.full(cap, -1, dtype=np.int32)
+            grown[:len(dist[i])] = dist[i]
+            dist[i] = grown
+        return dist[i]
+
+    def _propagate(self, d, start, fwd):
+        """Lan truyền phần khoảng cách được rút ngắn từ `start` theo fwd."""
+        g = self.graph
+        row_of = g._features.row_of
+        queue = deque([start])
+        while queue:
+            curr = queue.popleft()
+            nd = d[row_of[curr]] + 1
+            for n in fwd.get(curr, ()):
+                if n in g.users and (d[row_of[n]] < 0 or nd < d[row_of[n]]):
+                    d[row_of[n]] = nd
+                    queue.append(n)
+
+    def on_insert(self, uid):
+        """Cập nhật khoảng cách khi thêm user `uid` (chỉ có thể làm khoảng cách giảm)."""
+        g = self.graph
+        row_of = g._features.row_of
+        rev = g.reverse_adj()
+        for i in range(len(self.ids)):
+            for dist, fwd, back in ((self.dist_from, g.adj_list, rev), (self.dist_to, rev, g.adj_list)):
+                d = self._grown(dist, i)
+                # Khoảng cách tới uid qua các cạnh đi vào nó
+                best = -1
+                for p in back.get(uid, ()):
+                    if p in g.users and p != uid and d[row_of[p]] >= 0 and (best < 0 or d[row_of[p]] + 1 < best):
+                        best = d[row_of[p]] + 1
+                if self.ids[i] == uid:
+                    best = 0
+                d[row_of[uid]] = best
+                if best >= 0:
+                    self._propagate(d, uid, fwd)
+
+    def on_edge(self, a, b):
+        """Cập nhật khoảng cách khi thêm cạnh a -> b giữa 2 user đã có (chỉ xét phần bị rút ngắn)."""
+        g = self.graph
+        row_of = g._features.row_of
+        rev = g.reverse_adj()
+        for i in range(len(self.ids)):
+            for dist, src, dst, fwd in ((self.dist_from, a, b, g.adj_list), (self.dist_to, b, a, rev)):
+                d = self._grown(dist, i)
+                ds, dd = d[row_of[src]], d[row_of[dst]]
+                if ds >= 0 and (dd < 0 or ds + 1 < dd):
+                    d[row_of[dst]] = ds + 1
+                    self._propagate(d, dst, fwd)
+
+    def heuristic_to(self, goal_id):
+        """Trả về h(v): cận dưới số bước từ v tới goal (inf nếu chắc chắn không tới được).
+
+        Tính sẵn h cho mọi dòng bằng NumPy (1 lần/truy vấn), h(v) chỉ còn là 1 phép tra.
+        """
+        row_of = self.graph._features.row_of
+        n = self.graph._features.n
+        g_row = row_of[goal_id]
+        best = np.zeros(n, dtype=np.int64)
+        unreachable = np.zeros(n, dtype=bool)
+        for df, dt in zip(self.dist_from, self.dist_to):
+            d_lv, d_vl = df[:n].astype(np.int64), dt[:n].astype(np.int64)
+            d_lg, d_gl = int(df[g_row]), int(dt[g_row])
+            if d_lg < 0:
+                unreachable |= d_lv >= 0        # L tới được v nhưng không tới được goal
+            else:
+                best = np.maximum(best, np.where(d_lv >= 0, d_lg - d_lv, 0))
+            if d_gl >= 0:
+                unreachable |= d_vl < 0         # goal tới được L nhưng v thì không
+                best = np.maximum(best, np.where(d_vl >= 0, d_vl - d_gl, 0))
+        values = np.where(unreachable, -1, best).tolist()
+
+        def h(v):
+            x = values[row_of[v]]
+            return _INF if x < 0 else x
+        return h
+
+
+def _build_path(parent, node):
+    path = []
+    while node is not None:
+        path.append(node)
+        node = parent[node]
+    path.reverse()
+    return path
+
+
+class _VirtualStartAdj:
+    """Danh sách kề có thêm 1 nút ảo `start_id` (chưa thuộc graph) với các cạnh ra `start_neighbors`.
+
+    Cho phép tìm đường cho user truy vấn mà không phải add_new_user (không sửa adj_list).
+    """
+
+    def __init__(self, base, start_id, start_neighbors, reverse=False):
+        self.base = base
+        self.start_id = start_id
+        self.start_neighbors = start_neighbors
+        self.reverse = reverse
+
+    def get(self, node, default=()):
+        if self.reverse:
+            nbrs = self.base.get(node, default)
+            return itertools.chain(nbrs, (self.start_id,)) if node in self.start_neighbors else nbrs
+        if node == self.start_id:
+            return self.start_neighbors
+        return self.base.get(node, default)
+
+
+def _bidirectional_search(graph, start_id, goal_id, stats, start_neighbors=None):
+    """BFS hai chiều theo từng tầng (adj_list xuôi từ start, adj_list ngược từ goal)."""
+    users = graph.users
+    fwd, back = graph.adj_list, graph.reverse_adj()
+    if start_neighbors is not None:
+        fwd = _VirtualStartAdj(fwd, start_id, start_neighbors)
+        back = _VirtualStartAdj(back, start_id, start_neighbors, reverse=True)
+    sides = [
+        {"adj": fwd, "parent": {start_id: None}, "dist": {start_id: 0}, "frontier": [start_id]},
+        {"adj": back, "parent": {goal_id: None}, "dist": {goal_id: 0}, "frontier": [goal_id]},
+    ]
+    best_len, meet = _INF, None
+    while sides[0]["frontier"] and sides[1]["frontier"]:
+        # Mở rộng trọn 1 tầng của phía có frontier nhỏ hơn
+        i = 0 if len(sides[0]["frontier"]) <= len(sides[1]["frontier"]) else 1
+        side, other = sides[i], sides[1 - i]
+        nxt = []
+        for curr in side["frontier"]:
+            stats["expanded"] += 1
+            d = side["dist"][curr] + 1
+            for n in side["adj"].get(curr, ()):
+                stats["relaxed"] += 1
+                if (n not in users and n != start_id) or n in side["dist"]:
+                    continue
+                side["dist"][n] = d
+                side["parent"][n] = curr
+                nxt.append(n)
+                if n in other["dist"] and d + other["dist"][n] < best_len:
+                    best_len, meet = d + other["dist"][n], n
+        side["frontier"] = nxt
+        stats["peak_open"] = max(stats["peak_open"], len(sides[0]["frontier"]) + len(sides[1]["frontier"]))
+        if meet is not None:
+            break
+    stats["stored"] = len(sides[0]["dist"]) + len(sides[1]["dist"])
+    if meet is None:
+        return None
+    path = _build_path(sides[0]["parent"], meet)
+    node = sides[1]["parent"][meet]
+    while node is not None:
+        path.append(node)
+        node = sides[1]["parent"][node]
+    return path
+
+
+def run_astar(graph, start_id, goal_id, bidirectional=False, use_landmarks=None, stats=None,
+              start_neighbors=None):
+    """Đường đi ngắn nhất (số bước) trên adj_list từ start_id tới goal_id, None nếu không có.
+
+    A* với heuristic ALT (graph.landmarks()), lưu cha từng nút thay vì sao chép đường đi.
+    use_landmarks: None (mặc định) chỉ dùng landmark khi graph đã dựng sẵn (vd. ketban_service) vì dựng
+    mất vài lượt BFS toàn graph, đắt hơn 1 truy vấn đơn lẻ; True: dựng nếu chưa có; False: heuristic 0.
+    bidirectional=True: tìm kiếm hai chiều theo tầng.
+    start_neighbors: nếu có, start_id là nút ảo (chưa thuộc graph) với các cạnh ra này.
+    stats (dict, tuỳ chọn) nhận: expanded (nút mở rộng), pushed (lần đẩy heap),
+    relaxed (cạnh xét), peak_open (kích thước tập mở lớn nhất), stored (số nút lưu cha/khoảng cách).
+    """
+    if stats is None:
+        stats = {}
+    stats.update(expanded=0, pushed=0, relaxed=0, peak_open=0, stored=0)
+    with METRICS.phase("astar"):
+        path = _astar(graph, start_id, goal_id, bidirectional, use_landmarks, stats, start_neighbors)
+    METRICS.add(astar_nodes_expanded=stats["expanded"], astar_edges_relaxed=stats["relaxed"],
+                astar_heap_pushes=stats["pushed"])
+    return path
+
+
+def _astar(graph, start_id, goal_id, bidirectional, use_landmarks, stats, start_neighbors):
+    virtual = start_neighbors is not None
+    if (start_id not in graph.users and not virtual) or goal_id not in graph.users:
+        return None
+    if start_id == goal_id:
+        return [start_id]
+    # Khác thành phần liên thông -> chắc chắn không có đường, khỏi tìm
+    comps = graph.components()
+    if virtual:
+        if not any(comps.same(n, goal_id) for n in start_neighbors):
+            return None
+    elif not comps.same(start_id, goal_id):
+        return None
+    if bidirectional:
+        return _bidirectional_search(graph, start_id, goal_id, stats, start_neighbors)
+
+    landmarks = graph.landmarks() if use_landmarks else graph._landmarks if use_landmarks is None else None
+    h = landmarks.heuristic_to(goal_id) if landmarks is not None else (lambda v: 0)
+    adj = _VirtualStartAdj(graph.adj_list, start_id, start_neighbors) if virtual else graph.adj_list
+    users = graph.users
+    g_cost = {start_id: 0}
+    parent = {start_id: None}
+    open_set = [(0 if virtual else h(start_id), 0, start_id)]
+    closed = set()
+    stats["pushed"] = 1
+    while open_set:
+        stats["peak_open"] = max(stats["peak_open"], len(open_set))
+        f, neg_g, curr = heapq.heappop(open_set)
+        if curr in closed:
+            continue
+        if curr == goal_id:
+            stats["stored"] = len(parent)
+            return _build_path(parent, curr)
+        closed.add(curr)
+        stats["expanded"] += 1
+        ng = -neg_g + 1
+        for n in adj.get(curr, []):
+            stats["relaxed"] += 1
+            if n in users and n not in closed and ng < g_cost.get(n, _INF):
+                hn = h(n)
+                if hn == _INF:
+                    continue
+                g_cost[n] = ng
+                parent[n] = curr
+                # Hoà f thì ưu tiên nút sâu hơn (gần goal hơn)
+                heapq.heappush(open_set, (ng + hn, -ng, n))
+                stats["pushed"] += 1
+    stats["stored"] = len(parent)
+    return None
+
+
+@METRICS.timed("recommend")
+def recommend(graph, user, k=30, with_path=True, lsh=None):
+    """Gợi ý cho `user` KHÔNG sửa graph (an toàn khi nhiều luồng truy vấn cùng graph).
+
+    Thay cho add_new_user: candidate/strong neighbors lấy từ chỉ mục ngược, điểm từ
+    score_all, đường đi A* xuất phát từ nút ảo có cạnh tới các candidate.
+    Khác main(): chấm MỌI user trong graph (main chỉ xét user BFS/DFS tới được từ user mới), điểm bằng
+    nhau xếp theo thứ tự dòng (main: theo thứ tự duyệt). Khi user mới nối vào thành phần lớn (như
+    user.xlsx) dãy điểm top-k giống hệt, chỉ khác những user đồng điểm ở ngưỡng cắt.
+    lsh: InterestLSH (graph.lsh_index()) - chỉ chấm các dòng nó trả về thay vì toàn bộ quần thể
+    (nhanh hơn, có thể bỏ sót user điểm cao không trùng sở thích).
+    Trả về dict: results [(user, điểm, tập id bạn chung)], path (list id hoặc None).
+    """
+    if user.id in graph.users:
+        raise ValueError(f"user {user.id} đã có trong graph")
+    graph._encode_user(user, register=False)
+    candidates = graph.candidate_ids(user)
+    strong = graph.strong_neighbor_ids(user)
+    top = graph.top_k(user, k, proxy_friends=strong, rows=None if lsh is None else lsh.candidates(user))
+    common = graph.common_friend_ids_batch(user.id, [u.id for u, _ in top], proxy_friends=strong)
+    path = None
+    if with_path and top:
+        path = run_astar(graph, user.id, top[0][0].id, start_neighbors=candidates)
+    return {"results": [(u, s, common[u.id]) for u, s in top], "path": path}
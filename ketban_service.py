@@ -0,0 +1,337 @@
+"""Dịch vụ gợi ý kết bạn chạy thường trú.
+
+Nạp dữ liệu + dựng SocialGraph 1 lần, sau đó nhận hồ sơ JSON qua HTTP (localhost).
+Mỗi truy vấn dùng ketban.recommend(): KHÔNG gọi add_new_user nên không sửa graph dùng chung;
+các request được xử lý song song trong 1 pool luồng cố định. Candidate là toàn bộ quần thể, điểm bằng nhau
+xếp theo thứ tự dòng - khác ketban.py (chỉ user BFS/DFS tới được, đồng điểm theo thứ tự duyệt), xem
+docstring của ketban.recommend.
+
+Nhật ký sự kiện (ketban_events.py) được đọc tiếp mỗi --events-interval giây: sự kiện mới được áp dụng
+tăng dần lên graph (thêm 1 user chỉ tốn theo số hàng xóm, không nạp lại dữ liệu) trong lúc tạm dừng
+các request đang chờ.
+
+    python ketban_service.py --data E:\\ttnt --port 8765 --workers 8
+
+POST /recommend   {"name": "...", "dob": "...", "gender": "...", "location": "HN",
+                   "industry": "IT", "interests": "Yoga; Đọc sách", "marital": "...", "k": 30}
+                  (nhận cả tên cột Excel: "Họ và tên", "Nơi ở", ...)
+GET  /users/<id>/recommendations   gợi ý cho user có sẵn: đọc từ bảng tính trước (--topk-table, xem ketban_topk.py)
+                  khi bảng khớp dữ liệu hiện tại, ngược lại (bảng cũ/dở dang, đã có sự kiện mới, user mới)
+                  chấm trực tiếp bằng graph.top_k, cùng quy tắc với bảng (bỏ bạn bè hiện có)
+GET  /health      số user, số request đã phục vụ, thống kê cache chuẩn hoá
+GET  /metrics     ketban.METRICS dạng Prometheus text (?format=json: JSON); cần --metrics
+
+--lsh 16x3: chỉ chấm điểm các candidate của InterestLSH (nhanh hơn, recall < 100%).
+"""
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import unquote
+
+import ketban
+
+
+def handle_profile(graph, profile, lsh=None):
+    """Xử lý 1 hồ sơ -> dict JSON (top-k + đường đi A* tới top-1)."""
+    k = int(profile.get("k", 30))
+    me = ketban.user_from_profile(profile)
+    rec = ketban.recommend(graph, me, k=k, lsh=lsh)
+    users = graph.users
+    results = [
+        ketban.user_to_dict(u, s, [users[c].name for c in common if c in users])
+        for u, s, common in rec["results"]
+    ]
+    path = None
+    if rec["path"]:
+        path = [{"id": p, "name": users[p].name if p in users else me.name} for p in rec["path"]]
+    return {"results": results, "path": path}
+
+
+class _ReadWriteLock:
+    """Nhiều request đọc graph song song; áp dụng sự kiện cần độc quyền (bên ghi được ưu tiên)."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "ketban/1.0"
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            self._send_metrics()
+            return
+        if self.path.startswith("/users/") and self.path.endswith("/recommendations"):
+            self._send_precomputed(unquote(self.path[len("/users/"):-len("/recommendations")]))
+            return
+        if self.path != "/health":
+            self._send(404, {"error": "not found"})
+            return
+        with self.server.graph_lock.read():
+            users = len(self.server.graph.users)
+        self._send(200, {
+            "users": users,
+            "served": self.server.served,
+            "events_applied": self.server.events_applied,
+            "workers": self.server.workers,
+            "normalize_cache": ketban.NORMALIZE_CACHE.stats(),
+        })
+
+    def _send_precomputed(self, uid):
+        server = self.server
+        graph = server.graph
+        with server.graph_lock.read():
+            users = graph.users
+            if uid not in users:
+                self._send(404, {"error": f"không có user id {uid}"})
+                return
+            recs = server.topk_table.lookup(uid) if server.topk_current else None
+            if recs is None:
+                recs = live_top_k(graph, users[uid], server.topk_k)
+            results = [
+                ketban.user_to_dict(users[v], s, [users[c].name for c in graph.common_friend_ids(uid, v)
+                                                  if c in users])
+                for v, s in recs if v in users
+            ]
+        server.count_served()
+        self._send(200, {"results": results})
+
+    def _send_metrics(self):
+        if not ketban.METRICS.enabled:
+            self._send(404, {"error": "chưa bật đo đạc (--metrics)"})
+            return
+        if self.path.endswith("format=json"):
+            self._send(200, ketban.METRICS.snapshot())
+            return
+        data = ketban.METRICS.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path != "/recommend":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            profile = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(profile, dict):
+                raise ValueError("body phải là 1 object JSON")
+        except ValueError as e:
+            self._send(400, {"error": f"JSON không hợp lệ: {e}"})
+            return
+        start = time.perf_counter()
+        try:
+            with self.server.graph_lock.read():
+                body = handle_profile(self.server.graph, profile, self.server.lsh)
+        except (TypeError, ValueError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        body["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        self.server.count_served()
+        self._send(200, body)
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+
+class RecommendationServer(HTTPServer):
+    """HTTPServer xử lý request trong ThreadPoolExecutor kích thước cố định."""
+
+    request_queue_size = 128
+
+    def __init__(self, address, graph, workers=8, verbose=False, lsh=None, topk_table=None, event_log=None,
+                 events_interval=2.0):
+        super().__init__(address, _Handler)
+        self.graph = graph
+        self.lsh = lsh
+        self.topk_table = topk_table
+        # bảng chỉ dùng được khi tính từ đúng dữ liệu hiện tại; sự kiện mới làm bảng cũ đi
+        self.topk_current = topk_table is not None and topk_table.is_current(graph)
+        self.topk_k = topk_table.meta["k"] if topk_table is not None else 30
+        self.workers = workers
+        self.verbose = verbose
+        self.served = 0
+        self.events_applied = 0
+        self.graph_lock = _ReadWriteLock()
+        self._served_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ketban")
+        self.event_log = event_log
+        self._stop = threading.Event()
+        self._tail = None
+        if event_log is not None and events_interval > 0:
+            self._tail = threading.Thread(target=self._tail_events, args=(events_interval,), daemon=True,
+                                          name="ketban-events")
+            self._tail.start()
+
+    def poll_events(self):
+        """Áp dụng các sự kiện mới của nhật ký lên graph; trả về số sự kiện đã áp dụng."""
+        with self.graph_lock.write():
+            applied = ketban.replay_events(self.graph, self.event_log)
+            if applied:
+                self.topk_current = False
+                warm_graph(self.graph)
+        self.events_applied += applied
+        if applied and self.verbose:
+            print(f"--- Đã áp dụng {applied} sự kiện mới ---", flush=True)
+        return applied
+
+    def _tail_events(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.poll_events()
+            except Exception as e:  # giữ luồng đọc nhật ký sống, thử lại ở lượt sau
+                print(f"Lỗi khi áp dụng sự kiện: {type(e).__name__}: {e}", flush=True)
+
+    def count_served(self):
+        with self._served_lock:
+            self.served += 1
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        self._stop.set()
+        if self._tail is not None:
+            self._tail.join()
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+def live_top_k(graph, user, k=30):
+    """[(id, điểm)] top-k cho user đã có trong graph, bỏ chính user và bạn bè hiện có (như ketban_topk)."""
+    friends = graph.friend_adj.get(user.id, ())
+    return [(u.id, s) for u, s in graph.top_k(user, k + len(friends)) if u.id not in friends][:k]
+
+
+def warm_graph(graph):
+    """Dựng sẵn mọi cấu trúc lười (để truy vấn chỉ còn đọc)."""
+    graph.friend_matrix()
+    graph.reverse_adj()
+    graph.landmarks()
+    graph.components()
+
+
+def build_graph(folder_path, compact=False, log=None):
+    """Nạp dữ liệu + nhật ký sự kiện (log: EventLog để đọc tiếp về sau), dựng graph và warm_graph."""
+    users, l_m, b_r, i_g = ketban.load_users(folder_path)
+    if users is None:
+        return None
+    graph = ketban.SocialGraph(users, l_m, b_r, i_g, compact=compact)
+    ketban.load_events(graph, folder_path, log)
+    warm_graph(graph)
+    return graph
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data", default=r"E:\ttnt", help="thư mục chứa file .xlsx và ketban.json")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--verbose", action="store_true")
+    ap.add_argument("--metrics", action="store_true", help="bật ketban.METRICS và GET /metrics")
+    ap.add_argument("--compact", action="store_true", help="danh sách kề dạng CSR (ít bộ nhớ hơn)")
+    ap.add_argument("--fuzzy", action="store_true", help="chuẩn hoá chịu lỗi gõ (như KETBAN_FUZZY=1)")
+    ap.add_argument("--lsh", help="BANDSxROWS, vd. 16x3: dùng InterestLSH để lọc candidate")
+    ap.add_argument("--lsh-tokens", default="interest", help="interest,industry,location")
+    ap.add_argument("--lsh-max-candidates", type=int, default=None)
+    ap.add_argument("--topk-table", help="thư mục bảng gợi ý tính trước (ketban_topk.py build)")
+    ap.add_argument("--events-interval", type=float, default=2.0,
+                    help="số giây giữa 2 lần đọc sự kiện mới của nhật ký (0 = chỉ đọc lúc khởi động)")
+    args = ap.parse_args()
+
+    if args.metrics:
+        ketban.METRICS.enabled = True
+    if args.fuzzy:
+        ketban.FUZZY_NORMALIZE = True
+
+    event_log = ketban.EventLog(os.path.join(args.data, ketban.EVENTS_FILENAME))
+    graph = build_graph(args.data, args.compact, event_log)
+    if graph is None:
+        return
+    lsh = None
+    if args.lsh:
+        bands, rows = (int(x) for x in args.lsh.lower().split("x"))
+        lsh = graph.lsh_index(bands, rows, tuple(args.lsh_tokens.split(",")))
+        lsh.max_candidates = args.lsh_max_candidates
+    topk_table = None
+    if args.topk_table:
+        import ketban_topk
+        topk_table = ketban_topk.TopKTable(args.topk_table)
+    server = RecommendationServer((args.host, args.port), graph, args.workers, args.verbose, lsh, topk_table,
+                                  event_log, args.events_interval)
+    if topk_table is not None and not server.topk_current:
+        print("--- Bảng gợi ý tính trước cũ hoặc chưa xong: /users/<id>/recommendations sẽ chấm trực tiếp; "
+              "nên chạy lại ketban_topk.py build ---")
+    print(f"--- Đang phục vụ {len(graph.users)} người dùng tại http://{args.host}:{server.server_port} ---",
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
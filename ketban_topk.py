@@ -0,0 +1,257 @@
+"""Bảng gợi ý tính trước cho mọi user hiện có.
+
+Tính top-k của từng user trong graph (cùng quy tắc calculate_score / common_friend_ids như
+SocialGraph.top_k, bỏ chính user đó và - mặc định - những người đã là bạn), chấm theo khối bằng
+GraphArrays.top_k_rows. Các dòng được chia thành lô cho 1 pool tiến trình; worker gắn vào các mảng
+của graph trong shared memory (như ketban_batch.py) và ghi thẳng lô của mình vào file .npy ánh xạ
+bộ nhớ, tiến trình chính chỉ đánh dấu lô đã xong.
+
+Thư mục kết quả:
+    meta.json     dấu vân tay dữ liệu + tham số (k, exclude_friends, chunk_rows)
+    ids.json      id user theo dòng
+    rows.npy      int32 (n, k): dòng của các user được gợi ý, thiếu thì -1
+    scores.npy    int16 (n, k): điểm tương ứng, thiếu thì 0
+    done.npy      bool theo lô: chạy lại cùng lệnh sẽ tiếp tục từ các lô chưa xong;
+                  dữ liệu hoặc tham số đổi thì tính lại từ đầu
+
+Tra cứu (TopKTable) chỉ là 1 dict id -> dòng + đọc 1 dòng của rows/scores (mmap): O(1) mỗi user.
+
+    python ketban_topk.py build E:\\ttnt\\topk --data E:\\ttnt --workers 8
+    python ketban_topk.py lookup E:\\ttnt\\topk 123
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import ketban
+from ketban_batch import SharedArrays
+
+META_FILENAME = "meta.json"
+IDS_FILENAME = "ids.json"
+
+
+def _ranked(mapping):
+    """Các code của mapping (tên -> code) xếp theo tên."""
+    return [mapping[name] for name in sorted(mapping)]
+
+
+def _canonical_arrays(graph, ga):
+    """Các mảng của ga với mọi code/bit/cột đánh số lại theo tên (id), để cùng dữ liệu cho cùng nội dung
+    ở mọi tiến trình: thứ tự code phụ thuộc thứ tự duyệt set (hash ngẫu nhiên theo tiến trình)."""
+    codes = ga.codes
+    out = {}
+    for name in ("loc", "ind", "grp"):
+        order = [0] + _ranked(getattr(codes, name))
+        recode = np.zeros(max(order) + 1, dtype=np.int32)
+        recode[order] = np.arange(len(order))
+        out[name] = recode[getattr(ga, name)]
+        if name == "loc":
+            out["loc_bonus"] = codes.loc_bonus[np.ix_(order, order)]
+    n = len(ga.loc)
+    bits = np.unpackbits(ga.imask.view(np.uint8).reshape(n, -1), axis=1, bitorder="little")
+    out["imask"] = np.packbits(bits[:, _ranked(codes.interest_bits)], axis=1, bitorder="little")
+    col_ids = graph.friend_matrix().col_ids
+    rank = np.empty(len(col_ids) + 1, dtype=np.int64)
+    rank[np.argsort(np.array(col_ids, dtype=object), kind="stable")] = np.arange(len(col_ids))
+    rank[-1] = -1   # row_col = -1: user không có cột
+    entry_rows = np.repeat(np.arange(n), np.diff(ga.indptr))
+    cols = rank[ga.indices]
+    out["friends"] = np.stack([entry_rows, cols])[:, np.lexsort((cols, entry_rows))]
+    out["row_col"] = rank[ga.row_col]
+    return out
+
+
+def fingerprint(graph, ga, k, exclude_friends):
+    """sha1 của mọi thứ quyết định nội dung bảng: đặc trưng + bạn bè (dạng chuẩn), bảng điểm, thứ tự id, k."""
+    h = hashlib.sha1()
+    for name, arr in sorted(_canonical_arrays(graph, ga).items()):
+        arr = np.ascontiguousarray(arr)
+        h.update(f"{name}:{arr.dtype.str}:{arr.shape}".encode())
+        h.update(arr.data)
+    interest_names = sorted(ga.codes.interest_bits, key=ga.codes.interest_bits.get)
+    groups = [sorted(name for bit, name in enumerate(interest_names) if gmask >> bit & 1)
+              for gmask in ga.codes.group_interest_masks]
+    h.update(json.dumps([groups, list(graph.row_ids()), k, exclude_friends], ensure_ascii=False).encode())
+    return h.hexdigest()
+
+
+class TopKTable:
+    """Bảng top-k đã tính (chỉ đọc, mmap). lookup(uid) -> [(id, điểm)] theo thứ tự gợi ý."""
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, META_FILENAME), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(folder, IDS_FILENAME), encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self.rows = np.load(os.path.join(folder, "rows.npy"), mmap_mode="r")
+        self.scores = np.load(os.path.join(folder, "scores.npy"), mmap_mode="r")
+        self.done = np.load(os.path.join(folder, "done.npy"))
+        self._row_of = {uid: i for i, uid in enumerate(self.ids)}
+
+    @property
+    def complete(self):
+        return bool(self.done.all())
+
+    def is_current(self, graph):
+        """Bảng có được tính từ đúng dữ liệu hiện tại của graph (và đã xong) không."""
+        fp = fingerprint(graph, ketban.GraphArrays.from_graph(graph), self.meta["k"], self.meta["exclude_friends"])
+        return self.complete and fp == self.meta["fingerprint"]
+
+    def __contains__(self, uid):
+        return uid in self._row_of
+
+    def lookup(self, uid):
+        """Gợi ý của user uid; None nếu uid không có trong bảng hoặc lô chứa uid chưa tính xong."""
+        row = self._row_of.get(uid)
+        if row is None or not self.done[row // self.meta["chunk_rows"]]:
+            return None
+        return [(self.ids[r], int(s)) for r, s in zip(self.rows[row].tolist(), self.scores[row].tolist()) if r >= 0]
+
+
+# ---- Phía worker ----
+
+_WORKER = {}
+
+
+def _open_outputs(folder, mode):
+    return (np.load(os.path.join(folder, "rows.npy"), mmap_mode=mode),
+            np.load(os.path.join(folder, "scores.npy"), mmap_mode=mode))
+
+
+def _init_worker(spec, codes, folder):
+    shared = SharedArrays.attach(spec)
+    _WORKER["shared"] = shared
+    _WORKER["arrays"] = ketban.GraphArrays(shared.arrays, codes)
+    _WORKER["outputs"] = _open_outputs(folder, "r+")
+
+
+def _compute_chunk(chunk, chunk_rows, n, k, exclude_friends, arrays=None, outputs=None):
+    """Tính và ghi lô thứ `chunk` vào rows/scores; trả về chỉ số lô."""
+    arrays = arrays or _WORKER["arrays"]
+    rows_out, scores_out = outputs or _WORKER["outputs"]
+    start, stop = chunk * chunk_rows, min(n, (chunk + 1) * chunk_rows)
+    top, top_scores = arrays.top_k_rows(np.arange(start, stop), k, exclude_friends)
+    rows_out[start:stop] = top
+    scores_out[start:stop] = top_scores
+    rows_out.flush()
+    scores_out.flush()
+    return chunk
+
+
+def _compute_task(args):
+    return _compute_chunk(*args)
+
+
+# ---- Phía tiến trình chính ----
+
+def _prepare(folder, meta, ids, k):
+    """Mở bảng dở dang cùng dấu vân tay, hoặc tạo bảng mới. Trả về mảng done (mmap)."""
+    meta_path = os.path.join(folder, META_FILENAME)
+    done_path = os.path.join(folder, "done.npy")
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            if json.load(f) == meta:
+                return np.load(done_path, mmap_mode="r+")
+    except (OSError, ValueError):
+        pass
+    os.makedirs(folder, exist_ok=True)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    n = len(ids)
+    open_memmap = np.lib.format.open_memmap
+    rows = open_memmap(os.path.join(folder, "rows.npy"), mode="w+", dtype=np.int32, shape=(n, k))
+    rows[:] = -1
+    rows.flush()
+    open_memmap(os.path.join(folder, "scores.npy"), mode="w+", dtype=np.int16, shape=(n, k)).flush()
+    done = open_memmap(done_path, mode="w+", dtype=bool, shape=(-(-n // meta["chunk_rows"]),))
+    done.flush()
+    with open(os.path.join(folder, IDS_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(ids, f, ensure_ascii=False)
+    # meta ghi sau cùng: bị ngắt giữa chừng thì lần sau tạo lại bảng
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return done
+
+
+def build_table(graph, folder, k=30, exclude_friends=True, workers=None, chunk_rows=1024):
+    """Tính (tiếp) bảng top-k cho mọi user của graph vào folder. Trả về (số lô đã tính lần này, tổng số lô).
+
+    workers=0: chạy ngay trong tiến trình này (không pool, không shared memory).
+    """
+    ga = ketban.GraphArrays.from_graph(graph)
+    ids = list(graph.row_ids())
+    n = len(ids)
+    meta = {"fingerprint": fingerprint(graph, ga, k, exclude_friends), "n": n, "k": k,
+            "exclude_friends": exclude_friends, "chunk_rows": chunk_rows}
+    done = _prepare(folder, meta, ids, k)
+    todo = np.flatnonzero(~done).tolist()
+    if not todo:
+        return 0, len(done)
+
+    shared = pool = None
+    if workers == 0:
+        outputs = _open_outputs(folder, "r+")
+        finished = (_compute_chunk(c, chunk_rows, n, k, exclude_friends, ga, outputs) for c in todo)
+    else:
+        shared = SharedArrays.create(ga.arrays)
+        pool = Pool(workers or os.cpu_count(), initializer=_init_worker, initargs=(shared.spec, ga.codes, folder))
+        finished = pool.imap_unordered(_compute_task, ((c, chunk_rows, n, k, exclude_friends) for c in todo))
+    try:
+        for chunk in finished:
+            done[chunk] = True
+            done.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()   # đã nhận đủ kết quả, hoặc bị ngắt: lô đang tính dở sẽ tính lại lần sau
+            pool.join()
+        if shared is not None:
+            shared.close(unlink=True)
+    return len(todo), len(done)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build", help="tính (tiếp) bảng top-k cho mọi user")
+    p.add_argument("out", help="thư mục kết quả")
+    p.add_argument("--data", default=r"E:\ttnt", help="thư mục chứa file .xlsx và ketban.json")
+    p.add_argument("--workers", type=int, default=None, help="số tiến trình (mặc định: số CPU; 0 = không dùng pool)")
+    p.add_argument("--k", type=int, default=30)
+    p.add_argument("--chunk-rows", type=int, default=1024, help="số user mỗi lô (đơn vị tiếp tục khi chạy lại)")
+    p.add_argument("--include-friends", action="store_true", help="không bỏ những người đã là bạn")
+    p.add_argument("--compact", action="store_true", help="danh sách kề dạng CSR (ít bộ nhớ hơn)")
+    p.add_argument("--fuzzy", action="store_true", help="chuẩn hoá chịu lỗi gõ (như KETBAN_FUZZY=1)")
+    p = sub.add_parser("lookup", help="in gợi ý đã tính của 1 user")
+    p.add_argument("out", help="thư mục kết quả")
+    p.add_argument("id")
+    args = ap.parse_args()
+
+    if args.cmd == "lookup":
+        recs = TopKTable(args.out).lookup(args.id)
+        if recs is None:
+            print(f"--- Không có gợi ý đã tính cho id {args.id} ---")
+            return
+        for i, (uid, score) in enumerate(recs, 1):
+            print(f"{i:>3}. {uid}  (điểm {score})")
+        return
+
+    if args.fuzzy:
+        ketban.FUZZY_NORMALIZE = True
+    users, l_m, b_r, i_g = ketban.load_users(args.data)
+    if users is None:
+        return
+    graph = ketban.SocialGraph(users, l_m, b_r, i_g, compact=args.compact)
+    ketban.load_events(graph, args.data)
+    start = time.perf_counter()
+    computed, total = build_table(graph, args.out, args.k, not args.include_friends, args.workers, args.chunk_rows)
+    elapsed = time.perf_counter() - start
+    print(f"--- Đã tính {computed}/{total} lô ({len(graph.users)} người dùng) trong {elapsed:.2f}s -> {args.out} ---")
+
+
+if __name__ == "__main__":
+    main()
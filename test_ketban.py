@@ -0,0 +1,537 @@
+"""Kiểm thử ketban.py: python -m pytest -q"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+import ketban
+import ketban_graph
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(HERE, "ketban.json"), encoding="utf-8") as _f:
+    LOC_MAP = json.load(_f)["locations"]
+
+# Các cặp tỉnh khác nhau nằm trong bán kính so khớp gần đúng của nhau
+CLOSE_PROVINCES = [
+    ("An Giang", "Hà Giang"), ("An Giang", "Hậu Giang"), ("An Giang", "Bắc Giang"), ("Hậu Giang", "Hà Giang"),
+    ("Bắc Giang", "Hà Giang"), ("Tiền Giang", "Kiên Giang"), ("Tây Ninh", "Bắc Ninh"),
+    ("Bình Phước", "Vĩnh Phúc"), ("Bình Thuận", "Ninh Thuận"), ("Đắk Nông", "Đà Nẵng"),
+    ("Khánh Hòa", "Thanh Hóa"), ("Ninh Bình", "Bình Định"), ("Quảng Ngãi", "Quảng Nam"),
+    ("Quảng Bình", "Quảng Ninh"), ("Hải Phòng", "Hải Dương"),
+]
+
+
+@pytest.mark.parametrize("a, b, limit, expected", [
+    ("", "", None, 0),
+    ("abc", "abc", None, 0),
+    ("abc", "abd", None, 1),
+    ("abc", "ab", None, 1),
+    ("kitten", "sitting", None, 3),
+    ("kitten", "sitting", 1, 2),    # vượt limit: trả về limit + 1
+    ("a", "abcdef", 2, 3),          # lệch độ dài > limit
+])
+def test_edit_distance(a, b, limit, expected):
+    assert ketban._edit_distance(a, b, limit) == expected
+    assert ketban._edit_distance(b, a, limit) == expected
+
+
+def test_fuzzy_index_typo_and_exact():
+    index = ketban.FuzzyIndex([("chay bo", "Chạy bộ"), ("doc sach", "Đọc sách")])
+    assert index.lookup("doc sach") == "Đọc sách"
+    assert index.lookup("doc sacg") == "Đọc sách"
+    assert index.lookup("chay bo") == "Chạy bộ"
+    assert index.lookup("xyz") is None   # key ngắn: chỉ khớp chính xác
+
+
+def test_fuzzy_index_refuses_ambiguous_match():
+    index = ketban.FuzzyIndex([("ke toan", "Kế toán"), ("kiem toan", "Kiểm toán")])
+    assert index.lookup("ke toan") == "Kế toán"
+    assert index.lookup("kiem toan") == "Kiểm toán"
+    # cách "kiem toan" 1 và "ke toan" 2: không đủ cách biệt để chọn
+    assert index.lookup("kem toan") is None
+
+
+def test_fuzzy_is_opt_in():
+    normalizer = ketban.DataNormalizer(known_locations=["An Giang"])
+    assert not normalizer.fuzzy
+    assert normalizer.normalize_location("An Giamg") == "An Giamg"
+
+
+@pytest.mark.parametrize("known, other", CLOSE_PROVINCES + [(b, a) for a, b in CLOSE_PROVINCES])
+def test_fuzzy_never_merges_provinces(known, other):
+    normalizer = ketban.DataNormalizer(known_locations=[known], fuzzy=True, valid_locations=LOC_MAP)
+    assert normalizer.normalize_location(other) == other
+    assert normalizer.normalize_location(known) == known
+
+
+def test_fuzzy_fixes_location_typo():
+    normalizer = ketban.DataNormalizer(known_locations=["Đồng Nai"], fuzzy=True, valid_locations=LOC_MAP)
+    assert normalizer.normalize_location("Dong Nao") == "Đồng Nai"
+    assert normalizer.normalize_location("Lao Caii") == "Lào Cai"   # tên hợp lệ cũng là đích sửa lỗi
+    # gần Hà Giang (1) nhưng cũng gần Hậu Giang (2): không đoán
+    assert normalizer.normalize_location("Ha Giamg") == "Ha Giamg"
+
+
+def test_fuzzy_keeps_ke_toan_and_kiem_toan_apart():
+    normalizer = ketban.DataNormalizer(fuzzy=True)
+    assert normalizer.normalize_industry_child("Kế toán") == "Kế toán"
+    assert normalizer.normalize_industry_child("Kiểm toán") == "Kiểm toán"
+    assert normalizer.normalize_industry_child("Kem toan") == "Kem Toan"
+
+
+def _codes():
+    with open(os.path.join(HERE, "ketban.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    return ketban._FeatureCodes({}, config["locations"], config["bonus_config"])
+
+
+@pytest.mark.parametrize("a, b", [("Cà Mau", "Lâm Đồng"), ("Cà Mau", "Đà Lạt"), ("Kiên Giang", "Đắk Nông")])
+def test_same_km_is_not_same_location(a, b):
+    codes = _codes()
+    same = codes.loc_bonus[codes.loc[a], codes.loc[a]]
+    assert codes.loc_bonus[codes.loc[a], codes.loc[b]] < same
+    assert codes.loc_bonus_rows[codes.loc[b]][codes.loc[a]] < same
+
+
+def test_new_location_only_matches_itself():
+    codes = _codes()
+    c = codes.code(codes.loc, "Nơi Mới")
+    codes._add_loc_bonus(c)
+    assert codes.loc_bonus[c, c] == codes.loc_tiers[0][1]
+    assert codes.loc_bonus[c, codes.loc["Cà Mau"]] == 0
+
+
+def _frame(rows):
+    import pandas as pd
+    columns = ['Số thứ tự', 'Họ và tên', 'Ngày sinh', 'Giới tính', 'Nơi ở', 'Sở thích', 'Bạn chung (ID)']
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def test_chunked_load_normalizes_against_all_known_locations():
+    # cùng key chuẩn hoá: nơi ở gặp sau thắng, kể cả với user của phần trước
+    rows = [(1, "An", "-", "Nam", "đà nẵng", "Yoga", ""), (2, "Bình", "-", "Nữ", "Đà Nẵng", "Yoga", "1")]
+    whole, _ = ketban._users_from_chunks([_frame(rows)])
+    chunked, _ = ketban._users_from_chunks([_frame(rows[:1]), _frame(rows[1:])])
+    assert [u.location for u in whole] == ["Đà Nẵng", "Đà Nẵng"]
+    assert [u.location for u in chunked] == [u.location for u in whole]
+
+
+def test_missing_data_reports_folder(tmp_path, capsys):
+    users, *_ = ketban.load_users(str(tmp_path))
+    assert users is None
+    assert str(tmp_path) in capsys.readouterr().out
+
+
+@pytest.fixture(scope="session")
+def data_dir(tmp_path_factory):
+    """Bản sao user.xlsx + ketban.json: snapshot được ghi ở đây, không vào thư mục mã nguồn."""
+    folder = tmp_path_factory.mktemp("data")
+    for name in ("user.xlsx", "ketban.json"):
+        shutil.copy(os.path.join(HERE, name), folder / name)
+    return str(folder)
+
+
+@pytest.fixture
+def graph(data_dir):
+    users, l_m, b_r, i_g = ketban.load_users(data_dir)
+    return ketban.SocialGraph(users, l_m, b_r, i_g)
+
+
+@pytest.fixture(scope="session")
+def shared_graph(data_dir):
+    """Graph dùng chung cho các test chỉ đọc (không được sửa)."""
+    users, l_m, b_r, i_g = ketban.load_users(data_dir)
+    return ketban.SocialGraph(users, l_m, b_r, i_g)
+
+
+def test_add_user_on_existing_id_is_rejected(graph):
+    uid = next(iter(graph.users))
+    friends = set(graph.friend_adj[uid])
+    with pytest.raises(ValueError):
+        ketban.apply_event(graph, {"op": "add_user", "id": uid, "profile": {"name": "Khác"}})
+    assert graph.friend_adj[uid] == friends
+
+
+def test_event_log_reads_on_after_compaction(tmp_path):
+    path = str(tmp_path / ketban.EVENTS_FILENAME)
+    writer, reader = ketban.EventLog(path), ketban.EventLog(path)
+    writer.append("add_friend", a="1", b="2")
+    writer.append("add_friend", a="1", b="3")
+    assert len(reader.read_new()) == 2
+    writer.read_new()
+    writer.append("add_friend", a="1", b="4")
+    writer.drop_read()   # như compact_events: chỉ giữ sự kiện chưa gộp
+    assert [e["b"] for e in reader.read_new()] == ["4"]
+
+
+def test_profile_class_rows_are_reused(graph, monkeypatch):
+    classes = graph.profile_classes()
+    rows, n_classes = classes.table.n, classes.n_classes
+    for i in range(5):   # thêm rồi gỡ user có chữ ký mới: dòng của lớp rỗng được dùng lại
+        me = ketban.user_from_profile({"name": "A", "location": f"Nơi Mới {i}", "interests": "Yoga"}, uid="90001")
+        graph.insert_user(me)
+        assert classes.n_classes == n_classes + 1
+        graph.remove_user(me.id)
+    assert classes.table.n == rows + 1
+    assert classes.n_classes == n_classes
+    query = ketban.user_from_profile({"name": "B", "location": "Nơi Mới 4", "interests": "Yoga; Đọc sách"})
+    monkeypatch.setattr(ketban_graph, "PROFILE_CLASS_MIN_MEAN", 0)   # luôn chấm theo lớp
+    scores = graph.score_all(query)
+    t = graph._features
+    expected = ketban._score_rows(t.loc[:t.n], t.ind[:t.n], t.grp[:t.n], t.imask[:t.n], query, None, graph._codes)
+    assert (scores == expected).all()
+
+
+def test_astar_builds_landmarks_only_on_request(graph):
+    ids = list(graph.users)
+    pairs = [(ids[0], ids[i]) for i in (1, 100, 5000)]
+    plain = [ketban.run_astar(graph, a, b) for a, b in pairs]
+    assert graph._landmarks is None   # truy vấn đơn lẻ không dựng landmark
+    alt = [ketban.run_astar(graph, a, b, use_landmarks=True) for a, b in pairs]
+    assert graph._landmarks is not None
+    assert [len(p or ()) for p in plain] == [len(p or ()) for p in alt]
+
+
+def test_metrics_count_scored_users(graph, monkeypatch):
+    start = next(iter(graph.users))
+    monkeypatch.setattr(ketban.METRICS, "enabled", True)
+    ketban.METRICS.reset()
+    found = ketban.run_bfs(graph, start, max_nodes=50)
+    counters = ketban.METRICS.snapshot()["counters"]
+    assert counters["users_scored"] == 50 >= len(found)
+    assert "calculate_score_calls" not in counters
+
+
+@pytest.mark.parametrize("maxsize", [0, 4])
+def test_normalize_cache_counts_every_lookup_across_threads(maxsize):
+    cache = ketban.NormalizeCache(maxsize)
+    def worker():
+        for i in range(2000):
+            cache.get_or_compute(i % 8, lambda: i)
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 8000
+    assert stats["size"] <= maxsize
+
+
+def _profile(u):
+    return (u.id, u.name, u.dob, u.gender, u.location, u.industry, u.industry_group, u.marital,
+            list(u.interests), list(u.friends_ids))
+
+
+def _copy_data(folder):
+    for name in ("user.xlsx", "ketban.json"):
+        shutil.copy(os.path.join(HERE, name), folder / name)
+    return str(folder)
+
+
+def test_snapshot_round_trip_and_invalidation(tmp_path, capsys, monkeypatch):
+    folder = _copy_data(tmp_path)
+    parsed, *config = ketban.load_users(folder)
+    assert os.path.exists(os.path.join(folder, ketban.SNAPSHOT_FILENAME))
+    capsys.readouterr()
+
+    cached, *cached_config = ketban.load_users(folder)
+    assert "snapshot" in capsys.readouterr().out
+    assert cached_config == config
+    assert [_profile(u) for u in cached] == [_profile(u) for u in parsed]
+
+    json_path = os.path.join(folder, "ketban.json")
+    os.utime(json_path, ns=(0, os.stat(json_path).st_mtime_ns + 10**9))   # nguồn đổi
+    ketban.load_users(folder)
+    assert "Đang nạp dữ liệu" in capsys.readouterr().out
+
+    monkeypatch.setattr(ketban, "FUZZY_NORMALIZE", True)   # cấu hình chuẩn hoá đổi
+    ketban.load_users(folder)
+    assert "Đang nạp dữ liệu" in capsys.readouterr().out
+
+
+def test_snapshot_from_older_version_is_rebuilt(tmp_path, capsys, monkeypatch):
+    folder = _copy_data(tmp_path)
+    monkeypatch.setattr(ketban, "SNAPSHOT_VERSION", ketban.SNAPSHOT_VERSION - 1)
+    ketban.load_users(folder)
+    monkeypatch.undo()
+    capsys.readouterr()
+    ketban.load_users(folder)
+    assert "Đang nạp dữ liệu" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("value, expected", [("", False), ("0", False), ("false", False), ("1", True)])
+def test_fuzzy_env_var(value, expected):
+    env = {**os.environ, "KETBAN_FUZZY": value}
+    out = subprocess.run([sys.executable, "-c", "import ketban; print(ketban.FUZZY_NORMALIZE)"],
+                         cwd=HERE, env=env, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == str(expected)
+
+
+def test_load_users_honours_fuzzy_setting(data_dir, monkeypatch):
+    monkeypatch.setattr(ketban, "FUZZY_NORMALIZE", True)
+    ketban.load_users(data_dir)
+    assert ketban.NORMALIZER.fuzzy
+    assert ketban.NORMALIZER.normalize_location("Dong Nao") == "Đồng Nai"
+
+
+def _die(path, chunk_rows, queue):
+    os._exit(9)
+
+
+def test_dead_parse_worker_raises_instead_of_hanging(tmp_path, monkeypatch):
+    rows = [(1, "An", "-", "Nam", "Huế", "Yoga", "")]
+    paths = []
+    for name in ("a.csv", "b.csv"):
+        _frame(rows).to_csv(tmp_path / name, index=False)
+        paths.append(str(tmp_path / name))
+    monkeypatch.setattr(ketban, "_parse_file_worker", _die)
+    monkeypatch.setattr(ketban, "LOAD_WORKER_POLL", 0.05)
+    with pytest.raises(RuntimeError, match="a.csv"):
+        list(ketban.iter_data_chunks(paths, workers=2))
+
+
+def _component_sizes(graph, ids):
+    return [graph.components().size_of(uid) for uid in ids]
+
+
+def test_components_insert_does_not_build_reverse_adj(graph):
+    ids = list(graph.users)[:50]
+    graph.components()
+    me = ketban.user_from_profile({"name": "A", "location": "Huế", "interests": "Yoga"})
+    graph.add_new_user(me)
+    other = ketban.user_from_profile({"name": "B", "location": "Huế", "friends": ids[:3]}, uid="90001")
+    graph.insert_user(other)
+    assert graph._rev_adj is None
+    incremental = _component_sizes(graph, ids + [me.id, other.id])
+    graph._components = None
+    assert incremental == _component_sizes(graph, ids + [me.id, other.id])
+
+
+def _state(folder):
+    users, l_m, b_r, i_g = ketban.load_users(folder)
+    graph = ketban.SocialGraph(users, l_m, b_r, i_g)
+    ketban.load_events(graph, folder)
+    return {uid: ketban._user_state(u) for uid, u in graph.users.items()}
+
+
+def test_compact_keeps_raw_files_and_state(tmp_path):
+    folder = str(tmp_path)
+    _frame([(1, "An", "-", "Nam", "ha noi", "yoga", "2"), (2, "Bình", "-", "Nữ", "Huế", "-", "1")]).to_csv(
+        tmp_path / "a.csv", index=False)
+    _frame([(3, "Chi", "-", "Nữ", "da nang", "doc sach", "")]).to_csv(tmp_path / "b.csv", index=False)
+    shutil.copy(os.path.join(HERE, "ketban.json"), tmp_path / "ketban.json")
+    raw = {name: (tmp_path / name).read_bytes() for name in ("a.csv", "b.csv")}
+    log = ketban.EventLog(str(tmp_path / ketban.EVENTS_FILENAME))
+    log.append("add_user", id="4", profile={"name": "Dũng", "location": "Cần Thơ", "friends": ["3"]})
+    log.append("update_user", id="2", profile={"location": "hcm"})
+    log.append("remove_friend", a="1", b="2")
+    expected = _state(folder)
+
+    assert ketban.compact_events(folder) == 3
+    assert os.path.getsize(log.path) == 0
+    assert {name: (tmp_path / name).read_bytes() for name in raw} == raw
+    assert _state(folder) == expected
+
+    log.append("add_friend", a="1", b="4")   # gộp lần 2: giữ cả các user đã gộp trước đó
+    expected = _state(folder)
+    assert ketban.compact_events(folder) == 1
+    assert _state(folder) == expected
+    assert expected["2"][3] == ketban.user_from_profile({"location": "hcm"}).location
+
+
+def test_add_user_ids_come_from_snapshot(data_dir, monkeypatch):
+    import ketban_events
+    users, *_ = ketban.load_users(data_dir)   # snapshot khớp nguồn
+    log = ketban.EventLog(os.path.join(data_dir, "ids_events.jsonl"))
+    log.append("add_user", id="90005", profile={"name": "A"})
+    monkeypatch.setattr(ketban, "load_users", None)   # không được nạp lại dữ liệu
+    ids = ketban_events._user_ids(data_dir, log)
+    assert ids == {u.id for u in users} | {"90005"}
+    assert ketban_events._next_user_id(ids) == "90006"
+
+
+def _expected_common(graph, uid):
+    mine = graph._proxy_friend_set(uid)
+    return [len(mine & graph._proxy_friend_set(v)) for v in graph.row_ids()]
+
+
+def test_common_friend_counts_match_set_intersection(shared_graph):
+    ids = shared_graph.row_ids()
+    rows = np.arange(0, len(ids), 7)
+    for uid in ids[::3001]:
+        expected = _expected_common(shared_graph, uid)
+        assert shared_graph.common_friend_counts(shared_graph.users[uid]).tolist() == expected
+        counts = shared_graph.common_friend_counts(shared_graph.users[uid], rows=rows)
+        assert counts.tolist() == [expected[r] for r in rows.tolist()]
+
+
+def test_common_friend_counts_follow_incremental_changes(graph):
+    ids = list(graph.users)
+    me = ketban.user_from_profile({"name": "A", "location": "Huế", "interests": "Yoga"})
+    graph.add_new_user(me)
+    graph.add_friendship(ids[0], ids[1])
+    graph.remove_friendship(ids[2], next(iter(graph.friend_adj[ids[2]])))
+    for uid in (me.id, ids[0], ids[1], ids[2]):
+        assert graph.common_friend_counts(graph.users[uid]).tolist() == _expected_common(graph, uid)
+
+
+def test_from_dataframe_matches_from_row(monkeypatch):
+    import pandas as pd
+    df = pd.read_excel(os.path.join(HERE, "user.xlsx")).head(3000)
+    edge = _frame([
+        (3001, float("nan"), None, "nữ", "  hà nội ", "yoga;; Đọc sách ,", 1.0),
+        (3002.0, "-", "", "", float("nan"), "-", "1, x, 2"),
+        (3003, "lê  văn a", "01/01/2000", "NAM", "Da Nang", float("nan"), float("nan")),
+    ])
+    df = pd.concat([df, edge], ignore_index=True)
+    for normalizer in (None, ketban.DataNormalizer(known_locations=df["Nơi ở"].dropna().astype(str).unique(),
+                                                   valid_locations=LOC_MAP)):
+        monkeypatch.setattr(ketban, "NORMALIZER", normalizer)
+        expected = [_profile(ketban.User.from_row(row)) for _, row in df.iterrows()]
+        assert [_profile(u) for u in ketban.User.from_dataframe(df)] == expected
+
+
+def _results(found):
+    return [(r["user"].id, r["score"]) for r in found]
+
+
+def test_compact_graph_traversals_match_dict_graph(data_dir):
+    graphs = []
+    for compact in (False, True):
+        users, l_m, b_r, i_g = ketban.load_users(data_dir)
+        graph = ketban.SocialGraph(users, l_m, b_r, i_g, compact=compact)
+        graph.add_new_user(ketban.user_from_profile({"name": "A", "location": "Huế", "interests": "Yoga; Đọc sách"}))
+        graphs.append(graph)
+    plain, compact = graphs
+    assert isinstance(compact.adj_list, ketban.CSRAdjacency)
+    ids = list(plain.users)
+    for start in ("NEW_USER", ids[0], ids[12345]):
+        assert _results(ketban.run_bfs(compact, start)) == _results(ketban.run_bfs(plain, start))
+        assert _results(ketban.run_dfs(compact, start)) == _results(ketban.run_dfs(plain, start))
+        for goal in (ids[1], ids[-1]):
+            assert ketban.run_astar(compact, start, goal) == ketban.run_astar(plain, start, goal)
+            assert ketban.run_astar(compact, start, goal, bidirectional=True) == \
+                ketban.run_astar(plain, start, goal, bidirectional=True)
+
+
+def test_lsh_candidates_include_exact_top_matches(shared_graph):
+    lsh = shared_graph.lsh_index(32, 1)
+    row_of = shared_graph._features.row_of
+    found = total = 0
+    for uid in shared_graph.row_ids()[::1500]:
+        query = shared_graph.users[uid]
+        candidates = set(lsh.candidates(query).tolist())
+        for v, _ in shared_graph.top_k(query, 10):
+            total += 1
+            found += row_of[v.id] in candidates
+            if query.interests and set(v.interests) == set(query.interests):
+                assert row_of[v.id] in candidates   # trùng hẳn tập sở thích: luôn trùng mọi dải
+    assert found / total >= 0.95
+
+
+def test_lsh_index_follows_inserted_users(graph):
+    lsh = graph.lsh_index(16, 2)
+    profile = {"name": "A", "location": "Huế", "interests": "Yoga; Câu cá; Đọc sách"}
+    graph.insert_user(ketban.user_from_profile(profile, uid="90001"))
+    query = ketban.user_from_profile(profile)
+    graph._encode_user(query, register=False)
+    assert graph._features.row_of["90001"] in lsh.candidates(query).tolist()
+    top = ketban.recommend(graph, query, 5, with_path=False, lsh=lsh)["results"]
+    assert top[0][0].id == "90001"
+
+
+@pytest.fixture(scope="session")
+def small_graph(data_dir):
+    users, l_m, b_r, i_g = ketban.load_users(data_dir)
+    return ketban.SocialGraph(users[:3000], l_m, b_r, i_g)
+
+
+def _live_top_k(graph, uid, k, exclude_friends):
+    friends = graph.friend_adj.get(uid, set()) if exclude_friends else set()
+    top = graph.top_k(graph.users[uid], k + len(friends))
+    return [(v.id, s) for v, s in top if v.id not in friends][:k]
+
+
+@pytest.mark.parametrize("exclude_friends", [True, False])
+def test_top_k_rows_match_top_k(small_graph, exclude_friends):
+    ids = small_graph.row_ids()
+    rows = np.arange(0, len(ids), 37)
+    arrays = ketban.GraphArrays.from_graph(small_graph)
+    top, scores = arrays.top_k_rows(rows, 10, exclude_friends, block=16)
+    for i, r in enumerate(rows.tolist()):
+        got = [(ids[x], s) for x, s in zip(top[i].tolist(), scores[i].tolist()) if x >= 0]
+        assert got == _live_top_k(small_graph, ids[r], 10, exclude_friends)
+
+
+def test_topk_table_matches_top_k(small_graph, tmp_path):
+    import ketban_topk
+    folder = str(tmp_path / "topk")
+    ketban_topk.build_table(small_graph, folder, k=10, workers=0, chunk_rows=512)
+    table = ketban_topk.TopKTable(folder)
+    assert table.complete and table.is_current(small_graph)
+    for uid in small_graph.row_ids()[::53]:
+        assert table.lookup(uid) == _live_top_k(small_graph, uid, 10, True)
+
+
+def test_topk_table_goes_stale_after_change(data_dir, tmp_path):
+    import ketban_topk
+    users, l_m, b_r, i_g = ketban.load_users(data_dir)
+    graph = ketban.SocialGraph(users[:500], l_m, b_r, i_g)
+    folder = str(tmp_path / "topk")
+    ketban_topk.build_table(graph, folder, k=5, workers=0)
+    assert ketban_topk.TopKTable(folder).is_current(graph)
+    a, b = graph.row_ids()[:2]
+    if b in graph.friend_adj.get(a, ()):
+        graph.remove_friendship(a, b)
+    else:
+        graph.add_friendship(a, b)
+    assert not ketban_topk.TopKTable(folder).is_current(graph)
+
+
+def test_calculate_score_matches_score_all(shared_graph):
+    ids = shared_graph.row_ids()
+    for uid in ids[::997]:
+        u = shared_graph.users[uid]
+        scores = shared_graph.score_all(u)
+        for r in range(0, len(ids), 211):
+            v = shared_graph.users[ids[r]]
+            assert shared_graph.calculate_score(u, v) == scores[r], (uid, v.id)
+            assert shared_graph.signature_score(u, v) == shared_graph.signature_score(v, u)
+
+
+def test_feature_vectors_follow_profile_update(graph):
+    a, b = graph.row_ids()[:2]
+    other = graph.users[b]
+    changed = ketban.user_from_profile({"name": "A", "location": other.location, "industry": other.industry,
+                                        "interests": "; ".join(other.interests)}, uid=a)
+    graph.insert_user(changed)
+    u = graph.users[a]
+    assert u.interest_mask == other.interest_mask and u.loc_code == other.loc_code
+    row = graph._features.row_of[b]
+    assert graph.calculate_score(u, other) == graph.score_all(u)[row]
+
+
+def _brute_candidates(graph, user):
+    loc_val = graph.loc_map.get(user.location)
+    return {v.id for v in graph.users.values() if v.id != user.id and (
+        (user.location != "-" and v.location == user.location)
+        or (loc_val is not None and graph.loc_map.get(v.location) == loc_val)
+        or user.interest_mask & v.interest_mask
+        or (user.industry_group != "-" and v.industry_group == user.industry_group))}
+
+
+def test_candidate_ids_match_brute_force(graph):
+    for uid in graph.row_ids()[::2999]:
+        u = graph.users[uid]
+        assert graph.candidate_ids(u) == _brute_candidates(graph, u)
+    me = ketban.user_from_profile({"name": "A", "location": "Hà Nội", "interests": "Yoga"}, uid="90001")
+    graph.add_new_user(me)
+    assert graph.adj_list[me.id] == _brute_candidates(graph, me)
+    assert all(me.id in graph.candidate_ids(graph.users[v]) for v in list(graph.adj_list[me.id])[:50])